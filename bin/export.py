@@ -1,22 +1,38 @@
 #!/usr/bin/env python
 
 from rigor.interop import Exporter
+import rigor.interop
 from rigor.config import RigorDefaultConfiguration
+import rigor.filters
 
 import argparse
 
 def main():
 	parser = argparse.ArgumentParser(description='Exports all data from the database')
 	parser.add_argument('database', help='Database to use')
-	parser.add_argument('filename', help='Metadata filename to create')
+	parser.add_argument('filename', help='Metadata filename to create, or directory with --columnar')
 	parser.add_argument('--config', '-c', help='override default rigor.ini to use')
+	parser.add_argument('--filter', '-f', help='only export percepts matching this filter, e.g. "tag:train & !property:source=synthetic"')
+	parser.add_argument('--json-lines', '-l', action='store_true', default=False, help='write one percept per line (JSON Lines) instead of a single JSON array')
+	parser.add_argument('--columnar', action='store_true', default=False, help='write a directory of NumPy column arrays, for analysis, instead of a metadata file')
+	parser.add_argument('--batch-size', '-b', type=int, default=rigor.interop.kDefaultExportBatchSize, help='number of percepts to read from the database at a time.  Default: {0}'.format(rigor.interop.kDefaultExportBatchSize))
+	parser.add_argument('--incremental', '-i', metavar='WATERMARK', help='only export percepts added or re-annotated since the export that wrote this watermark file, then update it.  If the file does not exist, everything is exported.')
 	args = parser.parse_args()
 	if args.config:
 		config = RigorDefaultConfiguration(args.config)
 	else:
 		config = RigorDefaultConfiguration()
-	exporter = Exporter(config, args.database, args.filename)
-	exporter.run()
+	exporter = Exporter(config, args.database, args.filename, json_lines=args.json_lines, batch_size=args.batch_size, columnar=args.columnar)
+	selection = None
+	if args.filter:
+		selection = rigor.filters.parse(args.filter)
+	since = None
+	if args.incremental:
+		since = rigor.interop.ExportWatermark.load(args.incremental)
+	count = exporter.run(selection=selection, since=since)
+	if args.incremental:
+		exporter.watermark.save(args.incremental)
+	print('Exported {0} percepts'.format(count))
 
 if __name__ == '__main__':
 	main()
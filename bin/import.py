@@ -4,31 +4,36 @@ import rigor.interop
 from rigor.config import RigorDefaultConfiguration
 
 import argparse
-import os 
-import glob
-import json
 
 def main():
 	parser = argparse.ArgumentParser(description='Imports percepts and metadata into the database')
 	parser.add_argument('-c', '--config', type=str, default='~/.rigor.ini', help='Path to .rigor.ini config file.  Default: ~/.rigor.ini')
 	parser.add_argument('-n', '--no-copy', action='store_true', default=False, help="Don't copy data into the Rigor repository; just keep it in place (not recommended)")
+	parser.add_argument('-b', '--batch-size', type=int, default=100, help='Number of percepts to import in each database transaction.  Default: 100')
+	parser.add_argument('-w', '--workers', type=int, default=1, help='Number of threads copying percept data in parallel.  Default: 1')
+	parser.add_argument('-k', '--keep-going', action='store_true', default=False, help="Log percepts that fail to import and continue, instead of stopping at the first failure")
+	parser.add_argument('-z', '--zero-copy', action='store_true', default=False, help="Hard link, clone or copy data within the kernel, where possible, when importing into a local repository.  Hard linked sources must not be modified afterwards.")
+	parser.add_argument('-j', '--journal', help='Record imported percepts in this journal file, and skip percepts it already lists, so an interrupted import can be run again')
+	parser.add_argument('-r', '--repository', help="Store data in a content-addressed repository at this base URL (local path or s3://bucket/prefix), named by hash, instead of at each percept's locator.  Data already in the repository isn't copied again.")
+	parser.add_argument('-s', '--skip-existing', action='store_true', default=False, help="Skip percepts whose locator is already in the database, as when importing incremental exports that overlap")
 	parser.add_argument('database', help='Name of database to use')
-	parser.add_argument('metadata', help='Path to metadata file to import containing one or more percepts, or directory with multiple metadata json files where each contains a single percept')
+	parser.add_argument('metadata', help='Path to metadata file to import containing one or more percepts (as a JSON array, or JSON Lines), or directory with multiple metadata files')
 	args = parser.parse_args()
 
-	# If we are given a directory combine all the json files within into one list to use for import
-	metadata = args.metadata
-	if os.path.isdir(metadata):
-		metadata_paths = glob.glob(os.path.join(metadata, '*.json'))
-		metadata = list()
-		for metadata_path in metadata_paths:
-			with open(metadata_path, "rb") as metadata_file:
-				metadata.append(json.load(metadata_file))
-
 	config = RigorDefaultConfiguration(args.config)
 	copy_data = not args.no_copy
-	i = rigor.interop.Importer(config, args.database, metadata, copy_data)
+	i = rigor.interop.Importer(config, args.database, args.metadata, copy_data, batch_size=args.batch_size, stop_on_error=not args.keep_going, workers=args.workers, repository=args.repository, zero_copy=args.zero_copy, journal=args.journal, skip_existing=args.skip_existing)
 	i.run()
+	if i.failures:
+		print('{0} percepts failed to import'.format(len(i.failures)))
+	if i.skipped:
+		print('{0} percepts were skipped, as the journal shows they were already imported'.format(i.skipped))
+	if i.existing:
+		print('{0} percepts were skipped, as they were already in the database'.format(i.existing))
+	for strategy, count in sorted(i.copy_strategies.items()):
+		print('{0} percepts copied by {1}'.format(count, strategy))
+	if i.deduplicated:
+		print('{0} percepts had data already in the repository'.format(i.deduplicated))
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,27 @@
+"""Add write version
+
+Revision ID: 2b7e5f1c9a04
+Revises: 3c0336c4339d
+Create Date: 2026-10-19 10:12:44.518203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b7e5f1c9a04'
+down_revision = '3c0336c4339d'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import table, column
+
+def upgrade():
+	# Created with the schema, so concurrent writers never race to insert it
+	meta = table('meta', column('key', sa.Text), column('value', sa.Text))
+	exists = sa.exists().where(meta.c.key == op.inline_literal('write_version'))
+	op.execute(meta.insert().from_select(['key', 'value'], sa.select([op.inline_literal('write_version'), op.inline_literal('0')]).where(~exists)))
+
+def downgrade():
+	meta = table('meta', column('key', sa.Text))
+	op.execute(meta.delete().where(meta.c.key == op.inline_literal('write_version')))
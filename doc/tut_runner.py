@@ -10,7 +10,7 @@ class PassthroughAlgorithm(rigor.algorithm.Algorithm):
 class AllPerceptRunner(rigor.runner.DatabaseRunner):
 	def __init__(self, algorithm, config, database):
 		super(AllPerceptRunner, self).__init__(algorithm, config, database_name=database)
-		self._session = self._database.get_session()
+		self._session = self._database.get_session(read_only=True)
 
 	def get_percepts(self):
 		return self._session.query(rigor.types.Percept).order_by(rigor.types.Percept.id).all()
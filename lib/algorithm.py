@@ -3,7 +3,7 @@
 import abc
 import time
 import rigor.logger
-from rigor.perceptops import ImageOps
+from rigor.perceptops import ImageOps, AudioOps, kDefaultAudioBlockSize
 
 class Algorithm(object):
 	"""
@@ -94,6 +94,16 @@ class ImageAlgorithm(Algorithm):
 	"""
 	Abstract base class for running an algorithm against a test percept, specialized for images
 	"""
+
+	#: Cache for decoded images, or :py:const:`None`. If set, images are decoded once and reused when the algorithm sees the same percept again; cached images are read-only. See :py:mod:`rigor.imagecache`.
+	image_cache = None
+
+	#: If set, images are scaled by this factor, between 0 and 1, as they're decoded; see :py:meth:`~rigor.perceptops.ImageOps.decode`. Decoding JPEG images at half size or less is much faster than decoding them at full size.
+	decode_scale = None
+
+	#: If set, images are cropped to this (x, y, width, height) rectangle, in full-size image coordinates, as they're decoded. To crop each percept differently, set it in :py:meth:`prefetch`.
+	decode_roi = None
+
 	def postfetch(self, percept, percept_data):
 		"""
 		This method can be overridden to alter or use the percept's data or metadata once it has been fetched from the data store, but before the algorithm begins running. If you override this method, be sure to call it before your implementation, as this is where OpenCV parses the image.
@@ -107,4 +117,34 @@ class ImageAlgorithm(Algorithm):
 
 			Be sure to return the data when you're done.
 		"""
-		return ImageOps.decode(percept_data)
+		if self.image_cache is None:
+			return ImageOps.decode(percept_data, self.decode_scale, self.decode_roi)
+		key = self.image_cache.key(percept, self.decode_scale, self.decode_roi)
+		return self.image_cache.get_or_load(key, lambda: ImageOps.decode(percept_data, self.decode_scale, self.decode_roi))
+
+class AudioAlgorithm(Algorithm):
+	"""
+	Abstract base class for running an algorithm against a test percept, specialized for audio. The algorithm's :py:meth:`run` method receives a generator of blocks of frames, so long recordings are processed in constant memory; see :py:meth:`~rigor.perceptops.AudioOps.decode_frames`.
+	"""
+
+	#: Number of frames in each block
+	block_size = kDefaultAudioBlockSize
+
+	#: If set, decoding starts at this time, in seconds
+	start_time = None
+
+	#: If set, decoding stops at this time, in seconds
+	end_time = None
+
+	#: Format of raw PCM data without a header, as a :py:class:`~rigor.perceptops.AudioFormat`; if :py:const:`None`, data must be in WAV format
+	raw_format = None
+
+	def postfetch(self, percept, percept_data):
+		"""
+		This method can be overridden to alter or use the percept's data or metadata once it has been fetched from the data store, but before the algorithm begins running. If you override this method, be sure to call it before your implementation, as this is where the audio is decoded.
+
+		:param dict percept: percept metadata
+		:param file percept_data: percept data
+		:return: generator of blocks of frames, each a :py:class:`numpy.ndarray` with a row for each frame and a column for each channel
+		"""
+		return AudioOps.decode_frames(percept_data, self.block_size, self.start_time, self.end_time, self.raw_format)
@@ -0,0 +1,581 @@
+"""
+Columnar (NumPy array) representations of Rigor data, for bulk analysis
+
+Percepts, annotations, and their tags and properties can be exported with :py:func:`export_columns` to a directory of ``.npy`` files, one or more per column, plus a ``schema.json`` file describing them. :py:func:`load_columns` reads them back, memory-mapping the arrays by default, so even very large exports load almost instantly and are only read from disk as they are used.
+
+Column kinds are:
+
+``number``
+	a single array; null integers are stored as -1, and null floats as NaN
+``timestamp``
+	a single ``datetime64[us]`` array in UTC; nulls are NaT
+``category``
+	an ``int32`` array of codes into a list of distinct values stored in the schema; nulls are -1
+``string``
+	UTF-8 data for all rows concatenated into one ``uint8`` array, with ``int64`` offsets of length N + 1, and a boolean array marking nulls
+``polygon``
+	vertices for all rows in one (M, 2) ``float64`` array, with ``int64`` offsets of length N + 1
+"""
+
+import rigor.geometry
+import rigor.utils
+from rigor.types import Percept, PerceptTag, PerceptProperty, Annotation, AnnotationTag, AnnotationProperty
+
+import sqlalchemy as sa
+import numpy as np
+import tempfile
+import struct
+import json
+import abc
+import io
+import os
+
+#: Number of rows fetched from the database at a time
+kDefaultBatchSize = 10000
+
+#: Version of the columnar export format
+kFormatVersion = 1
+
+#: Name of the file describing the columns in an export directory
+kSchemaFilename = 'schema.json'
+
+# Row count in the placeholder header written before the length of an array is known; it has as many digits as any real count
+_kMaxRows = 2 ** 63 - 1
+
+class AnnotationBoundaries(object):
+	"""
+	Annotation boundaries for a single domain, stored as flat arrays. Annotations are ordered by percept ID, then annotation ID, so all annotations for a percept are contiguous.
+
+	:param annotation_ids: annotation IDs, one per annotation
+	:param percept_ids: percept IDs, one per annotation
+	:param model_codes: index into ``models`` for each annotation, or -1 if the annotation has no model
+	:param list models: distinct model values
+	:param coordinates: all boundary vertices, with shape (M, 2)
+	:param offsets: vertex offsets, with length N + 1; boundary ``i`` is ``coordinates[offsets[i]:offsets[i + 1]]``
+	"""
+
+	def __init__(self, annotation_ids, percept_ids, model_codes, models, coordinates, offsets):
+		self.annotation_ids = annotation_ids
+		self.percept_ids = percept_ids
+		self.model_codes = model_codes
+		self.models = models
+		self.coordinates = coordinates
+		self.offsets = offsets
+
+	def __len__(self):
+		return len(self.annotation_ids)
+
+	def boundary(self, index):
+		"""
+		Gets the boundary of a single annotation
+
+		:param int index: annotation index (not ID)
+		:return: view of the annotation's vertices, with shape (N, 2)
+		:rtype: :py:class:`numpy.ndarray`
+		"""
+		return self.coordinates[self.offsets[index]:self.offsets[index + 1]]
+
+	def model(self, index):
+		"""
+		Gets the model of a single annotation
+
+		:param int index: annotation index (not ID)
+		:return: model value, or :py:const:`None`
+		"""
+		code = self.model_codes[index]
+		if code < 0:
+			return None
+		return self.models[code]
+
+	def percept_range(self, percept_id):
+		"""
+		Finds the annotations belonging to a percept
+
+		:param int percept_id: percept ID
+		:return: (start, stop) indices of the percept's annotations
+		:rtype: tuple
+		"""
+		start = np.searchsorted(self.percept_ids, percept_id, 'left')
+		stop = np.searchsorted(self.percept_ids, percept_id, 'right')
+		return (int(start), int(stop))
+
+	@classmethod
+	def load(cls, session, domain, batch_size=kDefaultBatchSize):
+		"""
+		Loads all annotations in a domain, without building ORM objects
+
+		:param session: database session
+		:param str domain: annotation domain
+		:param int batch_size: number of rows to fetch from the database at a time
+		:return: loaded boundaries
+		:rtype: :py:class:`AnnotationBoundaries`
+		"""
+		query = session.query(
+				Annotation.id,
+				Annotation.percept_id,
+				Annotation.model,
+				sa.type_coerce(Annotation.boundary, sa.Text)
+		).filter(Annotation.domain == domain).order_by(Annotation.percept_id, Annotation.id)
+		annotation_ids = list()
+		percept_ids = list()
+		model_codes = list()
+		boundaries = list()
+		interned = dict()
+		models = list()
+		for annotation_id, percept_id, model, boundary in query.yield_per(batch_size):
+			annotation_ids.append(annotation_id)
+			percept_ids.append(percept_id)
+			if model is None:
+				model_codes.append(-1)
+			else:
+				code = interned.get(model)
+				if code is None:
+					code = len(models)
+					interned[model] = code
+					models.append(model)
+				model_codes.append(code)
+			boundaries.append(boundary)
+		coordinates, offsets = rigor.geometry.parse_polygons(boundaries)
+		return cls(
+				np.array(annotation_ids, dtype=np.int64),
+				np.array(percept_ids, dtype=np.int64),
+				np.array(model_codes, dtype=np.int32),
+				models,
+				coordinates,
+				offsets
+		)
+
+class _ArrayFile(object):
+	"""
+	Writes a ``.npy`` file in pieces, without knowing its length in advance. A header with room for any number of rows is written first, and the data streamed after it; when the file is closed, the header is rewritten in place with the final shape.
+	"""
+
+	def __init__(self, path, dtype, tail=()):
+		self._path = path
+		self._dtype = np.dtype(dtype)
+		self._tail = tuple(tail)
+		self._rows = 0
+		self._file = open(path, 'wb')
+		header = self._header(_kMaxRows)
+		self._header_size = len(header)
+		self._file.write(header)
+
+	def _header(self, rows):
+		""" :return: ``.npy`` header for the given number of rows, padded to the size of the initial header once it's known """
+		buffer = io.BytesIO()
+		np.lib.format.write_array_header_1_0(buffer, {
+			'descr': np.lib.format.dtype_to_descr(self._dtype),
+			'fortran_order': False,
+			'shape': (rows, ) + self._tail,
+		})
+		header = buffer.getvalue()
+		if rows == _kMaxRows:
+			return header
+		# Pad the header dictionary with spaces, and update its length, which follows the magic string and version
+		padding = self._header_size - len(header)
+		prefix = len(np.lib.format.magic(1, 0))
+		text = header[prefix + 2:-1] + ' ' * padding + '\n'
+		return header[:prefix] + struct.pack('<H', len(text)) + text
+
+	def append(self, values):
+		array = np.asarray(values, dtype=self._dtype)
+		self._rows += len(array)
+		array.tofile(self._file)
+
+	def close(self):
+		try:
+			self._file.seek(0)
+			self._file.write(self._header(self._rows))
+		finally:
+			self._file.close()
+		return os.path.basename(self._path)
+
+	def discard(self):
+		self._file.close()
+		os.unlink(self._path)
+
+class _ColumnWriter(object):
+	""" Base class for writers of one kind of column """
+	__metaclass__ = abc.ABCMeta
+	kind = None
+
+	def __init__(self, prefix):
+		self._prefix = prefix
+		self._files = dict()
+
+	def _open(self, part, dtype, tail=()):
+		self._files[part] = _ArrayFile('{0}.{1}.npy'.format(self._prefix, part), dtype, tail)
+		return self._files[part]
+
+	@abc.abstractmethod
+	def append(self, values):
+		"""
+		Writes values for a batch of rows
+
+		:param values: one value per row
+		"""
+		pass
+
+	def close(self):
+		schema = {'kind': self.kind, 'files': dict()}
+		for part, array_file in self._files.iteritems():
+			schema['files'][part] = array_file.close()
+		return schema
+
+	def discard(self):
+		for array_file in self._files.itervalues():
+			array_file.discard()
+
+class _NumberWriter(_ColumnWriter):
+	kind = 'number'
+
+	def __init__(self, prefix, dtype, null=None):
+		_ColumnWriter.__init__(self, prefix)
+		self._null = null
+		self._values = self._open('values', dtype)
+
+	def append(self, values):
+		if self._null is not None:
+			values = [self._null if value is None else value for value in values]
+		self._values.append(values)
+
+class _TimestampWriter(_ColumnWriter):
+	kind = 'timestamp'
+
+	def __init__(self, prefix):
+		_ColumnWriter.__init__(self, prefix)
+		self._values = self._open('values', 'datetime64[us]')
+
+	def append(self, values):
+		self._values.append([_naive_utc(value) for value in values])
+
+class _CategoryWriter(_ColumnWriter):
+	kind = 'category'
+
+	def __init__(self, prefix):
+		_ColumnWriter.__init__(self, prefix)
+		self._codes = self._open('codes', np.int32)
+		self._interned = dict()
+		self._categories = list()
+
+	def append(self, values):
+		codes = list()
+		for value in values:
+			if value is None:
+				codes.append(-1)
+				continue
+			code = self._interned.get(value)
+			if code is None:
+				code = len(self._categories)
+				self._interned[value] = code
+				self._categories.append(value)
+			codes.append(code)
+		self._codes.append(codes)
+
+	def close(self):
+		schema = _ColumnWriter.close(self)
+		schema['categories'] = self._categories
+		return schema
+
+class _StringWriter(_ColumnWriter):
+	kind = 'string'
+
+	def __init__(self, prefix):
+		_ColumnWriter.__init__(self, prefix)
+		self._data = self._open('data', np.uint8)
+		self._offsets = self._open('offsets', np.int64)
+		self._nulls = self._open('nulls', np.bool_)
+		self._offsets.append([0, ])
+		self._length = 0
+
+	def append(self, values):
+		encoded = [value.encode('utf-8') if isinstance(value, unicode) else (value or '') for value in values]
+		lengths = np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+		self._offsets.append(self._length + np.cumsum(lengths))
+		self._length += int(lengths.sum())
+		self._data.append(np.frombuffer(''.join(encoded), dtype=np.uint8))
+		self._nulls.append([value is None for value in values])
+
+class _PolygonWriter(_ColumnWriter):
+	kind = 'polygon'
+
+	def __init__(self, prefix):
+		_ColumnWriter.__init__(self, prefix)
+		self._coordinates = self._open('coordinates', np.float64, (2, ))
+		self._offsets = self._open('offsets', np.int64)
+		self._offsets.append([0, ])
+		self._length = 0
+
+	def append(self, values):
+		coordinates, offsets = rigor.geometry.parse_polygons(values)
+		self._coordinates.append(coordinates)
+		self._offsets.append(self._length + offsets[1:])
+		self._length += len(coordinates)
+
+def _naive_utc(value):
+	""" Converts a timezone-aware timestamp to naive UTC, which NumPy expects """
+	if value is not None and value.utcoffset() is not None:
+		value = (value - value.utcoffset()).replace(tzinfo=None)
+	return value
+
+def _select_percepts(query, percept_id, selection):
+	if selection is None:
+		return query
+	if percept_id is Percept.id:
+		return query.filter(selection.clause())
+	# The filter's correlated clause would also correlate away tag and property tables, so use a standalone select
+	return query.filter(percept_id.in_(selection.select()))
+
+def _tables(session, selection):
+	"""
+	Describes the exported tables
+
+	:return: list of (table name, query, [(column name, writer class, writer arguments), ...]) tuples
+	"""
+	percept = session.query(
+			Percept.id, Percept.locator, Percept.credentials, Percept.hash, Percept.byte_count, Percept.stamp,
+			Percept.x_size, Percept.y_size, Percept.format, Percept.device_id, Percept.sample_count, Percept.sample_rate
+	).order_by(Percept.id)
+	percept_tag = session.query(PerceptTag.percept_id, PerceptTag.name).order_by(PerceptTag.percept_id, PerceptTag.name)
+	percept_property = session.query(PerceptProperty.percept_id, PerceptProperty.name, PerceptProperty.value).order_by(PerceptProperty.percept_id, PerceptProperty.name)
+	annotation = session.query(
+			Annotation.id, Annotation.percept_id, Annotation.confidence, Annotation.stamp, Annotation.domain, Annotation.model,
+			sa.type_coerce(Annotation.boundary, sa.Text)
+	).order_by(Annotation.percept_id, Annotation.id)
+	annotation_tag = session.query(AnnotationTag.annotation_id, AnnotationTag.name).order_by(AnnotationTag.annotation_id, AnnotationTag.name)
+	annotation_property = session.query(AnnotationProperty.annotation_id, AnnotationProperty.name, AnnotationProperty.value).order_by(AnnotationProperty.annotation_id, AnnotationProperty.name)
+	if selection is not None:
+		annotation_tag = annotation_tag.join(Annotation, Annotation.id == AnnotationTag.annotation_id)
+		annotation_property = annotation_property.join(Annotation, Annotation.id == AnnotationProperty.annotation_id)
+	return [
+		('percept', _select_percepts(percept, Percept.id, selection), [
+			('id', _NumberWriter, (np.int64, )),
+			('locator', _StringWriter, ()),
+			('credentials', _CategoryWriter, ()),
+			('hash', _StringWriter, ()),
+			('byte_count', _NumberWriter, (np.int64, -1)),
+			('stamp', _TimestampWriter, ()),
+			('x_size', _NumberWriter, (np.int32, -1)),
+			('y_size', _NumberWriter, (np.int32, -1)),
+			('format', _CategoryWriter, ()),
+			('device_id', _CategoryWriter, ()),
+			('sample_count', _NumberWriter, (np.int64, -1)),
+			('sample_rate', _NumberWriter, (np.float64, np.nan)),
+		]),
+		('percept_tag', _select_percepts(percept_tag, PerceptTag.percept_id, selection), [
+			('percept_id', _NumberWriter, (np.int64, )),
+			('name', _CategoryWriter, ()),
+		]),
+		('percept_property', _select_percepts(percept_property, PerceptProperty.percept_id, selection), [
+			('percept_id', _NumberWriter, (np.int64, )),
+			('name', _CategoryWriter, ()),
+			('value', _StringWriter, ()),
+		]),
+		('annotation', _select_percepts(annotation, Annotation.percept_id, selection), [
+			('id', _NumberWriter, (np.int64, )),
+			('percept_id', _NumberWriter, (np.int64, )),
+			('confidence', _NumberWriter, (np.int16, )),
+			('stamp', _TimestampWriter, ()),
+			('domain', _CategoryWriter, ()),
+			('model', _CategoryWriter, ()),
+			('boundary', _PolygonWriter, ()),
+		]),
+		('annotation_tag', _select_percepts(annotation_tag, Annotation.percept_id, selection), [
+			('annotation_id', _NumberWriter, (np.int64, )),
+			('name', _CategoryWriter, ()),
+		]),
+		('annotation_property', _select_percepts(annotation_property, Annotation.percept_id, selection), [
+			('annotation_id', _NumberWriter, (np.int64, )),
+			('name', _CategoryWriter, ()),
+			('value', _StringWriter, ()),
+		]),
+	]
+
+def _write_table(directory, name, query, columns, batch_size):
+	writers = [writer(os.path.join(directory, '.'.join((name, column))), *arguments) for column, writer, arguments in columns]
+	try:
+		rows = 0
+		batch = list()
+		for row in query.yield_per(batch_size):
+			batch.append(row)
+			if len(batch) >= batch_size:
+				for writer, values in zip(writers, zip(*batch)):
+					writer.append(values)
+				rows += len(batch)
+				batch = list()
+		if batch:
+			for writer, values in zip(writers, zip(*batch)):
+				writer.append(values)
+			rows += len(batch)
+	except:
+		for writer in writers:
+			writer.discard()
+		raise
+	schema = {'rows': rows, 'columns': dict()}
+	for (column, _, _), writer in zip(columns, writers):
+		schema['columns'][column] = writer.close()
+	schema['order'] = [column for column, _, _ in columns]
+	return schema
+
+def export_columns(session, directory, selection=None, batch_size=kDefaultBatchSize):
+	"""
+	Exports percepts, their tags and properties, and their annotations and annotation tags and properties, as column arrays. Rows are read from the database in batches and written as they are read, so memory use doesn't grow with the number of rows (apart from the distinct values of category columns). Tables are ordered by their parent's ID, so rows belonging to a percept or annotation are contiguous and can be found with :py:func:`numpy.searchsorted`.
+
+	The schema file is written last, so an interrupted export can't be loaded.
+
+	:param session: database session
+	:param str directory: directory to write; it will be created if needed
+	:param selection: If a filter is specified, only percepts it matches (and their annotations) are exported
+	:type selection: :py:class:`~rigor.filters.PerceptFilter`
+	:param int batch_size: number of rows to fetch from the database at a time
+	:return: number of rows written to each table
+	:rtype: dict
+	"""
+	rigor.utils.ensure_path_exists(directory)
+	schema = {'version': kFormatVersion, 'tables': dict()}
+	for name, query, columns in _tables(session, selection):
+		schema['tables'][name] = _write_table(directory, name, query, columns, batch_size)
+	handle, temporary = tempfile.mkstemp(prefix='.rigor-', dir=directory)
+	with os.fdopen(handle, 'wb') as schema_file:
+		json.dump(schema, schema_file, indent=1, sort_keys=True)
+	os.rename(temporary, os.path.join(directory, kSchemaFilename))
+	return dict((name, table['rows']) for name, table in schema['tables'].iteritems())
+
+class CategoryColumn(object):
+	"""
+	A column of values from a small set of distinct values
+
+	:param codes: index into ``categories`` for each row, or -1 for null
+	:param list categories: distinct values
+	"""
+
+	def __init__(self, codes, categories):
+		self.codes = codes
+		self.categories = categories
+
+	def __len__(self):
+		return len(self.codes)
+
+	def __getitem__(self, index):
+		code = self.codes[index]
+		if code < 0:
+			return None
+		return self.categories[code]
+
+	def code(self, value):
+		"""
+		:return: code for a value, for comparing against :py:attr:`codes`; -1 if the value doesn't appear in the column
+		:rtype: int
+		"""
+		try:
+			return self.categories.index(value)
+		except ValueError:
+			return -1
+
+class StringColumn(object):
+	"""
+	A column of variable-length strings
+
+	:param data: UTF-8 data for all rows, concatenated
+	:param offsets: offsets into ``data``, with length N + 1
+	:param nulls: :py:const:`True` for null rows
+	"""
+
+	def __init__(self, data, offsets, nulls):
+		self.data = data
+		self.offsets = offsets
+		self.nulls = nulls
+
+	def __len__(self):
+		return len(self.nulls)
+
+	def __getitem__(self, index):
+		if self.nulls[index]:
+			return None
+		return self.data[self.offsets[index]:self.offsets[index + 1]].tostring().decode('utf-8')
+
+class PolygonColumn(object):
+	"""
+	A column of polygons, stored as flat arrays like :py:class:`AnnotationBoundaries`
+
+	:param coordinates: all vertices, with shape (M, 2)
+	:param offsets: vertex offsets, with length N + 1
+	"""
+
+	def __init__(self, coordinates, offsets):
+		self.coordinates = coordinates
+		self.offsets = offsets
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, index):
+		return self.coordinates[self.offsets[index]:self.offsets[index + 1]]
+
+class ColumnarTable(object):
+	"""
+	A table loaded by :py:func:`load_columns`. Columns are accessed by name; ``number`` and ``timestamp`` columns are :py:class:`numpy.ndarray` instances, and other kinds are :py:class:`CategoryColumn`, :py:class:`StringColumn` or :py:class:`PolygonColumn` instances.
+
+	:param str name: table name
+	:param int rows: number of rows
+	:param dict columns: columns, by name
+	:param list order: column names, in export order
+	"""
+
+	def __init__(self, name, rows, columns, order):
+		self.name = name
+		self.rows = rows
+		self.columns = columns
+		self.order = order
+
+	def __len__(self):
+		return self.rows
+
+	def __getitem__(self, column):
+		return self.columns[column]
+
+	def keys(self):
+		return list(self.order)
+
+	def row(self, index):
+		"""
+		Gets a single row, with values converted to Python objects
+
+		:param int index: row index
+		:rtype: dict
+		"""
+		return dict((column, self.columns[column][index]) for column in self.order)
+
+def _load_column(directory, schema, mmap_mode):
+	def load(part):
+		return np.load(os.path.join(directory, schema['files'][part]), mmap_mode=mmap_mode)
+	kind = schema['kind']
+	if kind in ('number', 'timestamp'):
+		return load('values')
+	if kind == 'category':
+		return CategoryColumn(load('codes'), schema['categories'])
+	if kind == 'string':
+		return StringColumn(load('data'), load('offsets'), load('nulls'))
+	if kind == 'polygon':
+		return PolygonColumn(load('coordinates'), load('offsets'))
+	raise ValueError("Unknown column kind {0!r}".format(kind))
+
+def load_columns(directory, mmap=True):
+	"""
+	Loads tables exported by :py:func:`export_columns`
+
+	:param str directory: export directory
+	:param bool mmap: if :py:const:`True`, arrays are memory-mapped read-only rather than read into memory
+	:return: tables, by name
+	:rtype: dict of :py:class:`ColumnarTable`
+	"""
+	with open(os.path.join(directory, kSchemaFilename), 'rb') as schema_file:
+		schema = json.load(schema_file)
+	if schema.get('version') != kFormatVersion:
+		raise ValueError("Unsupported columnar export version {0!r}".format(schema.get('version')))
+	mmap_mode = 'r' if mmap else None
+	tables = dict()
+	for name, table in schema['tables'].iteritems():
+		columns = dict((column, _load_column(directory, column_schema, mmap_mode)) for column, column_schema in table['columns'].iteritems())
+		tables[name] = ColumnarTable(name, table['rows'], columns, table['order'])
+	return tables
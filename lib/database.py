@@ -1,8 +1,14 @@
 """ Database abstraction for Rigor """
 
+import rigor.logger
+
 import sqlalchemy as sa
 from sqlalchemy.orm.session import sessionmaker
 from contextlib import contextmanager
+import itertools
+import threading
+import time
+import re
 
 #: Mapping of database object types to names
 kNamingConvention = {
@@ -15,6 +21,9 @@ kNamingConvention = {
 
 kDSNKeys = ('driver', 'username', 'password', 'host', 'port')
 
+#: Default number of seconds between health checks of a read replica
+kDefaultReplicaCheckInterval = 30.0
+
 class ContextSession(object):
 	"""
 	Wraps a SQLAlchemy session in a context manager
@@ -42,10 +51,43 @@ class ContextSession(object):
 	def __getattr__(self, name):
 		return getattr(self.session, name)
 
+class Replica(object):
+	"""
+	A read-only copy of the database, with its health status
+
+	:param url: SQLAlchemy URL of the replica
+	"""
+	def __init__(self, url):
+		self.url = url
+		self.engine = sa.create_engine(url)
+		self.sessionmaker = sessionmaker(bind=self.engine)
+		self.healthy = True
+		self.checked = None
+		#: Whether a health check is running, so other threads use the last known status rather than waiting for it
+		self.checking = False
+
+	def check(self):
+		"""
+		Checks whether the replica is accepting queries, and updates :py:attr:`healthy`
+
+		:return: whether the replica is healthy
+		:rtype: bool
+		"""
+		try:
+			with self.engine.connect() as connection:
+				connection.execute(sa.select([sa.literal(1)])).scalar()
+			self.healthy = True
+		except sa.exc.SQLAlchemyError:
+			self.healthy = False
+		self.checked = time.time()
+		return self.healthy
+
 class BaseDatabase(object):
 	"""
 	Abstracts a database engine and sessions
 
+	Read-only sessions can be routed to read replicas listed in the ``replicas`` setting of the ``database`` configuration section, as whitespace- or comma-separated SQLAlchemy URLs. If a replica URL doesn't include a database name, the primary database name is used. Replicas are used in turn, and each is health checked at most once every ``replica_check_interval`` seconds; unhealthy replicas are skipped, and if none are healthy, or the session can't connect to the chosen replica, the primary is used. Sessions that may write always use the primary.
+
 	:param str database: The name of the database
 	:param config: Configuration data
 	:type config: :py:class:`~rigor.config.RigorConfiguration`
@@ -69,17 +111,91 @@ class BaseDatabase(object):
 		self.name = database
 		self._config = config
 		url = Database.build_url(database, config)
+		self.url = url
 		self._engine = sa.create_engine(url)
 		self._metadata = sa.MetaData(bind=self._engine, naming_convention=kNamingConvention)
 		self._sessionmaker = sessionmaker(bind=self._engine)
+		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
+		self._replicas = [Replica(replica_url) for replica_url in self.build_replica_urls(database, config)]
+		self._replica_counter = itertools.count()
+		self._replica_lock = threading.Lock()
+		self._replica_check_interval = kDefaultReplicaCheckInterval
+		if ('database', 'replica_check_interval') in config:
+			self._replica_check_interval = float(config.get('database', 'replica_check_interval'))
 
-	def get_session(self, commit=True):
+	@classmethod
+	def build_replica_urls(cls, database, config):
+		"""
+		Given the configuration and a database name, this method will generate SQLAlchemy URLs for any configured read replicas
+
+		:param str database: Name of the database to connect to
+		:param config: The Rigor configuration
+		:return: list of URLs, which is empty if there are no replicas
+		"""
+		if ('database', 'replicas') not in config:
+			return list()
+		urls = list()
+		for value in re.split(r'[\s,]+', config.get('database', 'replicas').strip()):
+			if not value:
+				continue
+			url = sa.engine.url.make_url(value)
+			if not url.database:
+				url.database = database
+			urls.append(url)
+		return urls
+
+	def _get_replica(self):
+		"""
+		Chooses the next healthy replica, or returns :py:const:`None` if there are none. A replica due for a health check is checked by one thread, without holding the lock, so a slow replica doesn't hold up sessions on the others; meanwhile, other threads use its last known status.
+		"""
+		count = len(self._replicas)
+		for _ in range(count):
+			replica = self._replicas[next(self._replica_counter) % count]
+			with self._replica_lock:
+				due = not replica.checking and (replica.checked is None or time.time() - replica.checked >= self._replica_check_interval)
+				if due:
+					replica.checking = True
+				was_healthy = replica.healthy
+			if due:
+				try:
+					replica.check()
+				finally:
+					with self._replica_lock:
+						replica.checking = False
+				if not replica.healthy or not was_healthy:
+					self._logger.warning("Replica {0!r} is {1}".format(replica.url, 'healthy' if replica.healthy else 'unavailable'))
+			if replica.healthy:
+				return replica
+		return None
+
+	def _open_replica_session(self, replica):
+		""" Opens a session on a replica, connecting at once so a failure is found here; if it fails, the replica is marked unhealthy, and :py:const:`None` is returned """
+		session = replica.sessionmaker()
+		try:
+			session.connection()
+		except sa.exc.SQLAlchemyError as err:
+			session.close()
+			with self._replica_lock:
+				replica.healthy = False
+				replica.checked = time.time()
+			self._logger.warning("Replica {0!r} is unavailable ({1}); using the primary".format(replica.url, err))
+			return None
+		return session
+
+	def get_session(self, commit=True, read_only=False):
 		"""
 		Gets a new session from the pool. The session in wrapped in a :py:func:`~contextlib.contextmanager`.
 
 		:param bool commit: If :py:const:`True`, the session will be committed when it exits the context. If :py:const:`False`, or if there is an exception, the session will be rolled back.
+		:param bool read_only: If :py:const:`True`, the session will only be used for reading, so it may be routed to a read replica. Read-only sessions are never committed. Note that replicas may lag slightly behind the primary database.
 		:return: new session
 		"""
+		if read_only:
+			replica = self._get_replica() if self._replicas else None
+			session = None if replica is None else self._open_replica_session(replica)
+			if session is not None:
+				return ContextSession(session, False)
+			return ContextSession(self._sessionmaker(), False)
 		return ContextSession(self._sessionmaker(), commit)
 
 Database = BaseDatabase
@@ -0,0 +1,222 @@
+"""
+Local disk cache for remote percept data
+
+Data read from S3 or HTTP is stored in a local directory, keyed by its locator and (when known) its hash, so later reads of the same percept come from local disk. When the percept's hash is known, and is a SHA-256 hash, data is verified against it as the cache is filled, so corrupted downloads are never cached, and a percept whose data changes (with a new hash) doesn't read stale data.
+
+The cache is limited in size; when it grows too large, the least recently used files are removed. Several processes can safely share a cache directory: files are filled under temporary names and renamed into place, and a file removed while it's being read remains readable until it's closed.
+"""
+
+import rigor.hash
+import rigor.logger
+import rigor.utils
+
+import threading
+import tempfile
+import hashlib
+import errno
+import re
+import time
+import os
+
+#: Default location of the cache, if not set in the configuration
+kDefaultCachePath = os.path.join(os.path.expanduser('~'), '.cache', 'rigor', 'data')
+
+#: Default maximum size of the cache, in bytes
+kDefaultMaxSize = 10 * 0x40000000
+
+#: When evicting, files are removed until the cache is this fraction of its maximum size, so eviction isn't needed on every fill
+kEvictionRatio = 0.9
+
+#: Temporary files older than this many seconds are assumed to be left over from a crashed process, and are removed when evicting
+kStaleTemporaryAge = 24 * 60 * 60
+
+_kTemporaryPrefix = '.rigor-'
+
+# Hashes stored by older versions, or given in import metadata, may not be SHA-256
+_kSHA256Pattern = re.compile(r'^[0-9a-fA-F]{64}$')
+
+_kSizeSuffixes = {'K': 0x400, 'M': 0x100000, 'G': 0x40000000, 'T': 0x10000000000}
+
+class DataVerificationError(IOError):
+	""" Exception raised when data doesn't match its expected hash """
+	pass
+
+def parse_size(value):
+	"""
+	Parses a size in bytes, with an optional ``K``, ``M``, ``G`` or ``T`` suffix (powers of 1024)
+
+	:param str value: size
+	:rtype: int
+	"""
+	value = str(value).strip().upper().rstrip('B')
+	if value and value[-1] in _kSizeSuffixes:
+		return int(float(value[:-1]) * _kSizeSuffixes[value[-1]])
+	return int(value)
+
+class DataCache(object):
+	"""
+	Caches percept data on local disk, with least recently used eviction
+
+	:param str path: cache directory
+	:param int max_size: most space the cache may use, in bytes
+	"""
+
+	def __init__(self, path=kDefaultCachePath, max_size=kDefaultMaxSize):
+		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
+		self._path = os.path.expanduser(path)
+		self._max_size = max_size
+		self._size = None
+		self._lock = threading.Lock()
+		#: Number of reads served from the cache
+		self.hits = 0
+		#: Number of reads not found in the cache
+		self.misses = 0
+		#: Number of files removed to make room
+		self.evictions = 0
+
+	@classmethod
+	def from_config(cls, config):
+		"""
+		Creates a cache using the ``data_cache_path`` and ``data_cache_size`` settings in the ``cache`` section of the configuration
+
+		:param config: configuration data
+		:type config: :py:class:`~rigor.config.RigorConfiguration`
+		:return: cache, or :py:const:`None` if ``data_cache_path`` isn't set
+		:rtype: :py:class:`DataCache`
+		"""
+		if ('cache', 'data_cache_path') not in config:
+			return None
+		max_size = kDefaultMaxSize
+		if ('cache', 'data_cache_size') in config:
+			max_size = parse_size(config.get('cache', 'data_cache_size'))
+		return cls(config.get('cache', 'data_cache_path'), max_size)
+
+	def _filename(self, locator, hash_value):
+		if isinstance(locator, unicode):
+			locator = locator.encode('utf-8')
+		digest = hashlib.sha256('{0}\n{1}'.format(locator, hash_value or '')).hexdigest()
+		return os.path.join(self._path, digest[:2], digest)
+
+	def open(self, locator, hash_value=None):
+		"""
+		Opens cached data
+
+		:param str locator: percept locator
+		:param str hash_value: hash of the data, if known
+		:return: open cached file, or :py:const:`None` if the data isn't cached
+		:rtype: file
+		"""
+		filename = self._filename(locator, hash_value)
+		try:
+			cached = open(filename, 'rb')
+		except IOError as err:
+			if err.errno != errno.ENOENT:
+				raise
+			with self._lock:
+				self.misses += 1
+			return None
+		try:
+			# Marks it as recently used; access times are often not updated
+			os.utime(filename, None)
+		except OSError:
+			pass
+		with self._lock:
+			self.hits += 1
+		return cached
+
+	def fill(self, locator, data, hash_value=None):
+		"""
+		Stores data in the cache, and opens the cached copy
+
+		:param str locator: percept locator
+		:param data: file-like object to read data from
+		:param str hash_value: hash of the data, if known; if it's a SHA-256 hash, the data is checked against it, and otherwise it only identifies the data
+		:return: open cached file
+		:rtype: file
+		:raises DataVerificationError: if the data doesn't match the hash
+		"""
+		filename = self._filename(locator, hash_value)
+		directory = os.path.dirname(filename)
+		rigor.utils.ensure_path_exists(directory)
+		handle, temporary = tempfile.mkstemp(prefix=_kTemporaryPrefix, dir=directory)
+		try:
+			with os.fdopen(handle, 'wb') as cache_file:
+				digest = rigor.hash.copy_and_hash(data, cache_file)
+			if hash_value is not None and _kSHA256Pattern.match(hash_value) and digest.sha256() != hash_value.lower():
+				raise DataVerificationError("Data for {0} has hash {1}, but {2} was expected".format(locator, digest.sha256(), hash_value))
+			os.rename(temporary, filename)
+		except:
+			os.unlink(temporary)
+			raise
+		cached = open(filename, 'rb')
+		self._added(digest.byte_count)
+		return cached
+
+	def _added(self, byte_count):
+		with self._lock:
+			if self._size is None:
+				self._size = self._scan()[0]
+			else:
+				self._size += byte_count
+			if self._size > self._max_size:
+				self._evict(int(self._max_size * kEvictionRatio))
+
+	def _scan(self):
+		"""
+		:return: (total size, list of (last used, size, path) for cached files)
+		"""
+		total = 0
+		files = list()
+		now = time.time()
+		for directory, _, filenames in os.walk(self._path):
+			for filename in filenames:
+				path = os.path.join(directory, filename)
+				try:
+					status = os.stat(path)
+				except OSError:
+					continue
+				if filename.startswith(_kTemporaryPrefix):
+					if now - status.st_mtime > kStaleTemporaryAge:
+						self._remove(path)
+					continue
+				total += status.st_size
+				files.append((status.st_mtime, status.st_size, path))
+		return (total, files)
+
+	def _remove(self, path):
+		try:
+			os.unlink(path)
+		except OSError as err:
+			if err.errno != errno.ENOENT:
+				raise
+			return False
+		return True
+
+	def _evict(self, target):
+		# Rescanned, as other processes sharing the cache may have added or removed files
+		total, files = self._scan()
+		files.sort()
+		for _, size, path in files:
+			if total <= target:
+				break
+			if self._remove(path):
+				self.evictions += 1
+			total -= size
+		self._size = total
+		self._logger.debug("Evicted cached data down to {0} bytes".format(total))
+
+	def evict(self, max_size=None):
+		"""
+		Removes least recently used files until the cache is no larger than the given size
+
+		:param int max_size: target size in bytes; defaults to the cache's maximum size
+		"""
+		with self._lock:
+			self._evict(self._max_size if max_size is None else max_size)
+
+	@property
+	def size(self):
+		""" Total size of cached data, in bytes """
+		with self._lock:
+			self._size = self._scan()[0]
+			return self._size
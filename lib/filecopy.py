@@ -0,0 +1,164 @@
+"""
+Copying files without passing their data through user space
+
+Each strategy is tried in turn until one works for the pair of files:
+
+``hardlink``
+	links the destination to the source, so no data is copied at all. The two names share one file, so later changes to either (including permission changes) affect both.
+``reflink``
+	clones the source's blocks with the ``FICLONE`` ioctl, on filesystems that support it (Btrfs, XFS). The copy is independent, and shares storage until either file is modified.
+``copy_file_range``
+	copies within the kernel, which can be offloaded to the filesystem or storage (for example, NFS server-side copy)
+``sendfile``
+	copies within the kernel, on older systems without ``copy_file_range``
+
+Only Linux supports the last three.
+
+An existing destination is never written to: the copy is made under a temporary name in the destination's directory, then renamed over the destination. This matters when the destination is already a hard link to the source, as writing to it would change the source.
+"""
+
+import ctypes
+import ctypes.util
+import tempfile
+import errno
+import uuid
+import sys
+import os
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+#: All strategies, in the order they are tried
+kStrategies = ('hardlink', 'reflink', 'copy_file_range', 'sendfile')
+
+#: ``FICLONE`` ioctl request number, from ``linux/fs.h``
+kFICLONE = 0x40049409
+
+#: Most bytes copied by a single system call
+kMaxChunk = 0x40000000
+
+_kTemporaryPrefix = '.rigor-'
+
+# Errors meaning a strategy isn't available for these files, rather than that copying failed
+_kUnsupported = frozenset(getattr(errno, name) for name in ('EXDEV', 'EPERM', 'EOPNOTSUPP', 'ENOTSUP', 'EINVAL', 'ENOSYS', 'ENOTTY', 'EMLINK', 'EEXIST', 'EBADF') if hasattr(errno, name))
+
+def _load_syscall(name, argtypes):
+	if not sys.platform.startswith('linux'):
+		return None
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		function = getattr(libc, name)
+	except (OSError, AttributeError):
+		return None
+	function.argtypes = argtypes
+	function.restype = ctypes.c_ssize_t
+	return function
+
+_copy_file_range = _load_syscall('copy_file_range', [ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t, ctypes.c_uint])
+_sendfile = _load_syscall('sendfile', [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t])
+
+def _temporary_name(destination):
+	directory, filename = os.path.split(destination)
+	return os.path.join(directory, '{0}{1}-{2}'.format(_kTemporaryPrefix, uuid.uuid4().hex, filename))
+
+def _hardlink(source, destination):
+	temporary = _temporary_name(destination)
+	try:
+		os.link(source, temporary)
+	except OSError as err:
+		if err.errno in _kUnsupported:
+			return False
+		raise
+	try:
+		os.rename(temporary, destination)
+	except:
+		os.unlink(temporary)
+		raise
+	return True
+
+def _reflink(source_fd, destination_fd, _size):
+	if fcntl is None or not sys.platform.startswith('linux'):
+		return False
+	try:
+		fcntl.ioctl(destination_fd, kFICLONE, source_fd)
+	except (IOError, OSError) as err:
+		if err.errno in _kUnsupported:
+			return False
+		raise
+	return True
+
+def _kernel_copy(copy_chunk, source_fd, destination_fd, size):
+	"""
+	Copies using a system call that copies up to a given number of bytes from the current file positions
+
+	:return: :py:const:`False` if the system call isn't supported, or if it stopped before copying the whole file (as when the file shrinks during the copy)
+	"""
+	copied = 0
+	while copied < size:
+		count = copy_chunk(source_fd, destination_fd, min(size - copied, kMaxChunk))
+		if count < 0:
+			error = ctypes.get_errno()
+			if copied == 0 and error in _kUnsupported:
+				return False
+			raise OSError(error, os.strerror(error))
+		if count == 0:
+			return False
+		copied += count
+	return True
+
+def _copy_file_range_chunk(source_fd, destination_fd, count):
+	return _copy_file_range(source_fd, None, destination_fd, None, count, 0)
+
+def _sendfile_chunk(source_fd, destination_fd, count):
+	return _sendfile(destination_fd, source_fd, None, count)
+
+def copy_file(source, destination, strategies=kStrategies):
+	"""
+	Copies a file using the first of the given strategies that works. If the destination exists, it's replaced, by renaming the copy over it; if it's already the same file as the source, nothing is copied, and ``'hardlink'`` is returned. File metadata, such as permissions and modification time, is not copied.
+
+	:param str source: path to the file to copy
+	:param str destination: path to the new file
+	:param strategies: names of the strategies to try, in order; see :py:data:`kStrategies`
+	:return: the strategy used, or :py:const:`None` if none of them could be used, in which case the caller should copy the file some other way
+	:rtype: str
+	"""
+	if os.path.exists(destination) and os.path.samefile(source, destination):
+		return 'hardlink'
+	if 'hardlink' in strategies and _hardlink(source, destination):
+		return 'hardlink'
+	kernel_copies = (
+		('reflink', _reflink),
+		('copy_file_range', _copy_file_range and (lambda *args: _kernel_copy(_copy_file_range_chunk, *args))),
+		('sendfile', _sendfile and (lambda *args: _kernel_copy(_sendfile_chunk, *args))),
+	)
+	kernel_copies = [(name, function) for name, function in kernel_copies if function and name in strategies]
+	if not kernel_copies:
+		return None
+	source_fd = os.open(source, os.O_RDONLY)
+	try:
+		size = os.fstat(source_fd).st_size
+		destination_fd, temporary = tempfile.mkstemp(prefix=_kTemporaryPrefix, dir=os.path.dirname(destination) or '.')
+		used = None
+		try:
+			try:
+				for name, function in kernel_copies:
+					# Each strategy starts again from the beginning, discarding anything a failed strategy copied
+					os.lseek(source_fd, 0, os.SEEK_SET)
+					os.lseek(destination_fd, 0, os.SEEK_SET)
+					os.ftruncate(destination_fd, 0)
+					if function(source_fd, destination_fd, size):
+						used = name
+						break
+			finally:
+				os.close(destination_fd)
+			if used is not None:
+				os.rename(temporary, destination)
+				temporary = None
+		finally:
+			if temporary is not None:
+				os.unlink(temporary)
+	finally:
+		os.close(source_fd)
+	return used
@@ -0,0 +1,322 @@
+"""
+Composable filters for selecting percepts by tag, property and collection
+
+Filters can be combined with ``&`` (and), ``|`` (or) and ``~`` (not), and compile to SQL that does not duplicate rows, no matter how many terms are used:
+
+	>>> selection = HasTag('train') & HasTag('hard') & ~HasProperty('source', 'synthetic')
+	>>> percepts = session.query(Percept).filter(selection.clause())
+
+The same filters can be parsed from a string with :py:func:`parse`, which is handy for command-line tools:
+
+	>>> selection = parse('tag:train & tag:hard & !property:source=synthetic')
+"""
+
+from rigor.types import Percept, PerceptTag, PerceptProperty, PerceptCollection, Collection, Annotation
+
+import abc
+import re
+import sqlalchemy as sa
+
+class FilterSyntaxError(ValueError):
+	""" Exception raised when a filter string can't be parsed """
+	pass
+
+class PerceptFilter(object):
+	""" Base class for filters that select percepts """
+	__metaclass__ = abc.ABCMeta
+
+	@abc.abstractmethod
+	def clause(self):
+		"""
+		Builds a boolean SQL expression, correlated to :py:class:`~rigor.types.Percept`, that is true for matching percepts. Use this with :py:meth:`sqlalchemy.orm.query.Query.filter`.
+
+		:return: SQL expression
+		"""
+		pass
+
+	@abc.abstractmethod
+	def select(self):
+		"""
+		Builds a standalone ``SELECT`` of matching percept IDs, using ``INTERSECT``, ``UNION`` and ``EXCEPT`` to combine terms
+
+		:return: SQL select statement with a single percept ID column
+		"""
+		pass
+
+	def __and__(self, other):
+		return AllOf(self, other)
+
+	def __or__(self, other):
+		return AnyOf(self, other)
+
+	def __invert__(self):
+		return Not(self)
+
+class HasTag(PerceptFilter):
+	"""
+	Selects percepts with the given tag
+
+	:param str name: tag name
+	"""
+
+	def __init__(self, name):
+		self.name = name
+
+	def clause(self):
+		""" See :py:meth:`PerceptFilter.clause` """
+		return sa.exists().where(PerceptTag.percept_id == Percept.id).where(PerceptTag.name == self.name)
+
+	def select(self):
+		""" See :py:meth:`PerceptFilter.select` """
+		return sa.select([PerceptTag.percept_id.label('percept_id')]).where(PerceptTag.name == self.name)
+
+	def __repr__(self):
+		return "HasTag({0!r})".format(self.name)
+
+class HasProperty(PerceptFilter):
+	"""
+	Selects percepts with the given property, and optionally a specific value
+
+	:param str name: property name
+	:param str value: property value, or :py:const:`None` to match any value
+	"""
+
+	def __init__(self, name, value=None):
+		self.name = name
+		self.value = value
+
+	def _conditions(self):
+		conditions = [PerceptProperty.name == self.name, ]
+		if self.value is not None:
+			conditions.append(PerceptProperty.value == self.value)
+		return conditions
+
+	def clause(self):
+		""" See :py:meth:`PerceptFilter.clause` """
+		return sa.exists().where(PerceptProperty.percept_id == Percept.id).where(sa.and_(*self._conditions()))
+
+	def select(self):
+		""" See :py:meth:`PerceptFilter.select` """
+		return sa.select([PerceptProperty.percept_id.label('percept_id')]).where(sa.and_(*self._conditions()))
+
+	def __repr__(self):
+		return "HasProperty({0!r}, {1!r})".format(self.name, self.value)
+
+class InCollection(PerceptFilter):
+	"""
+	Selects percepts that are members of the named collection
+
+	:param str name: collection name
+	"""
+
+	def __init__(self, name):
+		self.name = name
+
+	def _conditions(self):
+		return sa.and_(PerceptCollection.collection_id == Collection.id, Collection.name == self.name)
+
+	def clause(self):
+		""" See :py:meth:`PerceptFilter.clause` """
+		return sa.exists().where(PerceptCollection.percept_id == Percept.id).where(self._conditions())
+
+	def select(self):
+		""" See :py:meth:`PerceptFilter.select` """
+		return sa.select([PerceptCollection.percept_id.label('percept_id')]).where(self._conditions())
+
+	def __repr__(self):
+		return "InCollection({0!r})".format(self.name)
+
+class ChangedSince(PerceptFilter):
+	"""
+	Selects percepts added after a given percept ID, or with an annotation stamped after a given time
+
+	:param int percept_id: highest percept ID already seen
+	:param annotation_stamp: latest annotation stamp already seen, or :py:const:`None` to ignore annotations
+	:type annotation_stamp: :py:class:`~datetime.datetime`
+	"""
+
+	def __init__(self, percept_id, annotation_stamp=None):
+		self.percept_id = percept_id
+		self.annotation_stamp = annotation_stamp
+
+	def clause(self):
+		""" See :py:meth:`PerceptFilter.clause` """
+		clause = Percept.id > self.percept_id
+		if self.annotation_stamp is not None:
+			clause = sa.or_(clause, sa.exists().where(Annotation.percept_id == Percept.id).where(Annotation.stamp > self.annotation_stamp))
+		return clause
+
+	def select(self):
+		""" See :py:meth:`PerceptFilter.select` """
+		select = sa.select([Percept.id.label('percept_id')]).where(Percept.id > self.percept_id)
+		if self.annotation_stamp is not None:
+			select = sa.union(select, sa.select([Annotation.percept_id.label('percept_id')]).where(Annotation.stamp > self.annotation_stamp))
+		return select
+
+	def __repr__(self):
+		return "ChangedSince({0!r}, {1!r})".format(self.percept_id, self.annotation_stamp)
+
+class _CompoundFilter(PerceptFilter):
+	""" Base class for filters that combine other filters """
+	_kOperator = None
+
+	def __init__(self, *filters):
+		self.filters = list()
+		for child in filters:
+			# Flatten nested filters of the same kind, so a & b & c is one INTERSECT
+			if type(child) is type(self):
+				self.filters.extend(child.filters)
+			else:
+				self.filters.append(child)
+
+	def _child_selects(self):
+		selects = list()
+		for child in self.filters:
+			select = child.select()
+			if isinstance(select, sa.sql.expression.CompoundSelect):
+				# Not all databases accept nested compound selects, so wrap them
+				select = sa.select([select.alias().c.percept_id])
+			selects.append(select)
+		return selects
+
+	def __repr__(self):
+		return "{0}({1})".format(self.__class__.__name__, ', '.join(repr(child) for child in self.filters))
+
+class AllOf(_CompoundFilter):
+	""" Selects percepts matching all of the given filters """
+
+	def clause(self):
+		""" See :py:meth:`PerceptFilter.clause` """
+		return sa.and_(*[child.clause() for child in self.filters])
+
+	def select(self):
+		""" See :py:meth:`PerceptFilter.select` """
+		return sa.intersect(*self._child_selects())
+
+class AnyOf(_CompoundFilter):
+	""" Selects percepts matching any of the given filters """
+
+	def clause(self):
+		""" See :py:meth:`PerceptFilter.clause` """
+		return sa.or_(*[child.clause() for child in self.filters])
+
+	def select(self):
+		""" See :py:meth:`PerceptFilter.select` """
+		return sa.union(*self._child_selects())
+
+class Not(PerceptFilter):
+	"""
+	Selects percepts that don't match the given filter
+
+	:param selection: filter to negate
+	:type selection: :py:class:`PerceptFilter`
+	"""
+
+	def __init__(self, selection):
+		self.filter = selection
+
+	def clause(self):
+		""" See :py:meth:`PerceptFilter.clause` """
+		return sa.not_(self.filter.clause())
+
+	def select(self):
+		""" See :py:meth:`PerceptFilter.select` """
+		select = self.filter.select()
+		if isinstance(select, sa.sql.expression.CompoundSelect):
+			select = sa.select([select.alias().c.percept_id])
+		return sa.except_(sa.select([Percept.id.label('percept_id')]), select)
+
+	def __invert__(self):
+		return self.filter
+
+	def __repr__(self):
+		return "Not({0!r})".format(self.filter)
+
+_kTokenPattern = re.compile(r'\s*(?:(?P<operator>[&|!()])|(?P<term>(?:"[^"]*"|[^\s&|!()"])+))')
+_kTermPattern = re.compile(r'^(?P<kind>tag|property|collection):(?P<name>"[^"]*"|[^=]+)(?:=(?P<value>.*))?$')
+
+def _unquote(value):
+	if value is not None and len(value) >= 2 and value[0] == value[-1] == '"':
+		return value[1:-1]
+	return value
+
+def _tokenize(text):
+	tokens = list()
+	position = 0
+	text = text.rstrip()
+	while position < len(text):
+		match = _kTokenPattern.match(text, position)
+		if not match:
+			raise FilterSyntaxError("Unexpected character at position {0} in {1!r}".format(position, text))
+		tokens.append(match.group('operator') or match.group('term'))
+		position = match.end()
+	return tokens
+
+def _build_term(token):
+	match = _kTermPattern.match(token)
+	if not match:
+		raise FilterSyntaxError("Invalid filter term {0!r}; expected tag:NAME, property:NAME[=VALUE] or collection:NAME".format(token))
+	kind = match.group('kind')
+	name = _unquote(match.group('name'))
+	value = _unquote(match.group('value'))
+	if kind == 'tag':
+		return HasTag(name)
+	if kind == 'property':
+		return HasProperty(name, value)
+	return InCollection(name)
+
+def parse(text):
+	"""
+	Parses a filter expression. Terms are ``tag:NAME``, ``property:NAME``, ``property:NAME=VALUE`` and ``collection:NAME``; names and values containing spaces or operators can be wrapped in double quotes. Terms are combined with ``&``, ``|``, ``!`` and parentheses, where ``!`` binds tightest and ``&`` binds tighter than ``|``.
+
+	:param str text: filter expression
+	:return: compiled filter
+	:rtype: :py:class:`PerceptFilter`
+	:raises FilterSyntaxError: if the expression is invalid
+	"""
+	tokens = _tokenize(text)
+	position = [0]
+
+	def peek():
+		if position[0] < len(tokens):
+			return tokens[position[0]]
+		return None
+
+	def take():
+		token = peek()
+		if token is None:
+			raise FilterSyntaxError("Unexpected end of filter {0!r}".format(text))
+		position[0] += 1
+		return token
+
+	def parse_any():
+		terms = [parse_all(), ]
+		while peek() == '|':
+			take()
+			terms.append(parse_all())
+		return terms[0] if len(terms) == 1 else AnyOf(*terms)
+
+	def parse_all():
+		terms = [parse_unary(), ]
+		while peek() == '&':
+			take()
+			terms.append(parse_unary())
+		return terms[0] if len(terms) == 1 else AllOf(*terms)
+
+	def parse_unary():
+		token = take()
+		if token == '!':
+			return Not(parse_unary())
+		if token == '(':
+			result = parse_any()
+			if take() != ')':
+				raise FilterSyntaxError("Expected ')' in {0!r}".format(text))
+			return result
+		if token in ('&', '|', ')'):
+			raise FilterSyntaxError("Unexpected {0!r} in {1!r}".format(token, text))
+		return _build_term(token)
+
+	result = parse_any()
+	if peek() is not None:
+		raise FilterSyntaxError("Unexpected {0!r} in {1!r}".format(peek(), text))
+	return result
@@ -0,0 +1,112 @@
+""" Fast conversion between geometric types and their database text representation """
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+_kStripTable = {ord(u'('): None, ord(u')'): None, ord(u' '): None}
+
+def _parse_number(token):
+	""" Parses a coordinate as an integer, or as a float if it's written with a decimal point or exponent """
+	if '.' in token or 'e' in token or 'E' in token:
+		return float(token)
+	return int(token)
+
+def _parse_coordinates(stripped):
+	""" Parses comma-separated coordinates, each as an integer or float according to how it's written """
+	tokens = stripped.split(',')
+	try:
+		return map(int, tokens)
+	except ValueError:
+		return map(_parse_number, tokens)
+
+def _strip(value):
+	""" Removes parentheses and whitespace, leaving only comma-separated coordinates """
+	if isinstance(value, unicode):
+		return value.translate(_kStripTable)
+	return value.translate(None, '() ')
+
+def _flatten(value):
+	""" Returns a flat list of coordinates from a sequence of vertices or an array """
+	if hasattr(value, 'ravel'):
+		return value.ravel().tolist()
+	return [coordinate for vertex in value for coordinate in vertex]
+
+def parse_point(value, as_array=False):
+	"""
+	Parses a point from its text representation, such as ``(1, 2)``
+
+	:param str value: text representation of the point
+	:param bool as_array: if :py:const:`True`, returns a :py:class:`numpy.ndarray` of :py:const:`float64` with shape (2, )
+	:return: the point, as an (x, y) :py:class:`tuple` or array
+	"""
+	if value is None:
+		return None
+	stripped = _strip(value)
+	if as_array:
+		return np.fromstring(stripped, dtype=np.float64, sep=',')
+	x, y = _parse_coordinates(stripped)
+	return (x, y)
+
+def parse_polygon(value, as_array=False):
+	"""
+	Parses a polygon from its text representation, such as ``((1, 2), (3, 4))`` or ``(1, 2), (3, 4)``
+
+	:param str value: text representation of the polygon
+	:param bool as_array: if :py:const:`True`, returns a :py:class:`numpy.ndarray` of :py:const:`float64` with shape (N, 2)
+	:return: the polygon, as a :py:class:`tuple` of (x, y) tuples or an array
+	"""
+	if value is None:
+		return None
+	stripped = _strip(value)
+	if as_array:
+		return np.fromstring(stripped, dtype=np.float64, sep=',').reshape(-1, 2)
+	if not stripped:
+		return tuple()
+	coordinates = _parse_coordinates(stripped)
+	return tuple(zip(coordinates[0::2], coordinates[1::2]))
+
+def format_point(value):
+	"""
+	Formats a point for storage in the database
+
+	:param value: (x, y) sequence or array
+	:return: text representation of the point
+	:rtype: str
+	"""
+	if value is None:
+		return None
+	return '({0:n}, {1:n})'.format(value[0], value[1])
+
+def format_polygon(value):
+	"""
+	Formats a polygon for storage in the database
+
+	:param value: sequence of (x, y) vertices, or an array with shape (N, 2)
+	:return: text representation of the polygon
+	:rtype: str
+	"""
+	if value is None:
+		return None
+	coordinates = _flatten(value)
+	return ('({:n}, {:n}), ' * (len(coordinates) // 2))[:-2].format(*coordinates)
+
+def parse_polygons(values):
+	"""
+	Parses many polygons at once into flat arrays. All coordinates are parsed in a single pass, which is much faster than parsing each polygon individually.
+
+	:param values: sequence of polygon text representations; :py:const:`None` is treated as a polygon with no vertices
+	:raises ValueError: if a polygon is malformed
+	:return: (coordinates, offsets), where coordinates is a :py:class:`numpy.ndarray` of :py:const:`float64` with shape (M, 2) containing all vertices, and offsets is an array of :py:const:`int64` with length N + 1 such that the vertices of polygon ``i`` are ``coordinates[offsets[i]:offsets[i + 1]]``
+	"""
+	stripped = [_strip(value) if value else '' for value in values]
+	counts = np.fromiter(((len(text) and text.count(',') + 1) // 2 for text in stripped), dtype=np.int64, count=len(stripped))
+	offsets = np.zeros(len(stripped) + 1, dtype=np.int64)
+	np.cumsum(counts, out=offsets[1:])
+	joined = ','.join(text for text in stripped if text)
+	coordinates = np.fromstring(joined, dtype=np.float64, sep=',')
+	# Parsing stops quietly at the first malformed coordinate, so check that every coordinate was parsed
+	if coordinates.size != 2 * offsets[-1]:
+		raise ValueError("Malformed polygon: expected {0} coordinates, parsed {1}".format(2 * offsets[-1], coordinates.size))
+	return coordinates.reshape(-1, 2), offsets
@@ -1,6 +1,10 @@
 """ Common functions for hashing files """
 
 import hashlib
+import base64
+
+#: Number of bytes read at a time
+kBufferSize = 0x100000
 
 def sha256_hash(path):
 	"""
@@ -12,8 +16,60 @@ def sha256_hash(path):
 	else:
 		file_object = open(path, 'rb')
 	while True:
-		buf = file_object.read(0x100000)
+		buf = file_object.read(kBufferSize)
 		if not buf:
 			break
 		sha256.update(buf)
 	return sha256.hexdigest()
+
+class StreamDigest(object):
+	"""
+	Incrementally computes a SHA-256 hash, byte count and optionally an MD5 hash of data as it passes through
+
+	:param bool md5: whether to compute an MD5 hash as well (as needed for S3 uploads)
+	"""
+	def __init__(self, md5=False):
+		self._sha256 = hashlib.sha256()
+		self._md5 = hashlib.md5() if md5 else None
+		self.byte_count = 0
+
+	def update(self, buf):
+		""" Adds data to the digest """
+		self._sha256.update(buf)
+		if self._md5 is not None:
+			self._md5.update(buf)
+		self.byte_count += len(buf)
+
+	def sha256(self):
+		"""
+		:return: SHA-256 hash of the data so far
+		:rtype: str
+		"""
+		return self._sha256.hexdigest()
+
+	def md5(self):
+		"""
+		:return: (hex digest, base64 digest) tuple of the MD5 hash of the data so far, in the form used by Boto
+		:rtype: tuple
+		"""
+		return (self._md5.hexdigest(), base64.b64encode(self._md5.digest()))
+
+def copy_and_hash(source, destination=None, md5=False):
+	"""
+	Reads all data from a file-like object once, hashing and counting it, and optionally writing it to another file-like object at the same time
+
+	:param source: file-like object to read
+	:param destination: file-like object to write to, or :py:const:`None` to just hash the data
+	:param bool md5: whether to compute an MD5 hash as well
+	:return: digest of the data
+	:rtype: :py:class:`StreamDigest`
+	"""
+	digest = StreamDigest(md5)
+	while True:
+		buf = source.read(kBufferSize)
+		if not buf:
+			break
+		digest.update(buf)
+		if destination is not None:
+			destination.write(buf)
+	return digest
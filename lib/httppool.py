@@ -0,0 +1,311 @@
+"""
+Pooled HTTP client for reading remote percept data
+
+Opening a new connection for every percept spends more time on TCP (and TLS) handshakes than on transferring small files. :py:class:`HTTPConnectionPool` keeps connections open between requests, reusing them for later requests to the same host. The number of connections to each host is limited, so many threads reading at once don't overwhelm a server; threads wait, for up to the timeout, for a connection to become free. Response data is streamed from the connection as it's read, and the connection is reused once all of it has been read.
+
+Requests that fail because of a network error, or a server error that is likely to be temporary, are retried. A connection the server closed while it was idle is replaced without counting as a retry.
+"""
+
+import rigor.logger
+from rigor.utils import RangeData
+
+from urlparse import urlsplit, urljoin
+import contextlib
+import threading
+import httplib
+import urllib2
+import socket
+import time
+import io
+
+#: Default most connections open to each host at once
+kDefaultMaxPerHost = 8
+
+#: Default number of seconds to wait for a connection or a response before giving up
+kDefaultTimeout = 30.0
+
+#: Default number of times a failed request is retried
+kDefaultRetries = 3
+
+#: Seconds to wait before the first retry; the delay doubles with each later retry
+kRetryDelay = 0.1
+
+#: Most redirects followed for a single request
+kMaxRedirects = 5
+
+#: Response statuses that are retried, as the server is likely to recover
+kRetryStatuses = frozenset((500, 502, 503, 504))
+
+_kRedirectStatuses = frozenset((301, 302, 303, 307, 308))
+
+_kConnectionClasses = {'http': httplib.HTTPConnection, 'https': httplib.HTTPSConnection}
+
+_kDefaultPorts = {'http': httplib.HTTP_PORT, 'https': httplib.HTTPS_PORT}
+
+class _Host(object):
+	""" Idle connections to one host, and a limit on how many connections may be in use """
+
+	def __init__(self, max_connections):
+		self.idle = list()
+		self.in_use = 0
+		self.max_connections = max_connections
+		self.available = threading.Condition(threading.Lock())
+
+class _PooledResponse(io.RawIOBase):
+	"""
+	Response body read from a pooled connection. The connection goes back to the pool once the body has been read to its end; if the response is closed first, the connection is closed instead, as it still holds unread data.
+	"""
+
+	def __init__(self, pool, host, connection, response):
+		io.RawIOBase.__init__(self)
+		self._pool = pool
+		self._host = host
+		self._connection = connection
+		self._response = response
+
+	def readable(self):
+		return True
+
+	def read(self, size=-1):
+		if self._response is None:
+			return ''
+		if size is None or size < 0:
+			data = self._response.read()
+		else:
+			data = self._response.read(size)
+		if self._response.isclosed():
+			self._finish(True)
+		return data
+
+	def readinto(self, buffer):
+		data = self.read(len(buffer))
+		buffer[:len(data)] = data
+		return len(data)
+
+	def _finish(self, complete):
+		response, self._response = self._response, None
+		if response is None:
+			return
+		if complete and not response.will_close:
+			self._pool._checkin(self._host, self._connection)
+		else:
+			response.close()
+			self._connection.close()
+		self._pool._release(self._host)
+
+	def close(self):
+		self._finish(False)
+		io.RawIOBase.close(self)
+
+class HTTPConnectionPool(object):
+	"""
+	Reads data over HTTP or HTTPS, keeping connections alive to be reused
+
+	The pool can be shared between threads.
+
+	:param int max_per_host: most connections open to each host at once
+	:param float timeout: seconds to wait for a connection or a response
+	:param int retries: number of times a failed request is retried
+	"""
+
+	def __init__(self, max_per_host=kDefaultMaxPerHost, timeout=kDefaultTimeout, retries=kDefaultRetries):
+		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
+		self._max_per_host = max_per_host
+		self._timeout = timeout
+		self._retries = retries
+		self._hosts = dict()
+		self._lock = threading.Lock()
+		#: Number of connections opened
+		self.connections = 0
+		#: Number of requests sent, including retries
+		self.requests = 0
+		#: Number of requests retried
+		self.retried = 0
+
+	@classmethod
+	def from_config(cls, config):
+		"""
+		Creates a pool using the ``max_connections_per_host``, ``timeout`` and ``retries`` settings in the ``http`` section of the configuration, if they are set
+
+		:param config: configuration data
+		:type config: :py:class:`~rigor.config.RigorConfiguration`
+		:rtype: :py:class:`HTTPConnectionPool`
+		"""
+		kwargs = dict()
+		for name, option, convert in (('max_per_host', 'max_connections_per_host', int), ('timeout', 'timeout', float), ('retries', 'retries', int)):
+			if ('http', option) in config:
+				kwargs[name] = convert(config.get('http', option))
+		return cls(**kwargs)
+
+	def _host(self, key):
+		with self._lock:
+			host = self._hosts.get(key)
+			if host is None:
+				host = _Host(self._max_per_host)
+				self._hosts[key] = host
+			return host
+
+	def _checkout(self, key, host):
+		""" :return: (connection, whether it was reused) """
+		with self._lock:
+			if host.idle:
+				return (host.idle.pop(), True)
+			self.connections += 1
+		scheme, hostname, port = key
+		return (_kConnectionClasses[scheme](hostname, port, timeout=self._timeout), False)
+
+	def _checkin(self, host, connection):
+		with self._lock:
+			host.idle.append(connection)
+
+	def _acquire(self, key, host):
+		""" Waits until a connection to the host may be used, for up to the timeout """
+		deadline = None if self._timeout is None else time.time() + self._timeout
+		with host.available:
+			while host.in_use >= host.max_connections:
+				if deadline is None:
+					host.available.wait()
+					continue
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					raise socket.timeout("Timed out waiting for a connection to {0}:{1}".format(key[1], key[2]))
+				host.available.wait(remaining)
+			host.in_use += 1
+
+	def _release(self, host):
+		with host.available:
+			host.in_use -= 1
+			host.available.notify()
+
+	def _request(self, key, host, path, headers):
+		"""
+		Sends one request, retrying on errors. The response body isn't read, so the connection is still in use when this returns.
+
+		:return: (response, connection)
+		"""
+		attempt = 0
+		while True:
+			connection, reused = self._checkout(key, host)
+			try:
+				with self._lock:
+					self.requests += 1
+				connection.request('GET', path, headers=headers)
+				response = connection.getresponse()
+				if response.status in kRetryStatuses and attempt < self._retries:
+					response.read()
+			except (socket.error, httplib.HTTPException) as err:
+				connection.close()
+				if reused:
+					# The server closed the idle connection; this isn't the server failing
+					continue
+				if attempt >= self._retries:
+					raise
+				self._logger.debug("Retrying {0}://{1}:{2}{3} after error: {4}".format(key[0], key[1], key[2], path, err))
+			else:
+				if response.status not in kRetryStatuses or attempt >= self._retries:
+					return (response, connection)
+				if response.will_close:
+					connection.close()
+				else:
+					self._checkin(host, connection)
+				self._logger.debug("Retrying {0}://{1}:{2}{3} after status {4}".format(key[0], key[1], key[2], path, response.status))
+			with self._lock:
+				self.retried += 1
+			time.sleep(kRetryDelay * (2 ** attempt))
+			attempt += 1
+
+	def _get(self, url, headers):
+		"""
+		Sends a request, following redirects
+
+		:return: (final URL, status, reason, response headers, body); the body is a :py:class:`_PooledResponse`
+		"""
+		request_headers = {'Connection': 'keep-alive'}
+		if headers:
+			request_headers.update(headers)
+		for _ in range(kMaxRedirects + 1):
+			parsed = urlsplit(url)
+			scheme = parsed.scheme.lower()
+			if scheme not in _kConnectionClasses:
+				raise ValueError("Unsupported URL scheme for {0}".format(url))
+			key = (scheme, parsed.hostname, parsed.port or _kDefaultPorts[scheme])
+			path = parsed.path or '/'
+			if parsed.query:
+				path = '?'.join((path, parsed.query))
+			host = self._host(key)
+			self._acquire(key, host)
+			try:
+				response, connection = self._request(key, host, path, request_headers)
+			except:
+				self._release(host)
+				raise
+			body = _PooledResponse(self, host, connection, response)
+			if response.status in _kRedirectStatuses and response.msg.get('location'):
+				body.read()
+				body.close()
+				url = urljoin(url, response.msg['location'])
+				continue
+			return (url, response.status, response.reason, response.msg, body)
+		raise urllib2.HTTPError(url, response.status, "Too many redirects", response.msg, io.BytesIO())
+
+	@staticmethod
+	def _error(url, status, reason, response_headers, body):
+		""" :return: :py:class:`urllib2.HTTPError` for an error response, after reading its body, so the connection can be reused """
+		with contextlib.closing(body):
+			return urllib2.HTTPError(url, status, reason, response_headers, io.BytesIO(body.read()))
+
+	def get(self, url, headers=None):
+		"""
+		Reads the data at the given URL, following redirects. The data is streamed from the connection as it's read, rather than buffered in memory; the connection goes back to the pool once the data has been read to its end, so close the response if you don't read all of it. Errors while reading the data aren't retried.
+
+		:param str url: ``http`` or ``https`` URL
+		:param dict headers: extra request headers
+		:return: response body
+		:rtype: file-like object
+		:raises urllib2.HTTPError: if the server responds with an error
+		:raises socket.timeout: if no connection to the host becomes free within the timeout
+		"""
+		url, status, reason, response_headers, body = self._get(url, headers)
+		if status >= 400:
+			raise self._error(url, status, reason, response_headers, body)
+		return body
+
+	def get_range(self, url, start, end=None, headers=None):
+		"""
+		Reads part of the data at the given URL, with an HTTP range request. If the server doesn't support range requests, the whole of the data is read, and the range is taken from it; the whole of the data is kept with the range (see :py:class:`~rigor.utils.RangeData`).
+
+		:param str url: ``http`` or ``https`` URL
+		:param int start: offset of the first byte to read
+		:param int end: offset after the last byte to read; if :py:const:`None`, the rest of the data is read
+		:param dict headers: extra request headers
+		:return: data in the range, which is shorter than requested if the data ends first; as with :py:meth:`get`, it's streamed from the connection
+		:rtype: file-like object
+		:raises urllib2.HTTPError: if the server responds with an error
+		:raises socket.timeout: if no connection to the host becomes free within the timeout
+		"""
+		if end is not None and end <= start:
+			return io.BytesIO()
+		request_headers = dict(headers or ())
+		request_headers['Range'] = 'bytes={0}-{1}'.format(start, '' if end is None else end - 1)
+		url, status, reason, response_headers, body = self._get(url, request_headers)
+		if status == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+			# The range starts after the end of the data
+			with contextlib.closing(body):
+				body.read()
+			return io.BytesIO()
+		if status >= 400:
+			raise self._error(url, status, reason, response_headers, body)
+		if status != httplib.PARTIAL_CONTENT:
+			with contextlib.closing(body):
+				whole = body.read()
+			return RangeData(whole[start:end], whole)
+		return body
+
+	def clear(self):
+		""" Closes all idle connections """
+		with self._lock:
+			hosts = self._hosts.values()
+			for host in hosts:
+				for connection in host.idle:
+					connection.close()
+				del host.idle[:]
@@ -0,0 +1,140 @@
+"""
+In-memory cache of decoded images
+
+Workflows that decode the same percepts many times, such as parameter sweeps, several algorithms run over one set of percepts, or interactive sessions, spend much of their time decoding. :py:class:`DecodedImageCache` keeps recently decoded images in memory, up to a total size, discarding the least recently used when it's full.
+
+Cached images are shared by everyone who fetches them, so they're made read-only. To change one, copy it first (for example, with :py:meth:`numpy.ndarray.copy`).
+"""
+
+from rigor.datacache import parse_size
+
+from collections import OrderedDict
+import threading
+
+#: Default most memory used by cached images, in bytes
+kDefaultMaxSize = 0x40000000
+
+class DecodedImageCache(object):
+	"""
+	Caches decoded images in memory, with least recently used eviction
+
+	The cache can be shared between threads.
+
+	:param int max_size: most memory cached images may use, in bytes
+	"""
+
+	def __init__(self, max_size=kDefaultMaxSize):
+		self._max_size = max_size
+		self._images = OrderedDict()
+		self._size = 0
+		self._lock = threading.Lock()
+		#: Number of images found in the cache
+		self.hits = 0
+		#: Number of images not found in the cache
+		self.misses = 0
+		#: Number of images removed to make room
+		self.evictions = 0
+
+	@classmethod
+	def from_config(cls, config):
+		"""
+		Creates a cache using the ``image_cache_size`` setting in the ``cache`` section of the configuration
+
+		:param config: configuration data
+		:type config: :py:class:`~rigor.config.RigorConfiguration`
+		:return: cache, or :py:const:`None` if ``image_cache_size`` isn't set
+		:rtype: :py:class:`DecodedImageCache`
+		"""
+		if ('cache', 'image_cache_size') not in config:
+			return None
+		return cls(parse_size(config.get('cache', 'image_cache_size')))
+
+	@staticmethod
+	def key(percept, *options):
+		"""
+		Makes the key for a percept's image. Percepts are identified by their data's hash if it's known, so percepts with identical data share a cached image, or otherwise by their ID or locator.
+
+		:param percept: percept metadata
+		:param options: anything else that affects how the image is decoded, such as OpenCV flags
+		:return: key
+		"""
+		hash_value = getattr(percept, 'hash', None)
+		if hash_value is not None:
+			identity = ('hash', hash_value)
+		elif getattr(percept, 'id', None) is not None:
+			identity = ('id', percept.id)
+		else:
+			identity = ('locator', percept.locator)
+		return (identity, options)
+
+	def get(self, key):
+		"""
+		Finds a cached image
+
+		:param key: key from :py:meth:`key`
+		:return: read-only image, or :py:const:`None` if it isn't cached
+		:rtype: :py:class:`numpy.ndarray`
+		"""
+		with self._lock:
+			image = self._images.pop(key, None)
+			if image is None:
+				self.misses += 1
+				return None
+			self._images[key] = image
+			self.hits += 1
+			return image
+
+	def put(self, key, image):
+		"""
+		Adds an image to the cache. Images larger than the cache aren't kept.
+
+		:param key: key from :py:meth:`key`
+		:param image: decoded image; it's made read-only
+		:type image: :py:class:`numpy.ndarray`
+		:return: the image
+		:rtype: :py:class:`numpy.ndarray`
+		"""
+		image.flags.writeable = False
+		if image.nbytes > self._max_size:
+			return image
+		with self._lock:
+			previous = self._images.pop(key, None)
+			if previous is not None:
+				self._size -= previous.nbytes
+			self._images[key] = image
+			self._size += image.nbytes
+			while self._size > self._max_size:
+				_, evicted = self._images.popitem(last=False)
+				self._size -= evicted.nbytes
+				self.evictions += 1
+		return image
+
+	def get_or_load(self, key, load):
+		"""
+		Finds a cached image, or loads and caches it if it isn't cached
+
+		:param key: key from :py:meth:`key`
+		:param load: function taking no arguments that returns the decoded image, or :py:const:`None` if it can't be decoded
+		:return: read-only image
+		:rtype: :py:class:`numpy.ndarray`
+		"""
+		image = self.get(key)
+		if image is None:
+			image = load()
+			if image is not None:
+				image = self.put(key, image)
+		return image
+
+	def clear(self):
+		""" Removes all cached images """
+		with self._lock:
+			self._images.clear()
+			self._size = 0
+
+	@property
+	def size(self):
+		""" Total size of cached images, in bytes """
+		return self._size
+
+	def __len__(self):
+		return len(self._images)
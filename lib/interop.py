@@ -8,16 +8,27 @@ import rigor.types
 import rigor.hash
 import rigor.utils
 import rigor.s3
+import rigor.filters
+import rigor.querycache
+import rigor.workers
+import rigor.jsonstream
+import rigor.filecopy
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from urlparse import urlsplit
+from io import BytesIO
 
+import sqlalchemy as sa
+import collections
 import os
 import stat
 import json
 import shutil
+import tempfile
 import errno
 import mimetypes
+import threading
+import uuid
 
 #: The MIME type used when none is supplied, and guessing type fails
 kDefaultMIMEType = 'application/octet-stream'
@@ -25,70 +36,453 @@ kDefaultMIMEType = 'application/octet-stream'
 #: The file extension used when none is supplied, and type is not well-known
 kDefaultExtension = 'dat'
 
+#: Number of percepts read from the database at a time when exporting
+kDefaultExportBatchSize = 500
+
+#: Largest file (in bytes) that will be read into memory for uploading to S3, so it only needs to be read once
+kMaxBufferedUpload = 0x4000000
+
+#: Number of percept IDs below an export watermark that are exported again, to catch percepts committed late by concurrent transactions
+kWatermarkIDOverlap = 1000
+
+#: Time before an export watermark's annotation stamp from which annotations are exported again, to catch annotations committed late by concurrent transactions
+kWatermarkStampOverlap = timedelta(minutes=10)
+
+class ImportJournal(object):
+	"""
+	Append-only record of metadata entries that have been imported, so an interrupted import can be restarted without repeating finished work. Each line of the journal file is a JSON object with the entry's ``source`` and ``locator`` (which identify it), and the resulting ``percept_id``, ``hash`` and stored ``url``.
+
+	Entries are recorded after their transaction commits, and the file is synced to disk after each write. A crash between a commit and the journal write can leave that one batch imported but unrecorded. A partially written last line is ignored.
+
+	:param str path: journal file; it will be created if it doesn't exist
+	"""
+	def __init__(self, path):
+		self._path = path
+		self._completed = dict()
+		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
+		terminated = True
+		try:
+			with open(path, 'rb') as journal_file:
+				for line_number, line in enumerate(journal_file, 1):
+					terminated = line.endswith('\n')
+					if not line.strip():
+						continue
+					try:
+						record = json.loads(line)
+					except ValueError:
+						self._logger.warning("Ignoring invalid line {0} in import journal {1}".format(line_number, path))
+						continue
+					self._completed[self.key(record)] = record
+		except IOError as err:
+			if err.errno != errno.ENOENT:
+				raise
+		self._file = open(path, 'ab')
+		if not terminated:
+			# The last write was interrupted, so start a new line
+			self._file.write('\n')
+
+	@staticmethod
+	def key(metadata):
+		"""
+		:return: key identifying a metadata entry
+		:rtype: tuple
+		"""
+		return (metadata.get('source'), metadata.get('locator'))
+
+	def __len__(self):
+		return len(self._completed)
+
+	def __contains__(self, metadata):
+		return self.key(metadata) in self._completed
+
+	def get(self, metadata):
+		"""
+		:param dict metadata: metadata entry
+		:return: record of the entry's import, or :py:const:`None` if it hasn't been imported
+		:rtype: dict
+		"""
+		return self._completed.get(self.key(metadata))
+
+	def record(self, completed):
+		"""
+		Records imported entries
+
+		:param completed: (metadata, percept ID, hash, URL) tuples
+		"""
+		lines = list()
+		for metadata, percept_id, hash_value, url in completed:
+			record = {'source': metadata.get('source'), 'locator': metadata.get('locator'), 'percept_id': percept_id, 'hash': hash_value, 'url': url}
+			self._completed[self.key(record)] = record
+			lines.append(json.dumps(record) + '\n')
+		self._file.write(''.join(lines))
+		self._file.flush()
+		os.fsync(self._file.fileno())
+
+	def close(self):
+		self._file.close()
+
 class Importer(object):
 	"""
 	Imports percept metadata into the database, and copies files into the repository, if needed.
 
+	Percepts can be imported in batches, with each batch in a single transaction, which is much faster than committing each percept. Each percept's data is copied before its database rows are written, outside of any transaction, and the rows are never written if copying failed. If writing a batch fails, it's rolled back and retried one percept per transaction, so that only the failing percept is affected.
+
+	When importing data, it's copied and hashed by a pool of worker threads, while database access stays in the calling thread. Copies run ahead of the database writes, up to a batch plus two percepts per worker, so they continue while a batch is written, and several workers copy at once even with one percept per batch.
+
+	With zero-copy enabled, data copied to a local repository is hard linked, cloned (reflinked) or copied within the kernel if possible (see :py:mod:`rigor.filecopy`), rather than read and written by Rigor. Hard linked files share permissions and contents with their sources, so sources must not be modified or removed afterwards. The data is still read to hash it, unless the metadata gives both ``hash`` and ``byte_count``. The strategy used for each percept is logged, and totals are kept in :py:attr:`copy_strategies`.
+
+	With a journal, each imported entry is recorded as soon as it's committed, and entries already recorded are skipped without touching the database or the data, so an interrupted import can simply be run again. See :py:class:`ImportJournal`.
+
+	If a content-addressed repository is given, each percept's data is stored at a location derived from its SHA-256 hash (``<repository>/ab/cd/abcd....ext``, using the source file's extension), and any ``locator`` in the metadata is ignored. Data that is already in the repository is detected with a single ``stat`` (or S3 ``HEAD`` request), and not copied again. Percepts with identical data share one stored object; since locators must be unique, each percept after the first gets the object's URL with a unique fragment (``#...``) appended, which is ignored when reading the data.
+
 	:param config: Configuration data
 	:type config: :py:class:`~rigor.config.RigorConfiguration` instance
 	:param str database: Name of the database to export
-	:param metadata: Name of the file containing metadata to read, or parsed metadata as a list of dicts
+	:param metadata: Path to a metadata file or directory of metadata files (see :py:func:`~rigor.jsonstream.iter_metadata`), or parsed metadata as a list or other iterable of dicts. Metadata files are read one entry at a time, so they can be arbitrarily large.
 	:param bool import_data: Whether to import percept data into the repository. This is highly recommended, and will be done by default.
+	:param int batch_size: Number of percepts to import in each transaction
+	:param bool stop_on_error: If :py:const:`True`, the first percept that fails to import stops the import by raising its exception. If :py:const:`False`, failures are logged and recorded in :py:attr:`failures`, and the import continues.
+	:param int workers: Number of threads copying percept data in parallel
+	:param str repository: Base URL (local or S3) of a content-addressed repository to store percept data in, or :py:const:`None` to use the locators given in the metadata
+	:param bool zero_copy: Whether to avoid copying data through Rigor when importing into a local repository
+	:param str journal: Path to an import journal, or :py:const:`None` to import every entry without keeping a journal
+	:param bool skip_existing: Whether to skip entries whose locator is already in the database, as when importing an incremental export that overlaps an earlier one (see :py:class:`ExportWatermark`). Locators are ignored with a content-addressed repository, so the two can't be combined.
 	"""
-	def __init__(self, config, database, metadata, import_data=True):
+	def __init__(self, config, database, metadata, import_data=True, batch_size=1, stop_on_error=True, workers=1, repository=None, zero_copy=False, journal=None, skip_existing=False):
+		if repository is not None:
+			if not import_data:
+				raise ValueError("Importing into a content-addressed repository requires importing data")
+			if skip_existing:
+				raise ValueError("Existing percepts can't be skipped when importing into a content-addressed repository")
+			if not urlsplit(repository).scheme:
+				repository = 'file://' + os.path.abspath(repository)
+			repository = repository.rstrip('/')
+		self._repository = repository
 		self._config = config
 		self._metadata = metadata
 		self._import_data = import_data
+		self._batch_size = max(1, batch_size)
+		self._stop_on_error = stop_on_error
+		self._workers = max(1, workers)
+		self._zero_copy = zero_copy
+		self._journal_path = journal
+		self._journal = None
+		self._skip_existing = skip_existing
+		self._pool = None
+		self._lock = threading.Lock()
 		self._database = rigor.database.Database(database, config)
 		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
-		self._s3 = None
+		#: List of (metadata, exception) tuples for percepts that failed to import, if not stopping on errors
+		self.failures = list()
+		#: Number of percepts whose data was already in the content-addressed repository
+		self.deduplicated = 0
+		#: Number of entries skipped because the journal shows they were already imported
+		self.skipped = 0
+		#: Number of entries skipped because their locator was already in the database, with ``skip_existing``
+		self.existing = 0
+		#: Number of percepts whose data was copied by each strategy (a :py:mod:`rigor.filecopy` strategy, ``copy`` or ``upload``)
+		self.copy_strategies = collections.Counter()
 		mimetypes.init()
 
 	def run(self):
 		"""
 		Imports all percepts from the metadata file
 		"""
-		metadata = None
-		if isinstance(self._metadata, list):
-			metadata = self._metadata
+		if isinstance(self._metadata, basestring):
+			metadata = rigor.jsonstream.iter_metadata(self._metadata)
 		else:
-			with open(self._metadata, 'rb') as metadata_file:
-				metadata = json.load(metadata_file)
+			metadata = self._metadata
+		if self._journal_path is not None:
+			self._journal = ImportJournal(self._journal_path)
+		if self._import_data:
+			# Room for the next batch to be transferred while the last one is written
+			self._pool = rigor.workers.WorkerPool(self._transfer, self._workers, self._batch_size + 2 * self._workers)
+		try:
+			for _ in self._import_all(self._pending(metadata), self._batch_size):
+				pass
+		finally:
+			if self._pool is not None:
+				# Waits for transfers already started, so none is still writing if an error is raised
+				self._pool.close()
+				self._pool = None
+			if self._journal is not None:
+				self._journal.close()
+				self._journal = None
+		if self.skipped:
+			self._logger.info("Skipped {0} percepts already imported according to the journal".format(self.skipped))
+		if self.existing:
+			self._logger.info("Skipped {0} percepts already in the database".format(self.existing))
+		if self.copy_strategies:
+			self._logger.info("Copied data by {0}".format(', '.join('{0}: {1}'.format(strategy, count) for strategy, count in sorted(self.copy_strategies.items()))))
+
+	def _pending(self, metadata):
+		""" Generates the entries still to be imported, leaving out those recorded in the journal, and those already in the database if skipping them """
+		chunk = list()
 		for entry in metadata:
-			self.import_percept(entry)
+			if self._journal is not None and entry in self._journal:
+				self.skipped += 1
+				continue
+			if not self._skip_existing:
+				yield entry
+				continue
+			chunk.append(entry)
+			if len(chunk) >= self._batch_size:
+				for new_entry in self._without_existing(chunk):
+					yield new_entry
+				chunk = list()
+		for new_entry in self._without_existing(chunk):
+			yield new_entry
+
+	def _without_existing(self, entries):
+		""" Leaves out entries whose locator is already in the database """
+		locators = [entry['locator'] for entry in entries if entry.get('locator')]
+		if not locators:
+			return entries
+		with self._database.get_session(False) as session:
+			existing = set(locator for locator, in session.query(rigor.types.Percept.locator).filter(rigor.types.Percept.locator.in_(locators)))
+		self.existing += sum(1 for entry in entries if entry.get('locator') in existing)
+		return [entry for entry in entries if entry.get('locator') not in existing]
+
+	def import_batch(self, entries):
+		"""
+		Imports several percepts in a single transaction. Data for all of them is transferred first, so the transaction isn't held open while it's copied. Percepts whose data couldn't be transferred are left out, and those before and after them are written in separate transactions. If a transaction fails, each of its percepts is retried in its own transaction to isolate the failure.
+
+		:param list entries: Percept metadata for each percept, including annotations
+		:return: percept IDs, in the same order as the entries; IDs of percepts that failed are :py:const:`None`
+		:rtype: list
+		"""
+		return list(self._import_all(entries, max(1, len(entries))))
 
 	def import_percept(self, metadata):
 		"""
-		Parses metadata and builds percept and annotations, then inserts it into the database. If file data is being imported, it will also copy the file data into the repository.
+		Parses metadata and builds percept and annotations, then inserts it into the database. If file data is being imported, it's copied into the repository first, and the percept is only added if that succeeds.
 
 		:param dict metadata: Percept metadata, including annotations
 		"""
-		percept = rigor.types.Percept.deserialize(metadata)
+		transferred = None
+		if self._import_data:
+			transferred = self._transfer(metadata)
+		return self._write_percept(metadata, transferred)
 
-		# We take control of the transaction here so we can fail if copying/moving the file fails
-		with self._database.get_session() as session:
-			session.add(percept)
-			session.flush()
-			with_data = ""
+	def _import_all(self, entries, batch_size):
+		"""
+		Imports entries in two stages: their data is transferred (by the worker pool, if there is one, which runs ahead of this thread), then their percepts are written to the database in batches. A failed transfer stops the import if stopping on errors, after the entries before it have been written.
+
+		:return: generator of percept IDs, in the same order as the entries; IDs of percepts that failed are :py:const:`None`
+		"""
+		batch = list()
+		for entry, transferred, error in self._transfer_each(entries):
+			if error is not None:
+				# Entries before the failure are written first, as they would have been one at a time
+				for percept_id in self._write_batch(batch):
+					yield percept_id
+				batch = list()
+				if self._stop_on_error:
+					raise error
+				self._record_failure(entry, error)
+				yield None
+				continue
+			batch.append((entry, transferred))
+			if len(batch) >= batch_size:
+				for percept_id in self._write_batch(batch):
+					yield percept_id
+				batch = list()
+		for percept_id in self._write_batch(batch):
+			yield percept_id
+
+	def _transfer_each(self, entries):
+		""" Transfers data for each entry, if importing data, generating (entry, result of :py:meth:`_transfer`, exception) tuples in order """
+		if self._pool is not None:
+			for (entry, ), transferred, error in self._pool.imap((entry, ) for entry in entries):
+				yield (entry, transferred, error)
+			return
+		for entry in entries:
+			transferred = None
+			error = None
 			if self._import_data:
-				repository = urlsplit(percept.locator)
-				if repository.scheme == 's3':
-					if not self._s3 or self._s3.bucket != repository.netloc:
-						self._s3 = rigor.s3.DefaultS3Client(self._config, repository.netloc, percept.credentials)
-				source = metadata['source']
-				destination = percept.locator
-				with_data = " with data "
-				self._copy_data(source, destination)
-				source = urlsplit(source)
-				if 'hash' not in metadata:
-					percept.hash = rigor.hash.sha256_hash(source.path)
-				if 'byte_count' not in metadata:
-					percept.byte_count = os.path.getsize(source.path)
-			self._logger.info("Imported percept ID {0}{1}".format(percept.id, with_data))
-			return percept.id
-
-	def _copy_data(self, source, destination):
-		""" Copies file data from source path to destination """
+				try:
+					transferred = self._transfer(entry)
+				except Exception as err:
+					error = err
+			yield (entry, transferred, error)
+
+	def _transfer(self, metadata):
+		"""
+		Copies a percept's data into the repository, before its percept is written to the database. This may be called from worker threads.
+
+		:return: for a content-addressed repository, as from :py:meth:`_store_object`; otherwise, as from :py:meth:`_copy_data`
+		"""
+		if self._repository is not None:
+			return self._store_object(metadata['source'], metadata.get('credentials'))
+		return self._copy_data(metadata['source'], metadata.get('locator'), metadata.get('credentials'), self._needs_digest(metadata))
+
+	def _write_batch(self, batch):
+		"""
+		Writes percepts whose data has been transferred to the database in a single transaction. If it fails, each percept is retried in its own transaction.
+
+		:param list batch: (metadata, transferred) tuples
+		:return: percept IDs, as from :py:meth:`import_batch`
+		"""
+		if len(batch) > 1:
+			try:
+				with self._database.get_session() as session:
+					percepts = [self._add_percept(session, entry, transferred) for entry, transferred in batch]
+					percept_ids = [percept.id for percept in percepts]
+					completed = [(entry, percept.id, percept.hash, percept.locator) for (entry, _), percept in zip(batch, percepts)]
+					rigor.querycache.increment_write_version(session)
+			except Exception as err:
+				self._logger.warning("Batch of {0} percepts failed ({1}); retrying one at a time".format(len(batch), err))
+			else:
+				# The batch is committed, so it's never retried, even if recording it fails
+				if self._repository is not None:
+					self._count_stored([transferred for _, transferred in batch])
+				self._record_completed(completed)
+				self._logger.info("Imported {0} percepts (IDs {1} to {2}){3}".format(len(percept_ids), percept_ids[0], percept_ids[-1], self._with_data()))
+				return percept_ids
+		percept_ids = list()
+		for entry, transferred in batch:
+			try:
+				percept_ids.append(self._write_percept(entry, transferred))
+			except Exception as err:
+				if self._stop_on_error:
+					raise
+				self._record_failure(entry, err)
+				percept_ids.append(None)
+		return percept_ids
+
+	def _write_percept(self, metadata, transferred):
+		""" Writes one percept, whose data has been transferred, to the database in its own transaction """
+		with self._database.get_session() as session:
+			percept = self._add_percept(session, metadata, transferred)
+			percept_id = percept.id
+			completed = [(metadata, percept.id, percept.hash, percept.locator), ]
+			rigor.querycache.increment_write_version(session)
+		if self._repository is not None and transferred is not None:
+			self._count_stored([transferred, ])
+		self._record_completed(completed)
+		self._logger.info("Imported percept ID {0}{1}".format(percept_id, self._with_data()))
+		return percept_id
+
+	def _record_failure(self, metadata, err):
+		""" Records a percept that failed to import, when not stopping on errors """
+		self._logger.error("Failed to import percept {0}: {1}".format(metadata.get('locator'), err))
+		self.failures.append((metadata, err))
+
+	def _record_completed(self, completed):
+		""" Records committed entries in the journal, if there is one """
+		if self._journal is not None:
+			self._journal.record(completed)
+
+	def _with_data(self):
+		""" Describes whether data is imported, for log messages """
+		if self._import_data:
+			return " with data "
+		return ""
+
+	def _add_percept(self, session, metadata, transferred=None):
+		""" Adds a percept to the session, and flushes it so it has an ID. If its data was transferred, its hash and byte count are filled in, and its locator too if it was stored in the content-addressed repository. """
+		percept = rigor.types.Percept.deserialize(metadata)
+		digest = transferred
+		if self._repository is not None and transferred is not None:
+			url, digest, _ = transferred
+			percept.locator = self._unique_locator(session, url)
+		self._apply_digest(percept, metadata, digest)
+		session.add(percept)
+		session.flush()
+		return percept
+
+	def _needs_digest(self, metadata):
+		""" Checks whether the hash or byte count must be computed, because the metadata doesn't give them """
+		return 'hash' not in metadata or 'byte_count' not in metadata
+
+	def _apply_digest(self, percept, metadata, digest):
+		""" Fills in the hash and byte count of a percept, unless given in the metadata """
+		if digest is None:
+			return
+		if 'hash' not in metadata:
+			percept.hash = digest.sha256()
+		if 'byte_count' not in metadata:
+			percept.byte_count = digest.byte_count
+
+	def _unique_locator(self, session, url):
+		""" Gets a locator for a percept stored at the URL, which is the URL itself unless another percept already has it """
+		if session.query(rigor.types.Percept.id).filter(rigor.types.Percept.locator == url).first() is None:
+			return url
+		return '{0}#{1}'.format(url, uuid.uuid4().hex)
+
+	def _count_stored(self, stored):
+		deduplicated = sum(1 for _, _, existed in stored if existed)
+		if deduplicated:
+			self.deduplicated += deduplicated
+			self._logger.debug("{0} of {1} percepts were already in the repository".format(deduplicated, len(stored)))
+
+	def _store_object(self, source, credentials=None):
+		"""
+		Stores file data in the content-addressed repository, unless it's already there. The source is read once to hash it, and again to copy it if it isn't already stored (except for S3 uploads up to :py:data:`kMaxBufferedUpload` bytes, which are buffered in memory). This may be called from worker threads.
+
+		:return: (URL, digest, :py:const:`True` if the data was already stored)
+		:rtype: tuple
+		"""
+		source = urlsplit(source)
+		if source.netloc:
+			raise NotImplementedError("Importing remote percept data is not implemented")
+		repository = urlsplit(self._repository)
+		to_s3 = repository.scheme == 's3'
+		if repository.netloc and not to_s3:
+			raise NotImplementedError("Can't upload data to remote servers. Try local repository or S3")
+		extension = os.path.splitext(source.path)[1].lower()
+		with open(source.path, 'rb') as source_file:
+			buffered = None
+			if to_s3 and os.fstat(source_file.fileno()).st_size <= kMaxBufferedUpload:
+				buffered = BytesIO()
+				digest = rigor.hash.copy_and_hash(source_file, buffered, md5=True)
+			else:
+				digest = rigor.hash.copy_and_hash(source_file, md5=to_s3)
+			sha256 = digest.sha256()
+			url = '{0}/{1}/{2}/{3}{4}'.format(self._repository, sha256[0:2], sha256[2:4], sha256, extension)
+			destination = urlsplit(url)
+			if to_s3:
+				s3 = rigor.s3.get_client(self._config, destination.netloc, credentials)
+				if s3.exists(destination.path):
+					return (url, digest, True)
+				if buffered is None:
+					source_file.seek(0)
+					s3.put(destination.path, source_file, digest.md5())
+				else:
+					buffered.seek(0)
+					s3.put(destination.path, buffered, digest.md5())
+				return (url, digest, False)
+			if os.path.exists(destination.path):
+				return (url, digest, True)
+			# Copied to a temporary file and renamed, so a partial object is never visible, even to concurrent imports
+			directory = os.path.dirname(destination.path)
+			rigor.utils.ensure_path_exists(directory)
+			handle, temporary = tempfile.mkstemp(prefix='.rigor-', dir=directory)
+			try:
+				source_file.seek(0)
+				with os.fdopen(handle, 'wb') as destination_file:
+					shutil.copyfileobj(source_file, destination_file, rigor.hash.kBufferSize)
+				shutil.copystat(source.path, temporary)
+				os.chmod(temporary, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
+				os.rename(temporary, destination.path)
+			except:
+				os.unlink(temporary)
+				raise
+		return (url, digest, False)
+
+	def _record_strategy(self, strategy, destination):
+		self._logger.debug("Copied data to {0} by {1}".format(destination, strategy))
+		with self._lock:
+			self.copy_strategies[strategy] += 1
+
+	def _copy_data(self, source, destination, credentials=None, hashed=True):
+		"""
+		Copies file data from source path to destination, reading the source only once. Files being uploaded to S3 that are larger than :py:data:`kMaxBufferedUpload` are read twice, as the MD5 hash must be known before uploading begins. This may be called from worker threads.
+
+		:param bool hashed: If :py:const:`False`, and the data was copied without reading it, it isn't read just to hash it
+		:return: digest of the copied data, or :py:const:`None` if it wasn't hashed
+		:rtype: :py:class:`~rigor.hash.StreamDigest`
+		"""
 		source = urlsplit(source)
 		if source.netloc:
 			raise NotImplementedError("Importing remote percept data is not implemented")
@@ -96,45 +490,221 @@ class Importer(object):
 		if not destination.netloc:
 			# Local
 			rigor.utils.ensure_path_exists(os.path.dirname(destination.path))
-			shutil.copy2(source.path, destination.path)
-			os.chmod(destination.path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
+			strategy = None
+			if self._zero_copy or os.path.exists(destination.path):
+				# Also finds a destination that's already the source (as when a hard linked copy is retried), which mustn't be written to
+				strategy = rigor.filecopy.copy_file(source.path, destination.path, rigor.filecopy.kStrategies if self._zero_copy else ())
+			if strategy is None:
+				strategy = 'copy'
+				# Written under a temporary name and renamed, so an existing file at the destination is replaced rather than truncated
+				handle, temporary = tempfile.mkstemp(prefix='.rigor-', dir=os.path.dirname(destination.path))
+				try:
+					with open(source.path, 'rb') as source_file:
+						with os.fdopen(handle, 'wb') as destination_file:
+							digest = rigor.hash.copy_and_hash(source_file, destination_file)
+					os.rename(temporary, destination.path)
+				except:
+					os.unlink(temporary)
+					raise
+			else:
+				digest = None
+				if hashed:
+					with open(source.path, 'rb') as source_file:
+						digest = rigor.hash.copy_and_hash(source_file)
+			if strategy != 'hardlink':
+				# A hard link is the source file, which shouldn't be changed
+				shutil.copystat(source.path, destination.path)
+				os.chmod(destination.path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH)
+			self._record_strategy(strategy, destination.path)
 		elif destination.scheme == 's3':
-			self._s3.put(destination.path, source.path)
+			s3 = rigor.s3.get_client(self._config, destination.netloc, credentials)
+			with open(source.path, 'rb') as source_file:
+				if os.fstat(source_file.fileno()).st_size <= kMaxBufferedUpload:
+					buffered = BytesIO()
+					digest = rigor.hash.copy_and_hash(source_file, buffered, md5=True)
+					buffered.seek(0)
+					s3.put(destination.path, buffered, digest.md5())
+				else:
+					digest = rigor.hash.copy_and_hash(source_file, md5=True)
+					source_file.seek(0)
+					s3.put(destination.path, source_file, digest.md5())
+			self._record_strategy('upload', destination.geturl())
 		else:
 			raise NotImplementedError("Can't upload data to remote servers. Try local repository or S3")
+		return digest
+
+class ExportWatermark(object):
+	"""
+	Records how far a database has been exported, so later exports can include only what changed. The watermark is the highest percept ID and the latest annotation stamp in the database at the time of export.
+
+	Percepts are considered changed if they were added, or if any of their annotations were added or restamped. Deletions, and changes to percept tags or properties alone, are not detected.
+
+	A transaction that was still running when the watermark was taken can commit a percept with a lower ID, or an annotation with an earlier stamp, afterwards. So that such rows aren't skipped, the selection reaches back :py:data:`kWatermarkIDOverlap` IDs and :py:data:`kWatermarkStampOverlap` before the watermark, and some percepts are exported again; consumers should replace percepts they already have (or, with :py:class:`Importer`, skip them with ``skip_existing``). A transaction that runs for longer than the overlap can still be missed.
+
+	:param int percept_id: highest percept ID exported
+	:param annotation_stamp: latest annotation stamp exported
+	:type annotation_stamp: :py:class:`~datetime.datetime`
+	"""
+	def __init__(self, percept_id=0, annotation_stamp=None):
+		self.percept_id = percept_id
+		self.annotation_stamp = annotation_stamp
+
+	@classmethod
+	def current(cls, session):
+		""" Gets the watermark for the current contents of the database """
+		percept_id = session.query(sa.func.max(rigor.types.Percept.id)).scalar()
+		annotation_stamp = session.query(sa.func.max(rigor.types.Annotation.stamp)).scalar()
+		return cls(percept_id or 0, annotation_stamp)
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Reads a watermark saved with :py:meth:`save`
+
+		:param str path: watermark file
+		:return: saved watermark, or an empty watermark (so everything is exported) if the file doesn't exist
+		:rtype: :py:class:`ExportWatermark`
+		"""
+		try:
+			with open(path, 'rb') as watermark_file:
+				saved = json.load(watermark_file)
+		except IOError as err:
+			if err.errno != errno.ENOENT:
+				raise
+			return cls()
+		annotation_stamp = saved.get('annotation_stamp')
+		if annotation_stamp is not None:
+			annotation_stamp = rigor.utils.parse_timestamp(annotation_stamp)
+		return cls(saved.get('percept_id', 0), annotation_stamp)
+
+	def save(self, path):
+		"""
+		Writes the watermark to a file. The file is replaced atomically, so an interrupted save leaves the previous watermark intact.
+
+		:param str path: watermark file
+		"""
+		annotation_stamp = self.annotation_stamp
+		if annotation_stamp is not None and annotation_stamp.utcoffset() is not None:
+			# Stored as naive UTC, like other Rigor timestamps
+			annotation_stamp = (annotation_stamp - annotation_stamp.utcoffset()).replace(tzinfo=None)
+		directory = os.path.dirname(os.path.abspath(path))
+		handle, temporary = tempfile.mkstemp(prefix='.rigor-', dir=directory)
+		try:
+			with os.fdopen(handle, 'wb') as watermark_file:
+				json.dump({'percept_id': self.percept_id, 'annotation_stamp': annotation_stamp}, watermark_file, cls=rigor.utils.RigorJSONEncoder)
+			os.rename(temporary, path)
+		except:
+			os.unlink(temporary)
+			raise
+
+	def selection(self):
+		"""
+		:return: filter selecting percepts changed since this watermark, reaching back by the overlap
+		:rtype: :py:class:`~rigor.filters.ChangedSince`
+		"""
+		annotation_stamp = self.annotation_stamp
+		if annotation_stamp is not None:
+			annotation_stamp -= kWatermarkStampOverlap
+		return rigor.filters.ChangedSince(max(0, self.percept_id - kWatermarkIDOverlap), annotation_stamp)
+
+	def __repr__(self):
+		return "ExportWatermark({0!r}, {1!r})".format(self.percept_id, self.annotation_stamp)
 
 class Exporter(object):
 	"""
 	Exports the data in a rigor database to a metadata file
 
+	Percepts are read in batches, in ID order, with their tags, properties, annotations and collections loaded by one query per relationship for each batch. Each batch is written out and removed from the session before the next is read, so memory use doesn't grow with the size of the database.
+
 	:param config: Configuration data
 	:type config: :py:class:`~rigor.config.RigorConfiguration` instance
 	:param str database: Name of the database to export
 	:param str filename: Name of the file to write
+	:param bool json_lines: If :py:const:`True`, write one percept per line (JSON Lines) instead of a JSON array. Both formats can be read by :py:class:`Importer`.
+	:param int batch_size: Number of percepts to read from the database at a time
+	:param bool columnar: If :py:const:`True`, ``filename`` is a directory, and data is written as column arrays for analysis with NumPy (see :py:func:`rigor.columnar.export_columns`). This requires NumPy.
 	"""
-	def __init__(self, config, database, filename):
+	def __init__(self, config, database, filename, json_lines=False, batch_size=kDefaultExportBatchSize, columnar=False):
 		self._filename = filename
 		self._config = config
+		self._json_lines = json_lines
+		self._columnar = columnar
+		self._batch_size = max(1, batch_size)
 		self._database = rigor.database.Database(database, config)
+		#: Watermark for the data exported by the last call to :py:meth:`run`
+		self.watermark = None
+
+	def _iter_percepts(self, session, selection=None):
+		""" Yields serialized percepts in ID order, one batch at a time """
+		Percept = rigor.types.Percept
+		Annotation = rigor.types.Annotation
+		query = session.query(Percept).options(
+				sa.orm.subqueryload(Percept.tags),
+				sa.orm.subqueryload(Percept.properties),
+				sa.orm.subqueryload(Percept.annotations).subqueryload(Annotation.tags),
+				sa.orm.subqueryload(Percept.annotations).subqueryload(Annotation.properties),
+				sa.orm.subqueryload(Percept.collections).joinedload(rigor.types.PerceptCollection.collection),
+		)
+		if selection is not None:
+			query = query.filter(selection.clause())
+		last_id = None
+		while True:
+			batch_query = query
+			if last_id is not None:
+				batch_query = batch_query.filter(Percept.id > last_id)
+			percepts = batch_query.order_by(Percept.id).limit(self._batch_size).all()
+			if not percepts:
+				return
+			for percept in percepts:
+				yield percept.serialize(True)
+			last_id = percepts[-1].id
+			session.expunge_all()
 
-	def run(self, tag=None):
+	def run(self, tag=None, selection=None, since=None):
 		"""
 		Performs the export operation.
 
 		:param str tag: If a tag is specified, exported percepts will be restricted to those with matching tag.
+		:param selection: If a filter is specified, exported percepts will be restricted to those it matches
+		:type selection: :py:class:`~rigor.filters.PerceptFilter`
+		:param since: If a watermark from a previous export is given, only percepts that changed since then are exported
+		:type since: :py:class:`ExportWatermark`
+		:return: number of percepts exported
+		:rtype: int
 		"""
+		if tag:
+			tag_filter = rigor.filters.HasTag(tag)
+			selection = tag_filter if selection is None else tag_filter & selection
+		if since is not None:
+			selection = since.selection() if selection is None else since.selection() & selection
+		if self._columnar:
+			return self._run_columnar(selection)
+		count = 0
 		with open(self._filename, 'wb') as out_file:
-			with self._database.get_session(False) as session:
-				query = session.query(rigor.types.Percept)
-				if tag:
-					query = query.join(rigor.types.PerceptTag).filter(rigor.types.PerceptTag.name == tag)
-				first = True
-				query.order_by(rigor.types.Percept.id)
-				out_file.write('[\n')
-				for percept in query.all():
-					if first:
-						first = False
+			with self._database.get_session(read_only=True) as session:
+				# Taken first, so anything changed during the export is exported again next time
+				watermark = ExportWatermark.current(session)
+				if not self._json_lines:
+					out_file.write('[\n')
+				for serialized in self._iter_percepts(session, selection):
+					if self._json_lines:
+						json.dump(serialized, out_file, cls=rigor.utils.RigorJSONEncoder)
+						out_file.write('\n')
 					else:
-						out_file.write(',\n')
-					json.dump(percept.serialize(True), out_file, cls=rigor.utils.RigorJSONEncoder)
-			out_file.write('\n]\n')
+						if count:
+							out_file.write(',\n')
+						json.dump(serialized, out_file, cls=rigor.utils.RigorJSONEncoder)
+					count += 1
+			if not self._json_lines:
+				out_file.write('\n]\n')
+		self.watermark = watermark
+		return count
+
+	def _run_columnar(self, selection):
+		""" Exports column arrays instead of JSON """
+		import rigor.columnar
+		with self._database.get_session(read_only=True) as session:
+			watermark = ExportWatermark.current(session)
+			counts = rigor.columnar.export_columns(session, self._filename, selection, self._batch_size)
+		self.watermark = watermark
+		return counts['percept']
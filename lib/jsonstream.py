@@ -0,0 +1,222 @@
+"""
+Streaming readers for percept metadata, so that very large metadata files can be imported in constant memory
+
+Supported formats are JSON Lines (one object per line), any other sequence of whitespace-separated JSON objects (including a file containing a single object), and a top-level JSON array of objects, which is parsed one element at a time.
+"""
+
+import json
+import os
+import re
+
+#: Number of bytes read at a time
+kChunkSize = 0x10000
+
+#: Largest single JSON value that may be read, in bytes
+kMaxBufferSize = 0x10000000
+
+#: File extensions included when reading metadata from a directory
+kMetadataExtensions = ('.json', '.jsonl', '.ndjson')
+
+_kWhitespace = re.compile(r'[ \t\n\r]*')
+
+# Characters that open or close a container or string, outside of a string
+_kStructure = re.compile(r'["\[\]{}]')
+
+# Characters that end or escape within a string
+_kStringSpecial = re.compile(r'["\\]')
+
+# Characters that end a number or literal
+_kScalarEnd = re.compile(r'[ \t\n\r,:\[\]{}"]')
+
+class _Reader(object):
+	""" Buffers a file, tracking a position within the buffer """
+	def __init__(self, file_object, chunk_size, max_size=None):
+		self._file = file_object
+		self._chunk_size = chunk_size
+		self._max_size = kMaxBufferSize if max_size is None else max_size
+		self.buffer = ''
+		self.position = 0
+		self.eof = False
+
+	def fill(self):
+		"""
+		Reads more data, discarding consumed data. At least a chunk is read, or as much as is already buffered, so a value spanning many chunks is read in linear time.
+
+		:return: :py:const:`False` at end of file
+		:raises ValueError: if the unconsumed data would grow larger than the maximum buffer size
+		"""
+		if self.eof:
+			return False
+		pending = len(self.buffer) - self.position
+		if pending >= self._max_size:
+			raise ValueError("JSON value is larger than {0} bytes".format(self._max_size))
+		size = min(max(self._chunk_size, pending), self._max_size - pending)
+		chunk = self._file.read(size)
+		self.buffer = self.buffer[self.position:] + chunk
+		self.position = 0
+		if not chunk:
+			self.eof = True
+			return False
+		return True
+
+	def peek(self):
+		""" Skips whitespace, and returns the next character, or :py:const:`None` at end of file """
+		while True:
+			self.position = _kWhitespace.match(self.buffer, self.position).end()
+			if self.position < len(self.buffer):
+				return self.buffer[self.position]
+			if not self.fill():
+				return None
+
+	def _fill_from(self, index):
+		""" Fills the buffer, returning the given buffer offset adjusted for the discarded data, or :py:const:`None` at end of file """
+		offset = self.position
+		if not self.fill():
+			return None
+		return index - offset
+
+	def _find_end(self):
+		"""
+		Reads until the buffer holds the whole of the next value, by matching brackets and quotes without decoding it
+
+		:return: offset after the end of the value, or :py:const:`None` if the file ends first
+		"""
+		if self.buffer[self.position] not in '{["':
+			index = self.position
+			while True:
+				match = _kScalarEnd.search(self.buffer, index)
+				if match is not None:
+					return match.start()
+				index = self._fill_from(len(self.buffer))
+				if index is None:
+					return len(self.buffer)
+		depth = 0
+		in_string = False
+		index = self.position
+		while True:
+			if in_string:
+				match = _kStringSpecial.search(self.buffer, index)
+				if match is not None and match.group() == '\\':
+					if match.end() < len(self.buffer):
+						index = match.end() + 1
+						continue
+					# The escaped character is in the next chunk
+					index = match.start()
+				elif match is not None:
+					in_string = False
+					index = match.end()
+					if depth == 0:
+						return index
+					continue
+				else:
+					index = len(self.buffer)
+			else:
+				match = _kStructure.search(self.buffer, index)
+				if match is not None:
+					index = match.end()
+					character = match.group()
+					if character == '"':
+						in_string = True
+					elif character in '[{':
+						depth += 1
+					else:
+						depth -= 1
+						if depth <= 0:
+							return index
+					continue
+				index = len(self.buffer)
+			index = self._fill_from(index)
+			if index is None:
+				return None
+
+	def decode(self, decoder):
+		"""
+		Decodes the next JSON value, reading more data as needed. The value is decoded once, after all of it has been read, so an error is always in the data itself.
+
+		:raises ValueError: if the data isn't valid JSON, or ends in the middle of a value
+		"""
+		if self.peek() is None:
+			raise ValueError("Unexpected end of JSON data")
+		if self._find_end() is None:
+			raise ValueError("Unexpected end of JSON data")
+		value, end = decoder.raw_decode(self.buffer, self.position)
+		self.position = end
+		return value
+
+def _iter_values(reader):
+	decoder = json.JSONDecoder()
+	while reader.peek() is not None:
+		yield reader.decode(decoder)
+
+def _iter_array(reader):
+	decoder = json.JSONDecoder()
+	if reader.peek() != '[':
+		raise ValueError("Expected a JSON array")
+	reader.position += 1
+	if reader.peek() == ']':
+		reader.position += 1
+	else:
+		while True:
+			yield reader.decode(decoder)
+			separator = reader.peek()
+			reader.position += 1
+			if separator == ']':
+				break
+			if separator != ',':
+				raise ValueError("Expected ',' or ']' in JSON array, found {0!r}".format(separator))
+	if reader.peek() is not None:
+		raise ValueError("Unexpected data after JSON array")
+
+def iter_json_values(file_object, chunk_size=kChunkSize):
+	"""
+	Reads a sequence of whitespace-separated JSON values, such as JSON Lines, one at a time
+
+	:param file file_object: open file to read
+	:param int chunk_size: number of bytes to read at a time
+	:return: generator of decoded values
+	"""
+	return _iter_values(_Reader(file_object, chunk_size))
+
+def iter_json_array(file_object, chunk_size=kChunkSize):
+	"""
+	Reads the elements of a top-level JSON array one at a time, without loading the whole array
+
+	:param file file_object: open file to read
+	:param int chunk_size: number of bytes to read at a time
+	:return: generator of decoded array elements
+	:raises ValueError: if the file doesn't contain a valid JSON array
+	"""
+	return _iter_array(_Reader(file_object, chunk_size))
+
+def iter_metadata_file(file_object, chunk_size=kChunkSize):
+	"""
+	Reads percept metadata entries from a file, which may contain a JSON array of entries, or a sequence of entries (JSON Lines or a single entry)
+
+	:param file file_object: open file to read
+	:param int chunk_size: number of bytes to read at a time
+	:return: generator of metadata entries
+	"""
+	reader = _Reader(file_object, chunk_size)
+	if reader.peek() == '[':
+		return _iter_array(reader)
+	return _iter_values(reader)
+
+def iter_metadata(path, chunk_size=kChunkSize):
+	"""
+	Reads percept metadata entries from a file, or from all metadata files (``*.json``, ``*.jsonl`` and ``*.ndjson``) in a directory and its subdirectories, in sorted order
+
+	:param str path: path to a metadata file or directory
+	:param int chunk_size: number of bytes to read at a time
+	:return: generator of metadata entries
+	"""
+	if os.path.isdir(path):
+		for directory, subdirectories, filenames in os.walk(path):
+			subdirectories.sort()
+			for filename in sorted(filenames):
+				if os.path.splitext(filename)[1].lower() in kMetadataExtensions:
+					for entry in iter_metadata(os.path.join(directory, filename), chunk_size):
+						yield entry
+		return
+	with open(path, 'rb') as metadata_file:
+		for entry in iter_metadata_file(metadata_file, chunk_size):
+			yield entry
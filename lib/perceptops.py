@@ -1,30 +1,384 @@
 """ Various utilities for dealing with percept data """
 
-from rigor.s3 import DefaultS3Client
-from rigor.types import Percept
+import rigor.s3
+import rigor.workers
+from rigor.types import Percept, PerceptTag, PerceptProperty, PerceptSensors, PerceptCollection, Annotation, AnnotationTag, AnnotationProperty
+from rigor.querycache import increment_write_version
+from rigor.datacache import DataCache, DataVerificationError
+from rigor.httppool import HTTPConnectionPool
+from rigor.imagecache import DecodedImageCache
 
 try:
-	import cv2
 	import numpy as np
+except ImportError:
+	pass
+
+try:
+	import cv2
 	_kImageReadFlags = cv2.CV_LOAD_IMAGE_UNCHANGED
 except ImportError:
 	pass
 
-from urlparse import urlsplit
-import urllib2
+from urlparse import urlsplit, urldefrag
+import sqlalchemy as sa
 import contextlib
+import httplib
+import urllib2
+import errno
+import struct
+import math
+import time
+import io
+import stat
+import mmap
 import os
 
+def _map_data(data):
+	"""
+	Maps an open file into memory, so its data can be used without being copied. Data that isn't in a regular file (for example, remote data that isn't cached) is read instead.
+
+	:param data: open file-like object, positioned at the start of the data
+	:return: mapped or read data
+	:rtype: :py:class:`mmap.mmap` or :py:class:`buffer`
+	"""
+	try:
+		fileno = data.fileno()
+		status = os.fstat(fileno)
+	except (AttributeError, IOError, OSError):
+		return buffer(data.read())
+	if not stat.S_ISREG(status.st_mode) or status.st_size == 0 or data.tell() != 0:
+		return buffer(data.read())
+	# The mapping holds its own reference to the file, so it stays valid after the file is closed
+	return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+@contextlib.contextmanager
+def _mapped(data):
+	with data as opened:
+		buffer = _map_data(opened)
+	try:
+		yield buffer
+	finally:
+		if isinstance(buffer, mmap.mmap):
+			buffer.close()
+
+#: Default number of percepts fetched at once by :py:meth:`PerceptOps.fetch_many`
+kDefaultFetchConcurrency = 8
+
+#: Default number of times :py:meth:`PerceptOps.fetch_many` retries a failed fetch
+kDefaultFetchRetries = 3
+
+#: Default most bytes of percept data fetched by :py:meth:`PerceptOps.fetch_many` but not yet consumed
+kDefaultFetchBytes = 0x10000000
+
+#: Seconds to wait before retrying a failed fetch; the delay doubles with each later retry
+kFetchRetryDelay = 0.5
+
+#: Number of percepts deleted by each statement in :py:meth:`PerceptOps.destroy_many`
+kDestroyBatchSize = 500
+
+#: Default number of threads removing data in :py:meth:`PerceptOps.destroy_many`
+kDefaultRemoveConcurrency = 8
+
+#: Most local files removed by each task in :py:meth:`PerceptOps.destroy_many`
+kRemoveBatchSize = 100
+
+# Errors that won't go away if the fetch is retried
+_kPermanentErrors = frozenset((errno.ENOENT, errno.EACCES, errno.EISDIR, errno.ENOTDIR))
+
+def _is_transient(error):
+	""" :return: whether a failed fetch might succeed if it's retried """
+	if isinstance(error, DataVerificationError):
+		return False
+	if isinstance(error, urllib2.HTTPError):
+		return error.code >= 500
+	if isinstance(error, EnvironmentError):
+		return error.errno not in _kPermanentErrors
+	return isinstance(error, httplib.HTTPException)
+
+# JPEG start-of-frame markers, which hold the image size; 0xc4, 0xc8 and 0xcc are other markers in the same range
+_kJPEGFrameMarkers = frozenset(range(0xc0, 0xd0)) - frozenset((0xc4, 0xc8, 0xcc))
+
+def _jpeg_header(data):
+	"""
+	Reads the size of a JPEG image from its header
+
+	:param data: image data
+	:return: (height, width, number of color components), or :py:const:`None` if the data isn't a JPEG image
+	"""
+	if data[:2] != '\xff\xd8':
+		return None
+	position = 2
+	while position + 4 <= len(data):
+		if data[position] != '\xff':
+			return None
+		marker = ord(data[position + 1])
+		if marker == 0xff:
+			# Fill byte
+			position += 1
+			continue
+		if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+			# Markers without a length
+			position += 2
+			continue
+		if marker in _kJPEGFrameMarkers:
+			if position + 10 > len(data):
+				return None
+			_, height, width, components = struct.unpack('>BHHB', data[position + 4:position + 10])
+			return (height, width, components)
+		position += 2 + struct.unpack('>H', data[position + 2:position + 4])[0]
+	return None
+
+def _reduced_decode(data, scale):
+	"""
+	Chooses how to decode an image at a reduced size. JPEG images can be decoded at 1/2, 1/4 or 1/8 size, which is much faster than decoding at full size, by versions of OpenCV with reduced decode modes.
+
+	:return: (reduction factor, OpenCV flags, full size as (height, width) if known)
+	"""
+	if scale is None or scale > 0.5:
+		return (1, _kImageReadFlags, None)
+	header = _jpeg_header(data)
+	if header is None:
+		return (1, _kImageReadFlags, None)
+	height, width, components = header
+	# Reduced modes convert to grayscale or color, so are only used when that won't change the image's channels
+	if components in (1, 3):
+		for factor in (8, 4, 2):
+			flags = getattr(cv2, 'IMREAD_REDUCED_{0}_{1}'.format('GRAYSCALE' if components == 1 else 'COLOR', factor), None)
+			if flags is not None and scale <= 1.0 / factor:
+				# Like the unchanged mode, doesn't rotate the image according to its EXIF orientation
+				return (factor, flags | getattr(cv2, 'IMREAD_IGNORE_ORIENTATION', 0), (height, width))
+	return (1, _kImageReadFlags, (height, width))
+
+def _decode_buffer(data, scale=None, roi=None):
+	factor, flags, size = _reduced_decode(data, scale)
+	image = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+	if image is None or (scale is None and roi is None):
+		return image
+	if size is None:
+		size = image.shape[:2]
+	height, width = size
+	left, top, right, bottom = 0, 0, width, height
+	if roi is not None:
+		x, y, roi_width, roi_height = roi
+		left, top = max(0, x), max(0, y)
+		right, bottom = min(width, x + roi_width), min(height, y + roi_height)
+		if right <= left or bottom <= top:
+			raise ValueError("Region {0} is outside the image, which is {1}x{2}".format(roi, width, height))
+		# Copied, so the rest of the decoded image can be freed
+		image = image[top // factor:-(-bottom // factor), left // factor:-(-right // factor)].copy()
+	if scale is None:
+		return image
+	target = (max(1, int(round((right - left) * scale))), max(1, int(round((bottom - top) * scale))))
+	if target == (image.shape[1], image.shape[0]):
+		return image
+	return cv2.resize(image, target, interpolation=cv2.INTER_AREA)
+
+#: Default number of frames in each block returned by :py:meth:`AudioOps.frames`
+kDefaultAudioBlockSize = 0x10000
+
+#: Bytes read at a time by :py:meth:`AudioOps.frames` from remote data
+kAudioReadSize = 0x100000
+
+_kWAVEFormatPCM = 1
+_kWAVEFormatFloat = 3
+_kWAVEFormatExtensible = 0xfffe
+
+class AudioFormat(object):
+	"""
+	Layout of uncompressed audio data
+
+	:param float sample_rate: frames per second
+	:param int channels: number of channels
+	:param int sample_width: bytes in each sample of one channel
+	:param bool floating_point: whether samples are floating-point numbers, rather than integers
+	:param int data_offset: offset of the first frame in the data
+	:param int frame_count: number of frames, or :py:const:`None` if the frames continue to the end of the data
+	"""
+
+	def __init__(self, sample_rate, channels, sample_width, floating_point=False, data_offset=0, frame_count=None):
+		self.sample_rate = sample_rate
+		self.channels = channels
+		self.sample_width = sample_width
+		self.floating_point = floating_point
+		self.data_offset = data_offset
+		self.frame_count = frame_count
+
+	@property
+	def frame_size(self):
+		""" Bytes in each frame """
+		return self.channels * self.sample_width
+
+	@property
+	def dtype(self):
+		""" NumPy type of decoded samples; 24-bit samples are decoded as 32-bit integers """
+		if self.floating_point:
+			return np.dtype('<f{0}'.format(self.sample_width))
+		if self.sample_width == 1:
+			return np.dtype(np.uint8)
+		return np.dtype('<i{0}'.format(4 if self.sample_width == 3 else self.sample_width))
+
+	def __repr__(self):
+		return "AudioFormat(sample_rate={0}, channels={1}, sample_width={2}, floating_point={3}, data_offset={4}, frame_count={5})".format(self.sample_rate, self.channels, self.sample_width, self.floating_point, self.data_offset, self.frame_count)
+
+def _read_exactly(data, size):
+	chunk = data.read(size)
+	if len(chunk) != size:
+		raise ValueError("Audio data ends in its header")
+	return chunk
+
+def _skip_to(data, position, target):
+	""" Moves data forward from ``position`` to ``target``, seeking if it can, or else reading and discarding what's in between """
+	try:
+		data.seek(target)
+		return
+	except (AttributeError, IOError):
+		# Streamed responses can't seek; io.UnsupportedOperation is an IOError
+		pass
+	while position < target:
+		skipped = len(data.read(min(target - position, kAudioReadSize)))
+		if skipped == 0:
+			return
+		position += skipped
+
+def _read_wav_format(data):
+	"""
+	Reads the header of WAV data, leaving the data positioned at the first frame
+
+	:param data: file-like object positioned at the start of the data; chunks before the audio are skipped by seeking, or by reading if it can't seek
+	:rtype: :py:class:`AudioFormat`
+	"""
+	riff, _, wave = struct.unpack('<4sI4s', _read_exactly(data, 12))
+	if riff != 'RIFF' or wave != 'WAVE':
+		raise ValueError("Audio data isn't in WAV format")
+	position = 12
+	audio_format = None
+	while True:
+		chunk_id, chunk_size = struct.unpack('<4sI', _read_exactly(data, 8))
+		position += 8
+		if chunk_id == 'fmt ':
+			header = _read_exactly(data, chunk_size)
+			format_tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', header[:16])
+			if format_tag == _kWAVEFormatExtensible and len(header) >= 26:
+				# The real format is the first two bytes of the subformat GUID
+				format_tag = struct.unpack('<H', header[24:26])[0]
+			if format_tag not in (_kWAVEFormatPCM, _kWAVEFormatFloat):
+				raise ValueError("WAV format {0} isn't uncompressed audio".format(format_tag))
+			audio_format = AudioFormat(float(sample_rate), channels, (bits + 7) // 8, format_tag == _kWAVEFormatFloat)
+		elif chunk_id == 'data':
+			if audio_format is None:
+				raise ValueError("WAV data has no format chunk before its data")
+			audio_format.data_offset = position
+			# Recorders that can't seek back to fill in the size leave it unset
+			if chunk_size not in (0, 0xffffffff):
+				audio_format.frame_count = chunk_size // audio_format.frame_size
+			return audio_format
+		else:
+			_skip_to(data, position, position + chunk_size + (chunk_size & 1))
+		position += chunk_size + (chunk_size & 1)
+		if chunk_id == 'fmt ' and chunk_size & 1:
+			_skip_to(data, position - 1, position)
+
+def _decode_samples(raw, audio_format):
+	""" Converts whole frames of raw data into an array with a row for each frame """
+	if audio_format.sample_width == 3:
+		packed = np.frombuffer(raw, np.uint8).reshape(-1, 3).astype(np.int32)
+		# Shifted into the top three bytes, then back down, to extend the sign
+		samples = ((packed[:, 0] << 8) | (packed[:, 1] << 16) | (packed[:, 2] << 24)) >> 8
+		# Read-only, like the views of the raw data other widths decode to
+		samples.flags.writeable = False
+	else:
+		samples = np.frombuffer(raw, audio_format.dtype)
+	return samples.reshape(-1, audio_format.channels)
+
+class _RangedFile(object):
+	"""
+	Read-only file-like object over a percept's data, reading a range at a time so data can be used before all of it has been transferred. If a range can't be read alone, and all of the data is read instead (see :py:class:`~rigor.utils.RangeData`), all of it is kept, and no more ranges are read.
+	"""
+
+	def __init__(self, ops, percept, read_size=None):
+		self._ops = ops
+		self._percept = percept
+		self._read_size = read_size or kAudioReadSize
+		self._position = 0
+		self._buffer = ''
+		self._buffer_start = 0
+		self._whole = False
+
+	def _fetch(self, end):
+		""" Reads the data from the current position to ``end``, or keeps all of the data if that's what was read """
+		data = self._ops.fetch_range(self._percept, self._position, end)
+		if data is None:
+			raise IOError(errno.ENOENT, "No data for percept", self._percept.locator)
+		with data as opened:
+			whole = getattr(opened, 'whole', None)
+			if whole is not None:
+				self._buffer = whole
+				self._buffer_start = 0
+				self._whole = True
+				return
+			self._buffer = opened.read()
+		self._buffer_start = self._position
+
+	def read(self, size=-1):
+		if size < 0:
+			if not self._whole:
+				self._fetch(None)
+			chunk = self._buffer[max(0, self._position - self._buffer_start):]
+			self._position += len(chunk)
+			return chunk
+		chunks = list()
+		while size > 0:
+			offset = self._position - self._buffer_start
+			if not 0 <= offset < len(self._buffer):
+				if self._whole:
+					break
+				self._fetch(self._position + max(size, self._read_size))
+				offset = self._position - self._buffer_start
+				if not 0 <= offset < len(self._buffer):
+					break
+			chunk = self._buffer[offset:offset + size]
+			chunks.append(chunk)
+			self._position += len(chunk)
+			size -= len(chunk)
+		return ''.join(chunks)
+
+	def seek(self, offset, whence=os.SEEK_SET):
+		if whence != os.SEEK_SET:
+			raise IOError(errno.EINVAL, "Only absolute positions are supported")
+		self._position = offset
+
+	def tell(self):
+		return self._position
+
+	def close(self):
+		self._buffer = ''
+
 class PerceptOps(object):
 	"""
 	Various utilities for dealing with percept data
 
+	Remote (S3 or HTTP) data is cached on local disk if a cache is given, or configured with ``data_cache_path`` in the ``cache`` section of the configuration. See :py:mod:`rigor.datacache`.
+
+	HTTP data is read through a pool of keep-alive connections, configured with the ``http`` section of the configuration. See :py:mod:`rigor.httppool`.
+
 	:param config: configuration data
 	:type config: :py:class:`~rigor.config.RigorConfiguration`
+	:param cache: cache for remote data; if :py:const:`None`, a cache is created from the configuration, if one is configured
+	:type cache: :py:class:`~rigor.datacache.DataCache`
+	:param http: connection pool for HTTP data; if :py:const:`None`, a pool is created from the configuration
+	:type http: :py:class:`~rigor.httppool.HTTPConnectionPool`
 	"""
 
-	def __init__(self, config):
+	def __init__(self, config, cache=None, http=None):
 		self._config = config
+		if cache is None:
+			cache = DataCache.from_config(config)
+		#: Cache for remote data, or :py:const:`None`
+		self.cache = cache
+		if http is None:
+			http = HTTPConnectionPool.from_config(config)
+		#: Connection pool for HTTP data
+		self.http = http
 
 	def fetch(self, percept):
 		"""
@@ -34,25 +388,178 @@ class PerceptOps(object):
 		:return: percept data
 		:rtype: file
 		"""
-		return self.read(percept.locator, percept.credentials)
+		hash_value = getattr(percept, 'hash', None)
+		if hash_value is None:
+			return self.read(percept.locator, percept.credentials)
+		return self.read(percept.locator, percept.credentials, hash_value)
 
-	def read(self, url, credentials=None):
+	def fetch_many(self, percepts, concurrency=kDefaultFetchConcurrency, ordered=True, retries=kDefaultFetchRetries, max_bytes=kDefaultFetchBytes):
+		"""
+		Fetches data for many percepts at once, using several threads. Fetches that fail with network errors, or server errors that are likely to be temporary, are retried.
+
+		Percepts are fetched only as fast as their data is consumed: once the data fetched but not yet returned adds up to ``max_bytes`` (as given by each percept's ``byte_count``), no more fetches start until some is returned.
+
+		If a fetch fails, its exception is raised when its percept would have been returned. No more fetches start, and data already fetched for later percepts is closed, if it's file-like (subclasses such as :py:class:`ImageOps` fetch decoded arrays, which are simply dropped). The same happens if the generator is closed early.
+
+		Fetches aren't grouped by backend or bucket: percepts are fetched in the order given, and connections are reused through the shared HTTP connection pool and S3 clients, whichever backends they're from.
+
+		:param percepts: iterable of percepts; it's read as percepts are fetched, so it can be a query or generator of any length
+		:param int concurrency: number of percepts fetched at once
+		:param bool ordered: if :py:const:`True`, percepts are returned in the order given; otherwise, they are returned as soon as they are fetched
+		:param int retries: number of times a failed fetch is retried
+		:param int max_bytes: most bytes of data fetched but not yet returned
+		:return: generator of (percept, data) tuples, with data as from :py:meth:`fetch`; the caller should close each
+		"""
+		def fetch(percept):
+			attempt = 0
+			while True:
+				try:
+					return self.fetch(percept)
+				except Exception as err:
+					if attempt >= retries or not _is_transient(err):
+						raise
+				time.sleep(kFetchRetryDelay * (2 ** attempt))
+				attempt += 1
+		def size(arguments):
+			return getattr(arguments[0], 'byte_count', None) or 0
+		stopped = list()
+		def arguments():
+			for percept in percepts:
+				if stopped:
+					return
+				yield (percept, )
+		with rigor.workers.WorkerPool(fetch, concurrency) as pool:
+			results = pool.imap(arguments(), ordered, size, max_bytes)
+			try:
+				for (percept, ), data, error in results:
+					if error is not None:
+						raise error
+					yield (percept, data)
+			finally:
+				# Close data the caller will never receive
+				stopped.append(True)
+				for _, data, _ in results:
+					close = getattr(data, 'close', None)
+					if close is not None:
+						close()
+
+	def fetch_buffer(self, percept):
+		"""
+		Given a percept, this will fetch its data from the repository as a buffer; see :py:meth:`read_buffer`
+
+		:param dict percept: percept metadata
+		:return: context manager giving the percept data
+		"""
+		hash_value = getattr(percept, 'hash', None)
+		if hash_value is None:
+			return self.read_buffer(percept.locator, percept.credentials)
+		return self.read_buffer(percept.locator, percept.credentials, hash_value)
+
+	def read_buffer(self, url, credentials=None, hash_value=None):
+		"""
+		Reads data from the specified URL as a buffer, which can be passed to :py:func:`numpy.frombuffer` or sliced, returning a context manager giving the buffer. Local files, and remote data in the cache, are mapped into memory rather than read, so their data is not copied; the buffer must not be used once the context manager exits.
+
+		:param str url: URL containing data
+		:param str credentials: optional name of configuration section with S3 credentials
+		:param str hash_value: hash of the data, if known
+		:return: context manager giving a :py:class:`mmap.mmap` or :py:class:`buffer`, or :py:const:`None` if there is no data at the URL
+		"""
+		data = self.read(url, credentials, hash_value)
+		if data is None:
+			return None
+		return _mapped(data)
+
+	def fetch_range(self, percept, start, end=None):
+		"""
+		Given a percept, this will fetch part of its data from the repository; see :py:meth:`read_range`
+
+		:param dict percept: percept metadata
+		:param int start: offset of the first byte to read
+		:param int end: offset after the last byte to read; if :py:const:`None`, the rest of the data is read
+		:return: percept data in the range
+		:rtype: file
+		"""
+		hash_value = getattr(percept, 'hash', None)
+		return self.read_range(percept.locator, start, end, percept.credentials, hash_value)
+
+	def fetch_time_range(self, percept, start_time, end_time=None, data_offset=0, frame_size=1):
+		"""
+		Given a percept with samples at a fixed rate, such as uncompressed audio, this will fetch the data for the samples in a range of times. The percept's ``sample_rate`` must be set. The data is assumed to be a header followed by fixed-size frames, each holding one sample (for all channels).
+
+		:param dict percept: percept metadata
+		:param float start_time: time of the first sample to read, in seconds
+		:param float end_time: time after the last sample to read, in seconds; if :py:const:`None`, the rest of the samples are read
+		:param int data_offset: size of the header before the first sample, in bytes
+		:param int frame_size: size of each sample, in bytes
+		:return: (index of the first sample read, data for the samples)
+		:rtype: tuple
+		"""
+		if not percept.sample_rate:
+			raise ValueError("Percept {0} has no sample rate".format(percept.locator))
+		first = max(0, int(start_time * percept.sample_rate))
+		end = None
+		if end_time is not None:
+			last = max(first, int(math.ceil(end_time * percept.sample_rate)))
+			if percept.sample_count is not None:
+				last = min(last, percept.sample_count)
+			end = data_offset + last * frame_size
+		return (first, self.fetch_range(percept, data_offset + first * frame_size, end))
+
+	def read_range(self, url, start, end=None, credentials=None, hash_value=None):
+		"""
+		Reads part of the data at the specified URL, returning it as an open file-like object with a :py:func:`contextlib.closing` wrapper. Only the requested range is transferred from S3 or HTTP servers, unless the data is cached, in which case it's read from the cache.
+
+		:param str url: URL containing data
+		:param int start: offset of the first byte to read
+		:param int end: offset after the last byte to read; if :py:const:`None`, the rest of the data is read
+		:param str credentials: optional name of configuration section with S3 credentials
+		:param str hash_value: hash of the data, if known; used to find it in the cache
+		:return: data in the range, which is shorter than requested if the data ends first, or :py:const:`None` if there is no data at the URL
+		"""
+		parsed = urlsplit(url)
+		data = None
+		if not parsed.netloc:
+			data = open(parsed.path, 'rb')
+		elif self.cache is not None:
+			data = self.cache.open(url, hash_value)
+		if data is not None:
+			with data:
+				data.seek(start)
+				return contextlib.closing(io.BytesIO(data.read(-1 if end is None else max(0, end - start))))
+		if parsed.scheme == 's3':
+			s3 = rigor.s3.get_client(self._config, parsed.netloc, credentials)
+			data = s3.get_range(parsed.path, start, end)
+		else:
+			data = self.http.get_range(url, start, end)
+		if data is None:
+			return None
+		return contextlib.closing(data)
+
+	def read(self, url, credentials=None, hash_value=None):
 		"""
 		Reads data from the specified URL, returning it as an open file-like object with a :py:func:`contextlib.closing` wrapper
 
 		:param str url: URL containing data
 		:param str credentials: optional name of configuration section with S3 credentials
+		:param str hash_value: hash of the data, if known; remote data is checked against it when it's cached, if it's a SHA-256 hash
 		"""
 		parsed = urlsplit(url)
 		if not parsed.netloc:
 			return open(parsed.path, 'rb')
+		if self.cache is not None:
+			cached = self.cache.open(url, hash_value)
+			if cached is not None:
+				return cached
 		if parsed.scheme == 's3':
-			s3 = DefaultS3Client(self._config, parsed.netloc, credentials)
+			s3 = rigor.s3.get_client(self._config, parsed.netloc, credentials)
 			data = s3.get(parsed.path)
 		else:
-			data = urllib2.urlopen(url)
+			data = self.http.get(url)
 		if data is None:
 			return None
+		if self.cache is not None:
+			with contextlib.closing(data):
+				return self.cache.fill(url, data, hash_value)
 		return contextlib.closing(data)
 
 	def remove(self, url, credentials=None):
@@ -71,57 +578,329 @@ class PerceptOps(object):
 			# Local file
 			os.unlink(parsed.path)
 		elif parsed.scheme == 's3':
-			s3 = DefaultS3Client(self._config, parsed.netloc, credentials)
+			s3 = rigor.s3.get_client(self._config, parsed.netloc, credentials)
 			s3.delete(parsed.path)
 		else:
 			raise NotImplementedError("Files not in a local repository or S3 bucket can't be deleted")
 
+	@staticmethod
+	def _is_shared(percept, session):
+		"""
+		Checks whether another percept's locator refers to the same data, as when percepts with identical data share one object in a content-addressed repository
+
+		:param percept: percept to check
+		:type percept: :py:class:`~rigor.types.Percept`
+		:param session: database session
+		:rtype: bool
+		"""
+		url = urldefrag(percept.locator)[0]
+		others = session.query(Percept.id).filter(Percept.id != percept.id).filter(
+				sa.or_(Percept.locator == url, PerceptOps._fragment_match(url))
+		)
+		return others.first() is not None
+
+	@staticmethod
+	def _fragment_match(url):
+		""" :return: SQL condition matching locators that are the URL with a fragment, as given to percepts sharing data """
+		pattern = url.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '#%'
+		return Percept.locator.like(pattern, escape='\\')
+
+	def _remove_batch(self, bucket, credentials, paths):
+		"""
+		Removes data for several percepts at once
+
+		:param str bucket: S3 bucket, or :py:const:`None` for local files
+		:param str credentials: name of configuration section with S3 credentials
+		:param list paths: S3 keys or local paths
+		:return: paths that couldn't be removed
+		"""
+		if bucket is not None:
+			return rigor.s3.get_client(self._config, bucket, credentials).delete_many(paths)
+		failed = list()
+		for path in paths:
+			try:
+				os.unlink(path)
+			except OSError as err:
+				if err.errno != errno.ENOENT:
+					failed.append(path)
+		return failed
+
+	@staticmethod
+	def _shared_urls(urls, session):
+		""" Finds which of the URLs are referred to by locators of percepts in the database """
+		urls = list(urls)
+		shared = set()
+		# Each URL is compared twice, so batches are halved to keep within limits on the number of parameters in a statement
+		batch_size = kDestroyBatchSize // 2
+		for start in range(0, len(urls), batch_size):
+			batch = urls[start:start + batch_size]
+			matches = session.query(Percept.locator).filter(sa.or_(Percept.locator.in_(batch), *[PerceptOps._fragment_match(url) for url in batch]))
+			shared.update(urldefrag(locator)[0] for locator, in matches)
+		return shared
+
+	def destroy_many(self, percepts, session, remove_data=True, concurrency=kDefaultRemoveConcurrency):
+		"""
+		Removes many percepts from the database, and their data from the repository. This is much faster than calling :py:meth:`destroy` for each percept: rows are deleted a batch of percepts at a time, rather than individually, and S3 objects are deleted up to 1000 in each request, using several threads.
+
+		Unlike :py:meth:`destroy`, this commits the session, and then removes data, so data is never removed for percepts that are still in the database. Data shared with percepts that aren't being removed is left in place.
+
+		Percepts' rows in ``percept_collection`` are deleted, but the collections themselves are left in place.
+
+		:param percepts: iterable of :py:class:`~rigor.types.Percept` objects or integer identifiers
+		:param session: database session
+		:param bool remove_data: if :py:const:`False`, data is left in place and only database rows are deleted
+		:param int concurrency: number of threads removing data
+		:return: (number of percepts removed, list of URLs whose data couldn't be removed)
+		:raises NotImplementedError: if any percept's data can't be removed, before anything is deleted
+		"""
+		percept_ids = list()
+		for percept in percepts:
+			if hasattr(percept, 'id'):
+				# Deleted rows are removed behind the session's back, so loaded objects must not be flushed
+				owner = sa.orm.object_session(percept)
+				if owner is not None:
+					owner.expunge(percept)
+				percept = percept.id
+			percept_ids.append(percept)
+		locations = dict()
+		for start in range(0, len(percept_ids), kDestroyBatchSize):
+			batch = percept_ids[start:start + kDestroyBatchSize]
+			for locator, credentials in session.query(Percept.locator, Percept.credentials).filter(Percept.id.in_(batch)):
+				url = urldefrag(locator)[0]
+				parsed = urlsplit(url)
+				if remove_data and parsed.netloc and parsed.scheme != 's3':
+					raise NotImplementedError("Files not in a local repository or S3 bucket can't be deleted")
+				locations[url] = credentials
+		deleted = 0
+		for start in range(0, len(percept_ids), kDestroyBatchSize):
+			batch = percept_ids[start:start + kDestroyBatchSize]
+			annotation_ids = sa.select([Annotation.id]).where(Annotation.percept_id.in_(batch))
+			for table in (AnnotationTag, AnnotationProperty):
+				session.execute(table.__table__.delete().where(table.annotation_id.in_(annotation_ids)))
+			for table in (Annotation, PerceptTag, PerceptProperty, PerceptSensors, PerceptCollection):
+				session.execute(table.__table__.delete().where(table.percept_id.in_(batch)))
+			deleted += session.execute(Percept.__table__.delete().where(Percept.id.in_(batch))).rowcount
+		increment_write_version(session)
+		shared = self._shared_urls(locations, session) if remove_data else set()
+		session.commit()
+		if not remove_data:
+			return (deleted, list())
+		groups = dict()
+		urls = dict()
+		for url, credentials in locations.iteritems():
+			if url in shared:
+				continue
+			parsed = urlsplit(url)
+			if parsed.netloc:
+				group = (parsed.netloc, credentials)
+				urls[(parsed.netloc, parsed.path.lstrip('/'))] = url
+			else:
+				group = (None, None)
+				urls[(None, parsed.path)] = url
+			groups.setdefault(group, list()).append(parsed.path)
+		batches = list()
+		for (bucket, credentials), paths in groups.iteritems():
+			size = rigor.s3.kMaxDeleteKeys if bucket is not None else kRemoveBatchSize
+			for start in range(0, len(paths), size):
+				batches.append((bucket, credentials, paths[start:start + size]))
+		unremoved = list()
+		with rigor.workers.WorkerPool(self._remove_batch, concurrency) as pool:
+			for (bucket, _, paths), failed, error in pool.imap(batches, ordered=False):
+				if error is not None:
+					failed = paths
+				unremoved.extend(urls[(bucket, path.lstrip('/') if bucket is not None else path)] for path in failed)
+		return (deleted, unremoved)
+
 	def destroy(self, percept, session):
 		"""
-		Removes a percept from the database, and its data from the repository.
+		Removes a percept from the database, and its data from the repository. Data shared with other percepts is left in place.
 
 		:param percept: either a :py:class:`~rigor.types.Percept` object, or an integer identifier
 		:param session: database session
 		"""
 		if not hasattr(percept, 'id'):
 			percept = session.query(Percept).get(percept)
+		shared = self._is_shared(percept, session)
 		session.delete(percept)
-		self.remove(percept.locator, percept.credentials)
+		increment_write_version(session)
+		if not shared:
+			self.remove(percept.locator, percept.credentials)
 
 class ImageOps(PerceptOps):
 	"""
 	Utilities for dealing with image-type percepts
 
+	Decoded images are kept in memory if an image cache is given, or configured with ``image_cache_size`` in the ``cache`` section of the configuration. Cached images are read-only. See :py:mod:`rigor.imagecache`.
+
 	:param config: configuration data
 	:type config: :py:class:`~rigor.config.RigorConfiguration`
+	:param cache: cache for remote data; see :py:class:`PerceptOps`
+	:type cache: :py:class:`~rigor.datacache.DataCache`
+	:param http: connection pool for HTTP data; see :py:class:`PerceptOps`
+	:type http: :py:class:`~rigor.httppool.HTTPConnectionPool`
+	:param image_cache: cache for decoded images; if :py:const:`None`, a cache is created from the configuration, if one is configured
+	:type image_cache: :py:class:`~rigor.imagecache.DecodedImageCache`
 	"""
 
-	def __init__(self, config):
-		super(ImageOps, self).__init__(config)
+	def __init__(self, config, cache=None, http=None, image_cache=None):
+		super(ImageOps, self).__init__(config, cache, http)
+		if image_cache is None:
+			image_cache = DecodedImageCache.from_config(config)
+		#: Cache for decoded images, or :py:const:`None`
+		self.image_cache = image_cache
 
-	def fetch(self, percept):
+	def fetch(self, percept, scale=None, roi=None):
 		"""
 		Given a percept, this will fetch its data from the URL or repository base,
 		returning it as a NumPy array
 
 		:param dict percept: Percept metadata
+		:param float scale: see :py:meth:`decode`
+		:param tuple roi: see :py:meth:`decode`
 		:return: decoded bitmap
 		:rtype: :py:class:`numpy.ndarray`
 		"""
-		with super(ImageOps, self).fetch(percept) as image_data:
-			return ImageOps.decode(image_data)
+		if self.image_cache is None:
+			return self._fetch_image(percept, scale, roi)
+		key = self.image_cache.key(percept, scale, roi)
+		return self.image_cache.get_or_load(key, lambda: self._fetch_image(percept, scale, roi))
+
+	def _fetch_image(self, percept, scale, roi):
+		with self.fetch_buffer(percept) as image_data:
+			return ImageOps.decode(image_data, scale, roi)
 
 	@staticmethod
-	def decode(percept_data):
+	def decode(percept_data, scale=None, roi=None):
 		"""
-		Given an image, this will decode it and return it as a NumPy array.
+		Given an image, this will decode it and return it as a NumPy array. Image data in a local file is mapped into memory and decoded in place, rather than read into a copy.
+
+		The image can be scaled down, and cropped to a region of interest, as it's decoded. JPEG images scaled to half size or less are decoded at reduced resolution, which is much faster, if OpenCV supports it; other images are decoded at full size, then cropped and scaled.
 
 		:param percept_data: image data or path to image file
-		:type percept_data: either a file-like object, or a path to an image file
+		:type percept_data: either a buffer (such as from :py:meth:`~PerceptOps.read_buffer`), a file-like object, or a path to an image file
+		:param float scale: if given, the image is scaled by this factor, between 0 and 1
+		:param tuple roi: if given, the image is cropped to this (x, y, width, height) rectangle, in full-size image coordinates, before it's scaled
 		:return: decoded bitmap
 		:rtype: :py:class:`numpy.ndarray`
 		"""
-		if hasattr(percept_data, 'read'):
-			image_array = np.frombuffer(percept_data.read(), np.uint8)
-			return cv2.imdecode(image_array, _kImageReadFlags)
-		return cv2.imread(percept_data, _kImageReadFlags)
+		if scale is not None and not 0 < scale <= 1:
+			raise ValueError("Scale must be between 0 and 1, not {0}".format(scale))
+		if isinstance(percept_data, basestring):
+			if scale is None and roi is None:
+				return cv2.imread(percept_data, _kImageReadFlags)
+			with open(percept_data, 'rb') as image_file:
+				return ImageOps.decode(image_file, scale, roi)
+		if isinstance(percept_data, (mmap.mmap, bytearray, buffer)) or not hasattr(percept_data, 'read'):
+			return _decode_buffer(percept_data, scale, roi)
+		image_buffer = _map_data(percept_data)
+		try:
+			return _decode_buffer(image_buffer, scale, roi)
+		finally:
+			if isinstance(image_buffer, mmap.mmap):
+				image_buffer.close()
+
+class AudioOps(PerceptOps):
+	"""
+	Utilities for dealing with audio-type percepts, in WAV format or as raw PCM samples
+
+	Audio is decoded in blocks of frames, each a NumPy array with a row for each frame and a column for each channel, so recordings of any length can be processed in constant memory. Remote data is read a range at a time, so processing can start before all of it has been transferred.
+
+	:param config: configuration data
+	:type config: :py:class:`~rigor.config.RigorConfiguration`
+	:param cache: cache for remote data; see :py:class:`PerceptOps`
+	:type cache: :py:class:`~rigor.datacache.DataCache`
+	:param http: connection pool for HTTP data; see :py:class:`PerceptOps`
+	:type http: :py:class:`~rigor.httppool.HTTPConnectionPool`
+	"""
+
+	def __init__(self, config, cache=None, http=None):
+		super(AudioOps, self).__init__(config, cache, http)
+
+	def stream(self, percept):
+		"""
+		Opens a percept's audio data for decoding with :py:meth:`decode_frames`. Local files are opened directly; remote data is read a range at a time, as it's decoded.
+
+		:param dict percept: percept metadata
+		:return: seekable file-like object with a :py:func:`contextlib.closing` wrapper
+		"""
+		parsed = urlsplit(percept.locator)
+		if not parsed.netloc:
+			return open(parsed.path, 'rb')
+		return contextlib.closing(_RangedFile(self, percept))
+
+	def info(self, percept, raw_format=None):
+		"""
+		Reads the format of a percept's audio
+
+		:param dict percept: percept metadata
+		:param raw_format: format of raw PCM data without a header; if :py:const:`None`, the data must be in WAV format
+		:type raw_format: :py:class:`AudioFormat`
+		:rtype: :py:class:`AudioFormat`
+		"""
+		if raw_format is not None:
+			return raw_format
+		with self.stream(percept) as data:
+			return _read_wav_format(data)
+
+	def frames(self, percept, block_size=kDefaultAudioBlockSize, start_time=None, end_time=None, raw_format=None):
+		"""
+		Given a percept, this will fetch and decode its audio a block at a time; see :py:meth:`decode_frames`
+
+		:param dict percept: percept metadata
+		:return: generator of blocks of frames
+		"""
+		with self.stream(percept) as data:
+			for block in AudioOps.decode_frames(data, block_size, start_time, end_time, raw_format):
+				yield block
+
+	def fetch(self, percept, start_time=None, end_time=None, raw_format=None):
+		"""
+		Given a percept, this will fetch its audio, returning all of its frames (or those in a range of times) as one NumPy array
+
+		:param dict percept: percept metadata
+		:return: decoded frames, with a row for each frame and a column for each channel
+		:rtype: :py:class:`numpy.ndarray`
+		"""
+		blocks = list(self.frames(percept, kDefaultAudioBlockSize, start_time, end_time, raw_format))
+		if not blocks:
+			audio_format = self.info(percept, raw_format)
+			return np.empty((0, audio_format.channels), audio_format.dtype)
+		return np.concatenate(blocks)
+
+	@staticmethod
+	def decode_frames(percept_data, block_size=kDefaultAudioBlockSize, start_time=None, end_time=None, raw_format=None):
+		"""
+		Decodes audio a block at a time. Samples are decoded to their stored type: 8-bit samples as unsigned integers, 16- and 32-bit samples as signed integers, 24-bit samples as 32-bit signed integers, and floating-point samples as floating-point numbers. Blocks are read-only.
+
+		:param percept_data: audio data
+		:type percept_data: file-like object, positioned at the start of the data; if it can't seek (such as a streamed HTTP response), data before ``start_time`` is read and discarded
+		:param int block_size: number of frames in each block; the last block may be shorter
+		:param float start_time: time of the first frame to decode, in seconds; if :py:const:`None`, decoding starts at the first frame
+		:param float end_time: time after the last frame to decode, in seconds; if :py:const:`None`, decoding continues to the last frame
+		:param raw_format: format of raw PCM data without a header; if :py:const:`None`, the data must be in WAV format
+		:type raw_format: :py:class:`AudioFormat`
+		:return: generator of blocks of frames, each a :py:class:`numpy.ndarray` with a row for each frame and a column for each channel
+		"""
+		audio_format = raw_format or _read_wav_format(percept_data)
+		first = 0
+		if start_time is not None:
+			first = max(0, int(start_time * audio_format.sample_rate))
+		remaining = None
+		if audio_format.frame_count is not None:
+			remaining = max(0, audio_format.frame_count - first)
+		if end_time is not None:
+			requested = max(0, int(math.ceil(end_time * audio_format.sample_rate)) - first)
+			remaining = requested if remaining is None else min(remaining, requested)
+		frame_size = audio_format.frame_size
+		# WAV headers are read up to the first frame; raw data starts at the beginning
+		position = 0 if raw_format is not None else audio_format.data_offset
+		_skip_to(percept_data, position, audio_format.data_offset + first * frame_size)
+		while remaining is None or remaining > 0:
+			count = block_size if remaining is None else min(block_size, remaining)
+			raw = percept_data.read(count * frame_size)
+			count = len(raw) // frame_size
+			if count == 0:
+				return
+			yield _decode_samples(raw[:count * frame_size], audio_format)
+			if remaining is not None:
+				remaining -= count
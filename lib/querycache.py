@@ -0,0 +1,165 @@
+"""
+Local cache for read-mostly percept queries
+
+Results are stored on disk, keyed by database and query, along with the database's write version at the time they were fetched. The write version is a counter stored in the ``meta`` table, which is incremented by everything that changes percepts (:py:class:`~rigor.interop.Importer`, :py:meth:`~rigor.perceptops.PerceptOps.destroy`, the CSV importer). A cached result is used only if the write version hasn't changed since it was stored, so checking the cache costs a single small query.
+"""
+
+from rigor.types import Meta, Percept
+import rigor.logger
+import rigor.utils
+
+import sqlalchemy as sa
+import cPickle as pickle
+import tempfile
+import hashlib
+import os
+
+#: Key in the ``meta`` table holding the write version
+kWriteVersionKey = 'write_version'
+
+#: Default location of the cache, if not set in the configuration
+kDefaultCachePath = os.path.join(os.path.expanduser('~'), '.cache', 'rigor', 'queries')
+
+kPickleProtocol = pickle.HIGHEST_PROTOCOL
+
+def get_write_version(session):
+	"""
+	Gets the current write version of the database
+
+	:param session: database session
+	:return: write version, which is 0 if nothing has incremented it yet
+	:rtype: int
+	"""
+	value = session.query(Meta.value).filter(Meta.key == kWriteVersionKey).scalar()
+	if value is None:
+		return 0
+	return int(value)
+
+def increment_write_version(session):
+	"""
+	Increments the write version of the database, invalidating cached query results. This should be called in the same transaction as the change to percept data.
+
+	The write version row is created with the schema. In older databases, it's created by the first increment; if another writer creates it at the same time, the increment is applied to that writer's row instead.
+
+	:param session: database session
+	"""
+	if _increment(session):
+		return
+	if session.connection().dialect.name == 'sqlite':
+		# SQLite writers hold a lock on the whole database, so another can't create the row first
+		session.add(Meta(kWriteVersionKey, '1'))
+		session.flush()
+		return
+	try:
+		with session.begin_nested():
+			session.add(Meta(kWriteVersionKey, '1'))
+	except sa.exc.IntegrityError:
+		_increment(session)
+
+def _increment(session):
+	""" :return: whether the write version row exists and was incremented """
+	return session.query(Meta).filter(Meta.key == kWriteVersionKey).update(
+			{Meta.value: sa.cast(sa.cast(Meta.value, sa.Integer) + 1, sa.Text)},
+			synchronize_session=False
+	) > 0
+
+class QueryCache(object):
+	"""
+	Caches query results on disk, invalidated by the database write version
+
+	:param config: configuration data
+	:type config: :py:class:`~rigor.config.RigorConfiguration`
+	:param database: database being queried
+	:type database: :py:class:`~rigor.database.Database`
+	:param str path: directory for cached results. If :py:const:`None`, the ``query_cache_path`` setting in the ``cache`` section of the configuration is used, or a default location in the user's home directory.
+	"""
+
+	def __init__(self, config, database, path=None):
+		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
+		self._database = database
+		if path is None:
+			if ('cache', 'query_cache_path') in config:
+				path = config.get('cache', 'query_cache_path')
+			else:
+				path = kDefaultCachePath
+		self._path = os.path.expanduser(path)
+		self.hits = 0
+		self.misses = 0
+
+	def _filename(self, key):
+		digest = hashlib.sha256(repr(self._database.url)).hexdigest()
+		digest = hashlib.sha256(digest + key).hexdigest()
+		return os.path.join(self._path, digest[:2], digest + '.pickle')
+
+	def _load(self, filename):
+		try:
+			with open(filename, 'rb') as cache_file:
+				return pickle.load(cache_file)
+		except (IOError, OSError, EOFError, pickle.UnpicklingError):
+			return None
+
+	def _store(self, filename, entry):
+		directory = os.path.dirname(filename)
+		rigor.utils.ensure_path_exists(directory)
+		handle, temporary = tempfile.mkstemp(prefix='.rigor-', dir=directory)
+		try:
+			with os.fdopen(handle, 'wb') as cache_file:
+				pickle.dump(entry, cache_file, kPickleProtocol)
+			os.rename(temporary, filename)
+		except:
+			os.unlink(temporary)
+			raise
+
+	def get(self, session, key, function):
+		"""
+		Returns the cached result for the key, or calls the function and caches its result if there is no valid cached result
+
+		:param session: database session
+		:param str key: unique description of the query
+		:param function: called with the session to fetch the result; it must return something that can be pickled
+		:return: query result
+		"""
+		if isinstance(key, unicode):
+			key = key.encode('utf-8')
+		version = get_write_version(session)
+		filename = self._filename(key)
+		entry = self._load(filename)
+		if entry is not None and entry[0] == key and entry[1] == version:
+			self.hits += 1
+			return entry[2]
+		self.misses += 1
+		result = function(session)
+		try:
+			self._store(filename, (key, version, result))
+		except (IOError, OSError) as err:
+			self._logger.warning("Couldn't store cached query result: {0}".format(err))
+		return result
+
+	def query(self, session, query):
+		"""
+		Runs a query for plain columns (not mapped objects), caching the result
+
+		:param session: database session
+		:param query: query to run
+		:type query: :py:class:`sqlalchemy.orm.query.Query`
+		:return: rows, as tuples
+		:rtype: list
+		"""
+		statement = query.statement.compile(dialect=session.bind.dialect)
+		key = '{0}\n{1!r}'.format(statement, sorted(statement.params.items()))
+		return self.get(session, key, lambda _: [tuple(row) for row in query])
+
+	def percept_ids(self, session, selection=None):
+		"""
+		Gets the IDs of percepts matching a filter, caching the result
+
+		:param session: database session
+		:param selection: filter to apply, or :py:const:`None` for all percepts
+		:type selection: :py:class:`~rigor.filters.PerceptFilter`
+		:return: percept IDs, in ascending order
+		:rtype: list
+		"""
+		query = session.query(Percept.id).order_by(Percept.id)
+		if selection is not None:
+			query = query.filter(selection.clause())
+		return [row[0] for row in self.query(session, query)]
@@ -2,7 +2,8 @@
 
 import rigor.logger
 from rigor.database import Database
-from rigor.perceptops import PerceptOps
+from rigor.perceptops import PerceptOps, AudioOps
+from rigor.algorithm import AudioAlgorithm
 from rigor.checkpoint import Checkpointer, NullCheckpointer
 
 import abc
@@ -115,6 +116,8 @@ class DatabaseRunner(Runner):
 	"""
 	Runner class that uses the database to discover percepts for evaluation
 
+	Audio algorithms (see :py:class:`~rigor.algorithm.AudioAlgorithm`) are given remote data a range at a time, so decoding starts before all of it has been transferred, and can start part way through it.
+
 	:param algorithm: algorithm to run against each percept
 	:type algorithm: :py:class:`~rigor.algorithm.Algorithm`
 	:param config: configuration data
@@ -128,7 +131,10 @@ class DatabaseRunner(Runner):
 		Runner.__init__(self, algorithm, parameters, checkpoint)
 		self._config = config
 		self._database = Database(database_name, config)
-		self._perceptops = PerceptOps(config)
+		if isinstance(algorithm, AudioAlgorithm):
+			self._perceptops = AudioOps(config)
+		else:
+			self._perceptops = PerceptOps(config)
 
 	def fetch_data(self, percept):
 		"""
@@ -137,4 +143,6 @@ class DatabaseRunner(Runner):
 		:param percept: The percept corresponding to data to fetch
 		:return: Percept data encapsulated in a :py:func:`~contextlib.contextmanager`
 		"""
+		if isinstance(self._perceptops, AudioOps):
+			return self._perceptops.stream(percept)
 		return self._perceptops.fetch(percept)
@@ -4,6 +4,12 @@ from abc import ABCMeta, abstractmethod
 from io import BytesIO
 from boto.s3.connection import S3Connection
 from boto.s3.key import Key
+from boto.exception import S3ResponseError
+from rigor.utils import RangeData
+import threading
+
+#: Most keys S3 deletes in a single request
+kMaxDeleteKeys = 1000
 
 class RigorS3Client(object):
 	"""
@@ -33,17 +39,47 @@ class RigorS3Client(object):
 		"""
 		pass
 
+	def get_range(self, key, start, end=None):
+		"""
+		Retrieves part of an object from S3. Clients that can retrieve part of an object should override this; by default, the whole object is retrieved, and kept with the range (see :py:class:`~rigor.utils.RangeData`).
+
+		:param str key: S3 key for the object to retrieve
+		:param int start: offset of the first byte to retrieve
+		:param int end: offset after the last byte to retrieve; if :py:const:`None`, the rest of the object is retrieved
+		:return: contents of the object in the range, which is shorter than requested if the object ends first, or :py:const:`None` if the object doesn't exist
+		:rtype: :py:class:`io.BytesIO`
+		"""
+		contents = self.get(key)
+		if contents is None:
+			return None
+		with contents:
+			whole = contents.read()
+		return RangeData(whole[start:end], whole)
+
 	@abstractmethod
-	def put(self, key, data):
+	def put(self, key, data, md5=None):
 		"""
 		Uploads data to S3
 
 		:param str key: S3 key where the data will go
 		:param data: Either a file-like object, or a path to a destination file
 		:type data: :py:class:`str` or :py:class:`file`
+		:param tuple md5: (hex digest, base64 digest) of the MD5 hash of the data, if already known; this saves reading the data an extra time to compute it
 		"""
 		pass
 
+	def exists(self, key):
+		"""
+		Checks whether an object exists, without fetching it. Clients that can check a single object should override this; by default, keys starting with the given key are listed.
+
+		:param str key: S3 key to check
+		:rtype: bool
+		"""
+		for item in self.list(key):
+			if getattr(item, 'name', item) == key:
+				return True
+		return False
+
 	@abstractmethod
 	def delete(self, key):
 		"""
@@ -53,6 +89,18 @@ class RigorS3Client(object):
 		"""
 		pass
 
+	def delete_many(self, keys):
+		"""
+		Removes data at several keys from S3. Clients that can delete several objects in one request should override this; by default, each is deleted in turn.
+
+		:param keys: S3 keys for the objects to delete
+		:return: keys that couldn't be deleted
+		:rtype: list
+		"""
+		for key in keys:
+			self.delete(key)
+		return list()
+
 	@abstractmethod
 	def list(self, prefix=None):
 		"""
@@ -64,41 +112,74 @@ class RigorS3Client(object):
 		"""
 		pass
 
+def _connection_arguments(config, credentials):
+	""" Gets the arguments for connecting to S3 with the named credentials, or the default credentials """
+	if credentials:
+		return (config.get(credentials, 'aws_access_key_id'), config.get(credentials, 'aws_secret_access_key'))
+	return ()
+
 class BotoS3Client(RigorS3Client):
 	"""
 	Object capable of accessing S3 data using Boto
+
+	:param connection: connection to use, so it can be shared between buckets; if :py:const:`None`, a new connection is made
+	:type connection: :py:class:`boto.s3.connection.S3Connection`
 	"""
 
-	def __init__(self, config, bucket, credentials=None):
+	def __init__(self, config, bucket, credentials=None, connection=None):
 		super(BotoS3Client, self).__init__(config, bucket, credentials)
-		connection_args = list()
-		if credentials:
-			connection_args.append(config.get(credentials, 'aws_access_key_id'))
-			connection_args.append(config.get(credentials, 'aws_secret_access_key'))
-		self._conn = S3Connection(*connection_args)
-		self.bucket = self._conn.get_bucket(bucket)
+		if connection is None:
+			connection = S3Connection(*_connection_arguments(config, credentials))
+		self._conn = connection
+		# Not validated, as that costs a request; a missing bucket is reported by the first request instead
+		self.bucket = self._conn.get_bucket(bucket, validate=False)
 
 	def get(self, key, local_file=None):
 		""" See :py:meth:`RigorS3Client.get` """
-		fetched_key = self.bucket.get_key(key)
-		if fetched_key is None:
-			return None
-		if local_file is None:
-			contents = BytesIO()
-			fetched_key.get_file(contents)
-			contents.seek(0)
-			return contents
-		else:
-			fetched_key.get_contents_to_filename(local_file)
+		# Fetched directly, rather than checking that the key exists first, to save a request
+		remote_key = Key(self.bucket, key)
+		try:
+			if local_file is None:
+				contents = BytesIO()
+				remote_key.get_file(contents)
+				contents.seek(0)
+				return contents
+			remote_key.get_contents_to_filename(local_file)
+		except S3ResponseError as err:
+			if err.status == 404 and err.error_code != 'NoSuchBucket':
+				return None
+			raise
+
+	def get_range(self, key, start, end=None):
+		""" See :py:meth:`RigorS3Client.get_range`; only the requested range is transferred """
+		if end is not None and end <= start:
+			return BytesIO()
+		remote_key = Key(self.bucket, key)
+		contents = BytesIO()
+		try:
+			remote_key.get_file(contents, headers={'Range': 'bytes={0}-{1}'.format(start, '' if end is None else end - 1)})
+		except S3ResponseError as err:
+			if err.status == 416:
+				# The range starts after the end of the object
+				return BytesIO()
+			if err.status == 404 and err.error_code != 'NoSuchBucket':
+				return None
+			raise
+		contents.seek(0)
+		return contents
 
-	def put(self, key, data):
+	def put(self, key, data, md5=None):
 		""" See :py:meth:`RigorS3Client.put` """
 		remote_key = Key(self.bucket)
 		remote_key.key = key
 		if hasattr(data, 'read'):
-			remote_key.set_contents_from_file(data)
+			remote_key.set_contents_from_file(data, md5=md5)
 		else:
-			remote_key.set_contents_from_filename(data)
+			remote_key.set_contents_from_filename(data, md5=md5)
+
+	def exists(self, key):
+		""" See :py:meth:`RigorS3Client.exists` """
+		return self.bucket.get_key(key) is not None
 
 	def delete(self, key):
 		""" See :py:meth:`RigorS3Client.delete` """
@@ -106,6 +187,16 @@ class BotoS3Client(RigorS3Client):
 		remote_key.key = key
 		remote_key.delete()
 
+	def delete_many(self, keys):
+		""" See :py:meth:`RigorS3Client.delete_many`; up to :py:data:`kMaxDeleteKeys` objects are deleted in each request """
+		# Keys in single-object requests are part of the request path, where a leading slash is ignored, but keys in multi-object deletes are taken literally
+		keys = [key.lstrip('/') for key in keys]
+		failed = list()
+		for start in range(0, len(keys), kMaxDeleteKeys):
+			result = self.bucket.delete_keys(keys[start:start + kMaxDeleteKeys], quiet=True)
+			failed.extend(error.key for error in result.errors)
+		return failed
+
 	def list(self, prefix=None):
 		""" See :py:meth:`RigorS3Client.list` """
 		if prefix is None:
@@ -113,3 +204,63 @@ class BotoS3Client(RigorS3Client):
 		return self.bucket.list(prefix=prefix)
 
 DefaultS3Client = BotoS3Client
+
+class S3ClientRegistry(object):
+	"""
+	Shares S3 clients, so that connections (and the HTTP connections they keep alive) are reused, rather than connecting for every object. Clients are made with :py:data:`DefaultS3Client`. Boto connections can't be shared between threads, so each thread has its own clients; within a thread, Boto clients share one connection for all buckets accessed with the same credentials.
+	"""
+
+	def __init__(self):
+		self._local = threading.local()
+
+	def get(self, config, bucket, credentials=None):
+		"""
+		Gets a client for the current thread
+
+		:param config: configuration data
+		:type config: :py:class:`~rigor.config.RigorConfiguration`
+		:param str bucket: S3 bucket containing data
+		:param str credentials: name of credentials section
+		:return: client of the class set as :py:data:`DefaultS3Client`
+		:rtype: :py:class:`RigorS3Client`
+		"""
+		arguments = _connection_arguments(config, credentials)
+		state = self._local.__dict__
+		clients = state.setdefault('clients', dict())
+		key = (DefaultS3Client, bucket, arguments)
+		client = clients.get(key)
+		if client is None:
+			if issubclass(DefaultS3Client, BotoS3Client):
+				connections = state.setdefault('connections', dict())
+				connection = connections.get(arguments)
+				if connection is None:
+					connection = connections[arguments] = S3Connection(*arguments)
+				client = DefaultS3Client(config, bucket, credentials, connection)
+			else:
+				client = DefaultS3Client(config, bucket, credentials)
+			clients[key] = client
+		return client
+
+	def clear(self):
+		""" Discards the current thread's clients and connections """
+		for connection in self._local.__dict__.get('connections', dict()).itervalues():
+			connection.close()
+		self._local.__dict__.clear()
+
+_registry = S3ClientRegistry()
+
+def get_client(config, bucket, credentials=None):
+	"""
+	Gets a shared client from the default :py:class:`S3ClientRegistry`. Clients must only be used by the thread that got them.
+
+	:param config: configuration data
+	:type config: :py:class:`~rigor.config.RigorConfiguration`
+	:param str bucket: S3 bucket containing data
+	:param str credentials: name of credentials section
+	:rtype: :py:class:`RigorS3Client`
+	"""
+	return _registry.get(config, bucket, credentials)
+
+def clear_clients():
+	""" Discards the current thread's clients in the default :py:class:`S3ClientRegistry` """
+	_registry.clear()
@@ -4,7 +4,7 @@ import sqlalchemy as sa
 from sqlalchemy.ext.declarative import as_declarative
 from rigor.database import kNamingConvention
 import rigor.utils
-import ast
+import rigor.geometry
 
 kMetaData = sa.MetaData(naming_convention=kNamingConvention)
 
@@ -132,41 +132,36 @@ class Point(sa.types.UserDefinedType):
 		return "POINT"
 
 	def bind_processor(self, dialect):
-		def process(value):
-			if value is None:
-				return None
-			return '({0:n}, {1:n})'.format(value[0], value[1])
-		return process
+		return rigor.geometry.format_point
 
 	def result_processor(self, dialect, coltype):
-		def process(value):
-			if value is None:
-				return value
-			return ast.literal_eval(value)
-		return process
+		return rigor.geometry.parse_point
 
 	def python_type(self):
 		return tuple
 
 class Polygon(sa.types.UserDefinedType):
-	""" Type representing a polygon made up of 2D points """
+	"""
+	Type representing a polygon made up of 2D points
+
+	:param bool as_array: if :py:const:`True`, values are loaded as :py:class:`numpy.ndarray` instances with shape (N, 2) instead of tuples
+	"""
+
+	def __init__(self, as_array=False):
+		self.as_array = as_array
 
 	def get_col_spec(self):
 		return "POLYGON"
 
 	def bind_processor(self, dialect):
-		def process(value):
-			if value is None:
-				return None
-			return ', '.join('({0:n}, {1:n})'.format(val[0], val[1]) for val in value)
-		return process
+		return rigor.geometry.format_polygon
 
 	def result_processor(self, dialect, coltype):
-		def process(value):
-			if value is None:
-				return value
-			return ast.literal_eval(value)
-		return process
+		if self.as_array:
+			def process(value):
+				return rigor.geometry.parse_polygon(value, True)
+			return process
+		return rigor.geometry.parse_polygon
 
 	def python_type(self):
 		return tuple
@@ -2,6 +2,7 @@
 
 import json
 import os
+import io
 import errno
 from datetime import datetime
 
@@ -39,3 +40,15 @@ def ensure_path_exists(path, mode=0o777):
 	except OSError as err:
 		if err.errno != errno.EEXIST:
 			raise err
+
+class RangeData(io.BytesIO):
+	"""
+	Data read for a range request. If the server or client couldn't read only the range, and read all of the data to take the range from it, the data is kept in ``whole``, so a caller reading several ranges can take the others from it, rather than transferring all of the data again for each range.
+
+	:param str data: data in the range
+	:param str whole: all of the data, if it was read
+	"""
+	def __init__(self, data='', whole=None):
+		io.BytesIO.__init__(self, data)
+		#: All of the data, if it was read to get the range; otherwise :py:const:`None`
+		self.whole = whole
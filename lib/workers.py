@@ -0,0 +1,111 @@
+""" Thread pool for running I/O-bound work (copying, uploading, fetching) concurrently """
+
+import rigor.logger
+
+import threading
+import Queue
+
+class WorkerPool(object):
+	"""
+	A fixed set of worker threads that apply a function to arguments. The number of tasks in flight at once is bounded, so arguments can come from an arbitrarily large iterator without exhausting memory.
+
+	Usage:
+		>>> with WorkerPool(copy_file, 8) as pool:
+		...		for arguments, result, error in pool.imap((source, destination) for ...):
+		...			pass
+
+	:param function: function to call in the worker threads
+	:param int workers: number of worker threads
+	:param int max_pending: maximum number of tasks submitted but not yet returned to the caller; defaults to twice the number of workers
+	"""
+
+	def __init__(self, function, workers, max_pending=None):
+		self._logger = rigor.logger.get_logger('.'.join((__name__, self.__class__.__name__)))
+		self._function = function
+		self._max_pending = max_pending or workers * 2
+		self._tasks = Queue.Queue()
+		self._threads = list()
+		for _ in range(workers):
+			thread = threading.Thread(target=self._work)
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def _work(self):
+		""" Runs tasks until told to stop """
+		while True:
+			task = self._tasks.get()
+			if task is None:
+				return
+			results, index, arguments = task
+			try:
+				results.put((index, self._function(*arguments), None))
+			except Exception as err:
+				self._logger.debug("Task {0} failed: {1!r}".format(index, err))
+				results.put((index, None, err))
+
+	def imap(self, arguments, ordered=True, size=None, max_size=None):
+		"""
+		Applies the function to each tuple of arguments. Exceptions raised by the function are returned, rather than raised, so one failure doesn't stop the others.
+
+		:param arguments: iterable of argument tuples
+		:param bool ordered: if :py:const:`True`, results are returned in the same order as the arguments; otherwise, they are returned as soon as they are finished
+		:param size: function giving the size of a task (such as the number of bytes it will return) from its argument tuple
+		:param int max_size: if given with ``size``, tasks are submitted only while the total size of tasks submitted but not yet returned stays within this limit; a task larger than the limit is submitted alone
+		:return: generator of (arguments, result, exception) tuples; exception is :py:const:`None` if the function succeeded
+		"""
+		results = Queue.Queue()
+		iterator = iter(arguments)
+		exhausted = False
+		waiting = None
+		pending = dict()
+		pending_sizes = dict()
+		pending_size = 0
+		finished = dict()
+		next_submitted = 0
+		next_returned = 0
+		while True:
+			while not exhausted and len(pending) < self._max_pending:
+				if waiting is None:
+					try:
+						task_arguments = next(iterator)
+					except StopIteration:
+						exhausted = True
+						break
+					waiting = (task_arguments, size(task_arguments) if size else 0)
+				task_arguments, task_size = waiting
+				if pending and max_size is not None and pending_size + task_size > max_size:
+					break
+				waiting = None
+				pending[next_submitted] = task_arguments
+				pending_sizes[next_submitted] = task_size
+				pending_size += task_size
+				self._tasks.put((results, next_submitted, task_arguments))
+				next_submitted += 1
+			if not pending:
+				return
+			index, result, error = results.get()
+			if not ordered:
+				pending_size -= pending_sizes.pop(index)
+				yield (pending.pop(index), result, error)
+				continue
+			finished[index] = (result, error)
+			while next_returned in finished:
+				result, error = finished.pop(next_returned)
+				pending_size -= pending_sizes.pop(next_returned)
+				yield (pending.pop(next_returned), result, error)
+				next_returned += 1
+
+	def close(self):
+		""" Stops the worker threads after they finish any tasks already submitted """
+		for _ in self._threads:
+			self._tasks.put(None)
+		for thread in self._threads:
+			thread.join()
+		self._threads = list()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, _exc_type, _exc_value, _exc_traceback):
+		self.close()
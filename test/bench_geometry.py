@@ -0,0 +1,43 @@
+"""
+Compares the speed of :py:mod:`rigor.geometry` with the :py:func:`ast.literal_eval` parser it replaced.
+
+Run directly: ``python bench_geometry.py [count]``
+"""
+
+from __future__ import print_function
+import rigor.geometry
+import ast
+import sys
+import timeit
+
+kVertexCount = 4
+kDefaultCount = 100000
+
+def ast_parse(value):
+	return ast.literal_eval(value)
+
+def ast_format(value):
+	return ', '.join('({0:n}, {1:n})'.format(val[0], val[1]) for val in value)
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else kDefaultCount
+	polygon = tuple((index * 10.5, index * 3) for index in range(kVertexCount))
+	text = '(' + rigor.geometry.format_polygon(polygon) + ')'
+	cases = (
+		('parse (ast)', lambda: ast_parse(text)),
+		('parse (rigor.geometry)', lambda: rigor.geometry.parse_polygon(text)),
+		('parse (rigor.geometry, array)', lambda: rigor.geometry.parse_polygon(text, True)),
+		('format (per-vertex)', lambda: ast_format(polygon)),
+		('format (rigor.geometry)', lambda: rigor.geometry.format_polygon(polygon)),
+	)
+	print('{0} polygons of {1} vertices'.format(count, kVertexCount))
+	for name, function in cases:
+		try:
+			elapsed = timeit.timeit(function, number=count)
+		except (ImportError, AttributeError):
+			print('{0:32} skipped'.format(name))
+			continue
+		print('{0:32} {1:8.3f} s {2:10.0f} /s'.format(name, elapsed, count / elapsed))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,59 @@
+"""
+Compares the speed of reading from a local HTTP server with :py:class:`rigor.httppool.HTTPConnectionPool` and with :py:func:`urllib2.urlopen`, which opens a new connection for every read.
+
+Run directly: ``python bench_httppool.py [count] [threads]``
+"""
+
+from __future__ import print_function
+from rigor.httppool import HTTPConnectionPool
+import httpserver
+import threading
+import urllib2
+import time
+import sys
+
+kDefaultCount = 2000
+kDefaultThreads = 4
+
+def urlopen_read(url):
+	data = urllib2.urlopen(url)
+	try:
+		return data.read()
+	finally:
+		data.close()
+
+def run(function, url, count, thread_count):
+	per_thread = count // thread_count
+	def read():
+		for _ in range(per_thread):
+			function(url)
+	threads = [threading.Thread(target=read) for _ in range(thread_count)]
+	start = time.time()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return (per_thread * thread_count, time.time() - start)
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else kDefaultCount
+	thread_count = int(sys.argv[2]) if len(sys.argv) > 2 else kDefaultThreads
+	server = httpserver.start()
+	url = server.url + '/body'
+	try:
+		pool = HTTPConnectionPool()
+		cases = (
+			('urllib2.urlopen', urlopen_read),
+			('HTTPConnectionPool', lambda url: pool.get(url).read()),
+		)
+		print('{0} reads of {1} bytes with {2} threads'.format(count, len(httpserver.kBody), thread_count))
+		for name, function in cases:
+			before = server.connections
+			reads, elapsed = run(function, url, count, thread_count)
+			print('{0:24} {1:8.3f} s {2:10.0f} /s {3:8} connections'.format(name, elapsed, reads / elapsed, server.connections - before))
+		pool.clear()
+	finally:
+		httpserver.stop(server)
+
+if __name__ == '__main__':
+	main()
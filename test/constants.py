@@ -7,11 +7,14 @@ kTestFile = os.path.join(kDirName, 'test.db')
 kTestDirectory = os.path.join(kDirName, 'tempdir', 'child')
 kConfigFile = os.path.join(kDirName, 'testing.ini')
 kConfigFile2 = os.path.join(kDirName, 'testing2.ini')
+kReplicaConfigFile = os.path.join(kDirName, 'replicas.ini')
+kReplicaFile = os.path.join(kDirName, 'replica{0}.db')
 kLockFile = os.path.join(kDirName, 'lockfile')
 kAwsBucket = 'orion.aws.testing'
 kImportFile = os.path.join(kDirName, 'import.json')
 kImportDirectory = os.path.join(kDirName, 'to_import')
 kRepoDirectory = os.path.join(kDirName, 'imported')
+kQueryCacheDirectory = os.path.join(kDirName, 'querycache')
 kImportDatabase = os.path.join(kDirName, 'imported.db')
 kExampleTextFile = os.path.join(kDirName, 'example_text_file.txt')
 kExampleImageFile = os.path.join(kDirName, 'example_image.png')
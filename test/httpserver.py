@@ -0,0 +1,85 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import threading
+
+kBody = 'x' * 1000
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# Buffered, so each response is sent at once; small unbuffered writes stall keep-alive connections on delayed acknowledgements
+	wbufsize = -1
+
+	def log_message(self, *args):
+		pass
+
+	def setup(self):
+		BaseHTTPRequestHandler.setup(self)
+		with self.server.lock:
+			self.server.connections += 1
+
+	def _send(self, status, body='', headers=()):
+		self.send_response(status)
+		self.send_header('Content-Length', str(len(body)))
+		for name, value in headers:
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def _send_range(self, body):
+		requested = self.headers.get('Range')
+		if not requested:
+			return self._send(200, body)
+		first, last = requested[len('bytes='):].split('-')
+		first = int(first)
+		last = min(int(last) if last else len(body) - 1, len(body) - 1)
+		if first >= len(body):
+			return self._send(416)
+		self._send(206, body[first:last + 1], (('Content-Range', 'bytes {0}-{1}/{2}'.format(first, last, len(body))), ))
+
+	def do_GET(self):
+		with self.server.lock:
+			self.server.requests += 1
+		if self.path.startswith('/data/'):
+			self._send(200, self.path[len('/data/'):])
+		elif self.path == '/body':
+			self._send(200, kBody)
+		elif self.path.startswith('/range/'):
+			self._send_range(self.path[len('/range/'):])
+		elif self.path.startswith('/files/') and self.path[len('/files/'):] in self.server.files:
+			self._send_range(self.server.files[self.path[len('/files/'):]])
+		elif self.path == '/close':
+			self.close_connection = 1
+			self._send(200, 'closed', (('Connection', 'close'), ))
+		elif self.path == '/redirect':
+			self._send(302, headers=(('Location', '/data/redirected'), ))
+		elif self.path == '/flaky':
+			with self.server.lock:
+				self.server.failures += 1
+				failed = self.server.failures <= 2
+			if failed:
+				self._send(503, 'unavailable')
+			else:
+				self._send(200, 'recovered')
+		else:
+			self._send(404, 'missing')
+
+class _Server(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+def start():
+	""" Starts a local HTTP server in a thread, returning it; its URL is in its ``url`` attribute, and data added to its ``files`` dictionary is served under ``/files/`` """
+	server = _Server(('127.0.0.1', 0), _Handler)
+	server.lock = threading.Lock()
+	server.connections = 0
+	server.requests = 0
+	server.failures = 0
+	server.files = dict()
+	server.url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+def stop(server):
+	server.shutdown()
+	server.server_close()
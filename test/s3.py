@@ -2,6 +2,7 @@ import boto
 from boto.s3.key import Key
 from moto import mock_s3
 import constants
+import rigor.s3
 import os
 
 mMock = None
@@ -21,6 +22,8 @@ def setup_module(module):
 
 def teardown_module(module):
 	global mMock
+	# Shared connections were made to the mock, so they can't be reused
+	rigor.s3.clear_clients()
 	mMock.stop()
 	mMock = None
 	try:
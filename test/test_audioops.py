@@ -0,0 +1,152 @@
+from rigor.perceptops import AudioOps, AudioFormat
+from rigor.types import Percept
+from s3 import setup_module, teardown_module
+import rigor.algorithm
+import rigor.perceptops
+import rigor.config
+import rigor.s3
+import numpy as np
+import struct
+import io
+import constants
+import pytest
+import os
+
+kConfig = rigor.config.RigorDefaultConfiguration(constants.kConfigFile)
+
+def make_wav(samples, sample_width, format_tag=1, extensible=False, extra_chunk=None):
+	channels = samples.shape[1]
+	if sample_width == 3:
+		values = samples.astype('<i4').reshape(-1, 1).view(np.uint8)[:, :3]
+		data = values.tostring()
+	else:
+		data = samples.tostring()
+	bits = sample_width * 8
+	if extensible:
+		fmt = struct.pack('<HHIIHHHHI', 0xfffe, channels, 8000, 8000 * channels * sample_width, channels * sample_width, bits, 22, bits, 0) + struct.pack('<H', format_tag) + '\x00' * 14
+	else:
+		fmt = struct.pack('<HHIIHH', format_tag, channels, 8000, 8000 * channels * sample_width, channels * sample_width, bits)
+	chunks = 'fmt ' + struct.pack('<I', len(fmt)) + fmt
+	if extra_chunk is not None:
+		chunks += 'LIST' + struct.pack('<I', len(extra_chunk)) + extra_chunk + ('\x00' if len(extra_chunk) & 1 else '')
+	chunks += 'data' + struct.pack('<I', len(data)) + data
+	return 'RIFF' + struct.pack('<I', 4 + len(chunks)) + 'WAVE' + chunks
+
+def make_percept(locator):
+	percept = Percept()
+	percept.locator = locator
+	return percept
+
+@pytest.fixture
+def stereo():
+	return (np.arange(20000, dtype='<i2') - 10000).reshape(-1, 2)
+
+@pytest.fixture
+def stereo_path(tmpdir, stereo):
+	path = tmpdir.join('stereo.wav')
+	path.write(make_wav(stereo, 2), 'wb')
+	return str(path)
+
+def test_info(stereo_path):
+	audio_format = AudioOps(kConfig).info(make_percept(stereo_path))
+	assert (audio_format.sample_rate, audio_format.channels, audio_format.sample_width, audio_format.frame_count, audio_format.data_offset) == (8000.0, 2, 2, 10000, 44)
+	assert audio_format.dtype == np.dtype('<i2')
+
+def test_frames(stereo_path, stereo):
+	blocks = list(AudioOps(kConfig).frames(make_percept(stereo_path), block_size=3000))
+	assert [len(block) for block in blocks] == [3000, 3000, 3000, 1000]
+	assert np.array_equal(np.concatenate(blocks), stereo)
+
+def test_fetch_time_range(stereo_path, stereo):
+	result = AudioOps(kConfig).fetch(make_percept('file://' + stereo_path), 0.25, 0.5)
+	assert np.array_equal(result, stereo[2000:4000])
+	assert np.array_equal(AudioOps(kConfig).fetch(make_percept(stereo_path), 1.0), stereo[8000:])
+	assert AudioOps(kConfig).fetch(make_percept(stereo_path), 5.0).shape == (0, 2)
+
+def test_24_bit(tmpdir):
+	samples = np.array([[-8388608], [-1], [0], [1], [8388607]], np.int32)
+	path = tmpdir.join('24.wav')
+	path.write(make_wav(samples, 3), 'wb')
+	result = AudioOps(kConfig).fetch(make_percept(str(path)))
+	assert result.dtype == np.int32
+	assert np.array_equal(result, samples)
+	assert not any(block.flags.writeable for block in AudioOps(kConfig).frames(make_percept(str(path)), block_size=2))
+
+def test_float_with_extra_chunk(tmpdir):
+	samples = np.linspace(-1, 1, 30).astype('<f4').reshape(-1, 3)
+	path = tmpdir.join('float.wav')
+	path.write(make_wav(samples, 4, format_tag=3, extra_chunk='odd'), 'wb')
+	assert np.array_equal(AudioOps(kConfig).fetch(make_percept(str(path))), samples)
+
+def test_extensible(tmpdir):
+	samples = np.arange(10, dtype=np.uint8).reshape(-1, 1)
+	path = tmpdir.join('extensible.wav')
+	path.write(make_wav(samples, 1, extensible=True), 'wb')
+	assert np.array_equal(AudioOps(kConfig).fetch(make_percept(str(path))), samples)
+
+def test_raw_format(tmpdir, stereo):
+	path = tmpdir.join('raw.pcm')
+	path.write(stereo.tostring(), 'wb')
+	raw_format = AudioFormat(8000, 2, 2)
+	blocks = list(AudioOps(kConfig).frames(make_percept(str(path)), 4096, raw_format=raw_format))
+	assert np.array_equal(np.concatenate(blocks), stereo)
+
+def test_not_wav():
+	with pytest.raises(ValueError):
+		AudioOps(kConfig).info(make_percept(constants.kExampleTextFile))
+
+def test_unsupported_format(tmpdir):
+	path = tmpdir.join('compressed.wav')
+	path.write(make_wav(np.zeros((4, 1), np.uint8), 1, format_tag=0x55), 'wb')
+	with pytest.raises(ValueError):
+		AudioOps(kConfig).info(make_percept(str(path)))
+
+def test_frames_s3_streamed(monkeypatch, stereo):
+	monkeypatch.setattr(rigor.perceptops, 'kAudioReadSize', 8192)
+	client = rigor.s3.get_client(kConfig, constants.kExampleBucket)
+	client.put('audio.wav', io.BytesIO(make_wav(stereo, 2)))
+	ops = AudioOps(kConfig)
+	ranges = list()
+	fetch_range = ops.fetch_range
+	def counting_fetch_range(percept, start, end=None):
+		ranges.append((start, end))
+		return fetch_range(percept, start, end)
+	ops.fetch_range = counting_fetch_range
+	percept = make_percept('s3://' + os.path.join(constants.kExampleBucket, 'audio.wav'))
+	blocks = ops.frames(percept, block_size=1000)
+	assert np.array_equal(next(blocks), stereo[:1000])
+	# Only the start of the data has been read
+	assert max(end for _, end in ranges) < 20000
+	assert np.array_equal(np.concatenate([stereo[:1000]] + list(blocks)), stereo)
+	assert len(ranges) > 4
+
+def test_frames_s3_ranges_unsupported(monkeypatch, stereo):
+	monkeypatch.setattr(rigor.perceptops, 'kAudioReadSize', 8192)
+	monkeypatch.setattr(rigor.s3.BotoS3Client, 'get_range', rigor.s3.RigorS3Client.get_range.im_func)
+	client = rigor.s3.get_client(kConfig, constants.kExampleBucket)
+	client.put('whole.wav', io.BytesIO(make_wav(stereo, 2)))
+	ops = AudioOps(kConfig)
+	ranges = list()
+	fetch_range = ops.fetch_range
+	def counting_fetch_range(percept, start, end=None):
+		ranges.append((start, end))
+		return fetch_range(percept, start, end)
+	ops.fetch_range = counting_fetch_range
+	percept = make_percept('s3://' + os.path.join(constants.kExampleBucket, 'whole.wav'))
+	assert np.array_equal(np.concatenate(list(ops.frames(percept, block_size=1000))), stereo)
+	# All of the data was read for the first range, so it's kept rather than read again
+	assert len(ranges) == 1
+
+def test_frames_s3_missing():
+	with pytest.raises(IOError):
+		list(AudioOps(kConfig).frames(make_percept('s3://' + os.path.join(constants.kExampleBucket, 'missing.wav'))))
+
+def test_audio_algorithm(stereo_path, stereo):
+	class PeakAlgorithm(rigor.algorithm.AudioAlgorithm):
+		block_size = 1000
+		def run(self, percept_data):
+			return max(np.abs(block.astype(np.int32)).max() for block in percept_data)
+	algorithm = PeakAlgorithm()
+	algorithm.end_time = 0.5
+	with open(stereo_path, 'rb') as data:
+		assert algorithm.run(algorithm.postfetch(make_percept(stereo_path), data)) == 10000
@@ -0,0 +1,110 @@
+from rigor.columnar import AnnotationBoundaries, export_columns, load_columns
+from rigor.filters import HasTag
+from rigor.types import Percept
+import rigor.columnar
+import numpy as np
+import os
+import tempfile
+import shutil
+import pytest
+import db
+
+@pytest.fixture
+def columnardb():
+	return db.get_database()
+
+def test_load_boundaries(columnardb):
+	with columnardb.get_session(False) as session:
+		boundaries = AnnotationBoundaries.load(session, 'test')
+	assert len(boundaries) == 18
+	assert len(boundaries.offsets) == 19
+	assert boundaries.coordinates.shape == (72, 2)
+	assert list(boundaries.percept_ids) == sorted(boundaries.percept_ids)
+
+def test_boundary_values(columnardb):
+	with columnardb.get_session(False) as session:
+		boundaries = AnnotationBoundaries.load(session, 'test', batch_size=4)
+	start, stop = boundaries.percept_range(832620)
+	assert stop - start == 3
+	assert boundaries.boundary(start).tolist() == [[1, 10], [3, 6], [1, 10], [10, 3]]
+	assert boundaries.model(start) == 'e'
+	assert boundaries.model(start + 2) == 'd'
+	assert len(boundaries.models) == len(set(boundaries.models))
+
+def test_load_missing_domain(columnardb):
+	with columnardb.get_session(False) as session:
+		boundaries = AnnotationBoundaries.load(session, 'xxxxxxx')
+	assert len(boundaries) == 0
+	assert boundaries.coordinates.shape == (0, 2)
+	assert boundaries.percept_range(832620) == (0, 0)
+
+@pytest.fixture
+def exportdir():
+	directory = tempfile.mkdtemp()
+	yield directory
+	shutil.rmtree(directory)
+
+@pytest.mark.parametrize('dtype,tail', [(np.int64, ()), (np.float64, (2, )), ('datetime64[us]', ())])
+def test_array_file(exportdir, dtype, tail):
+	path = os.path.join(exportdir, 'values.npy')
+	expected = np.arange(30 * int(np.prod(tail))).astype(dtype).reshape((30, ) + tail)
+	array_file = rigor.columnar._ArrayFile(path, dtype, tail)
+	for start in range(0, 30, 7):
+		array_file.append(expected[start:start + 7])
+	assert array_file.close() == 'values.npy'
+	loaded = np.load(path, mmap_mode='r')
+	assert loaded.shape == expected.shape
+	assert (loaded == expected).all()
+	assert loaded.offset % 16 == 0
+
+def test_array_file_empty(exportdir):
+	path = os.path.join(exportdir, 'values.npy')
+	rigor.columnar._ArrayFile(path, np.int32).close()
+	assert np.load(path).shape == (0, )
+
+def test_column_writer_abstract():
+	with pytest.raises(TypeError):
+		rigor.columnar._ColumnWriter('prefix')
+
+@pytest.mark.parametrize('batch_size', [5, 10000])
+def test_export_columns(columnardb, exportdir, batch_size):
+	with columnardb.get_session(False) as session:
+		counts = export_columns(session, exportdir, batch_size=batch_size)
+		expected = Percept.deserialize(session.query(Percept).get(832620).serialize(True)).serialize(True)
+	assert counts['percept'] == 12
+	tables = load_columns(exportdir)
+	assert sorted(tables.keys()) == ['annotation', 'annotation_property', 'annotation_tag', 'percept', 'percept_property', 'percept_tag']
+	percepts = tables['percept']
+	assert len(percepts) == 12
+	assert isinstance(percepts['id'], np.memmap)
+	index = int(np.searchsorted(percepts['id'], 832620))
+	row = percepts.row(index)
+	assert row['locator'] == expected['locator']
+	assert row['hash'] == expected['hash']
+	assert row['format'] == expected['format']
+	assert row['x_size'] == expected['x_size']
+	assert row['stamp'] == np.datetime64(expected['stamp'], 'us')
+	annotations = tables['annotation']
+	start = np.searchsorted(annotations['percept_id'], 832620, 'left')
+	stop = np.searchsorted(annotations['percept_id'], 832620, 'right')
+	assert stop - start == len(expected['annotations'])
+	assert annotations['boundary'][start].tolist() == [[1, 10], [3, 6], [1, 10], [10, 3]]
+	assert [annotations['model'][i] for i in range(start, stop)] == [annotation['model'] for annotation in expected['annotations']]
+	tags = tables['percept_tag']
+	tag_range = np.flatnonzero(tags['percept_id'][:] == 832620)
+	assert [tags['name'][i] for i in tag_range] == expected['tags']
+	annotation_tags = tables['annotation_tag']
+	for index, annotation in zip(range(start, stop), expected['annotations']):
+		rows = np.flatnonzero(annotation_tags['annotation_id'][:] == annotations['id'][index])
+		assert [annotation_tags['name'][row] for row in rows] == annotation['tags']
+	assert annotation_tags['name'].code('hard') >= 0
+	assert annotation_tags['name'].code('xxxxxxx') == -1
+
+def test_export_columns_selection(columnardb, exportdir):
+	with columnardb.get_session(False) as session:
+		counts = export_columns(session, exportdir, selection=HasTag('train') & HasTag('hard'))
+	assert counts['percept'] == 2
+	tables = load_columns(exportdir, mmap=False)
+	assert sorted(tables['percept']['id'].tolist()) == [585354, 780034]
+	assert set(tables['annotation']['percept_id'].tolist()) <= set((585354, 780034))
+	assert set(tables['percept_tag']['percept_id'].tolist()) == set((585354, 780034))
@@ -0,0 +1,87 @@
+from rigor.datacache import DataCache, DataVerificationError, parse_size
+import rigor.config
+import rigor.hash
+import pytest
+import tempfile
+import shutil
+import io
+import os
+
+kLocator = 's3://bucket/ab/cd/abcdef.png'
+kData = 'some percept data'
+kHash = rigor.hash.sha256_hash(io.BytesIO(kData))
+
+@pytest.fixture
+def directory():
+	path = tempfile.mkdtemp()
+	yield path
+	shutil.rmtree(path)
+
+def test_miss_then_hit(directory):
+	cache = DataCache(directory)
+	assert cache.open(kLocator, kHash) is None
+	with cache.fill(kLocator, io.BytesIO(kData), kHash) as cached:
+		assert cached.read() == kData
+	with cache.open(kLocator, kHash) as cached:
+		assert cached.read() == kData
+	assert (cache.hits, cache.misses) == (1, 1)
+	assert cache.size == len(kData)
+
+def test_keyed_by_hash(directory):
+	cache = DataCache(directory)
+	cache.fill(kLocator, io.BytesIO(kData), kHash).close()
+	assert cache.open(kLocator) is None
+	assert cache.open(kLocator, 'x' * 64) is None
+	assert cache.open('s3://bucket/other.png', kHash) is None
+
+def test_shared_between_instances(directory):
+	DataCache(directory).fill(kLocator, io.BytesIO(kData)).close()
+	with DataCache(directory).open(kLocator) as cached:
+		assert cached.read() == kData
+
+def test_verification(directory):
+	cache = DataCache(directory)
+	with pytest.raises(DataVerificationError):
+		cache.fill(kLocator, io.BytesIO('corrupted'), kHash)
+	assert cache.open(kLocator, kHash) is None
+	assert cache.size == 0
+	assert [filenames for _, _, filenames in os.walk(directory) if filenames] == []
+
+def test_other_hashes_not_verified(directory):
+	cache = DataCache(directory)
+	sha1 = 'a' * 40
+	cache.fill(kLocator, io.BytesIO(kData), sha1).close()
+	with cache.open(kLocator, sha1) as cached:
+		assert cached.read() == kData
+	assert cache.open(kLocator, 'b' * 40) is None
+
+def test_lru_eviction(directory):
+	cache = DataCache(directory, max_size=130)
+	for index in range(3):
+		cache.fill(str(index), io.BytesIO('x' * 40)).close()
+		# Distinct modification times, which track use
+		path = cache._filename(str(index), None)
+		os.utime(path, (1000 + index, 1000 + index))
+	assert cache.evictions == 0
+	cache.open('0').close()
+	cache.fill('3', io.BytesIO('x' * 40)).close()
+	assert cache.evictions == 2
+	assert cache.size <= 117
+	assert cache.open('0') is not None
+	assert cache.open('1') is None
+	assert cache.open('2') is None
+	assert cache.open('3') is not None
+
+def test_parse_size():
+	assert parse_size('1024') == 1024
+	assert parse_size('10K') == 10240
+	assert parse_size('1.5g') == 3 * 0x20000000
+	assert parse_size('2MB') == 0x200000
+
+def test_from_config(directory):
+	path = os.path.join(directory, 'cache.ini')
+	with open(path, 'w') as config_file:
+		config_file.write('[cache]\ndata_cache_path = {0}\ndata_cache_size = 1M\n'.format(directory))
+	cache = DataCache.from_config(rigor.config.RigorIniConfiguration(path))
+	assert cache._max_size == 0x100000
+	assert DataCache.from_config(rigor.config.RigorIniConfiguration(os.path.join(directory, 'missing.ini'))) is None
@@ -0,0 +1,93 @@
+import rigor.filecopy
+import pytest
+import tempfile
+import shutil
+import os
+
+kData = os.urandom(0x30000)
+
+@pytest.fixture
+def directory():
+	path = tempfile.mkdtemp()
+	yield path
+	shutil.rmtree(path)
+
+def write_source(directory):
+	source = os.path.join(directory, 'source.dat')
+	with open(source, 'wb') as source_file:
+		source_file.write(kData)
+	return source
+
+def read(path):
+	with open(path, 'rb') as data_file:
+		return data_file.read()
+
+def test_hardlink(directory):
+	source = write_source(directory)
+	destination = os.path.join(directory, 'destination.dat')
+	assert rigor.filecopy.copy_file(source, destination, ('hardlink', )) == 'hardlink'
+	assert os.stat(source).st_ino == os.stat(destination).st_ino
+
+@pytest.mark.parametrize('strategy', ['reflink', 'copy_file_range', 'sendfile'])
+def test_kernel_copy(directory, strategy):
+	source = write_source(directory)
+	destination = os.path.join(directory, 'destination.dat')
+	with open(destination, 'wb') as destination_file:
+		destination_file.write('x' * (len(kData) * 2))
+	used = rigor.filecopy.copy_file(source, destination, (strategy, ))
+	# Not every filesystem or kernel supports every strategy
+	assert used in (strategy, None)
+	if used is not None:
+		assert read(destination) == kData
+		assert os.stat(source).st_ino != os.stat(destination).st_ino
+
+def test_replace_existing(directory):
+	source = write_source(directory)
+	destination = os.path.join(directory, 'destination.dat')
+	with open(destination, 'wb') as destination_file:
+		destination_file.write('old')
+	used = rigor.filecopy.copy_file(source, destination)
+	assert used is not None
+	assert read(destination) == kData
+	assert read(source) == kData
+
+@pytest.mark.parametrize('strategies', [rigor.filecopy.kStrategies, ('hardlink', ), ('copy_file_range', 'sendfile')])
+def test_copy_twice(directory, strategies):
+	source = write_source(directory)
+	destination = os.path.join(directory, 'destination.dat')
+	for _ in range(2):
+		rigor.filecopy.copy_file(source, destination, strategies)
+		assert read(source) == kData
+	if os.path.exists(destination):
+		assert read(destination) == kData
+	assert [name for name in os.listdir(directory) if name.startswith('.rigor-')] == []
+
+@pytest.mark.parametrize('strategy,chunk', [('copy_file_range', '_copy_file_range_chunk'), ('sendfile', '_sendfile_chunk')])
+def test_short_copy(directory, monkeypatch, strategy, chunk):
+	copy_chunk = getattr(rigor.filecopy, chunk)
+	def short_chunk(source_fd, destination_fd, count):
+		# The source ends early, as if it shrank during the copy
+		if os.lseek(source_fd, 0, os.SEEK_CUR) >= 0x10000:
+			return 0
+		return copy_chunk(source_fd, destination_fd, min(count, 0x10000))
+	monkeypatch.setattr(rigor.filecopy, chunk, short_chunk)
+	source = write_source(directory)
+	destination = os.path.join(directory, 'destination.dat')
+	assert rigor.filecopy.copy_file(source, destination, (strategy, )) is None
+	assert not os.path.exists(destination)
+	assert [name for name in os.listdir(directory) if name.startswith('.rigor-')] == []
+
+def test_same_file(directory):
+	source = write_source(directory)
+	destination = os.path.join(directory, 'destination.dat')
+	os.link(source, destination)
+	assert rigor.filecopy.copy_file(source, destination, ('copy_file_range', 'sendfile')) == 'hardlink'
+	assert read(source) == kData
+
+def test_no_strategies(directory):
+	source = write_source(directory)
+	assert rigor.filecopy.copy_file(source, os.path.join(directory, 'destination.dat'), ()) is None
+
+def test_missing_source(directory):
+	with pytest.raises(OSError):
+		rigor.filecopy.copy_file(os.path.join(directory, 'missing.dat'), os.path.join(directory, 'destination.dat'))
@@ -0,0 +1,102 @@
+from rigor.filters import HasTag, HasProperty, InCollection, ChangedSince, AllOf, AnyOf, Not, parse, FilterSyntaxError
+from rigor.types import Percept, Collection, PerceptCollection, Annotation
+from datetime import timedelta
+import pytest
+import db
+
+@pytest.fixture
+def filtersdb():
+	return db.get_database()
+
+def query_ids(database, selection):
+	with database.get_session(False) as session:
+		return set(percept.id for percept in session.query(Percept).filter(selection.clause()))
+
+def select_ids(database, selection):
+	with database.get_session(False) as session:
+		return set(row[0] for row in session.execute(selection.select()))
+
+@pytest.fixture(params=[query_ids, select_ids])
+def matching(request, filtersdb):
+	return lambda selection: request.param(filtersdb, selection)
+
+def test_tag(matching):
+	assert matching(HasTag('train')) == set((585354, 780034, 485447, 629441))
+
+def test_tags_all(matching):
+	assert matching(HasTag('train') & HasTag('hard')) == set((585354, 780034))
+
+def test_tags_all_not(matching):
+	assert matching(HasTag('train') & HasTag('hard') & ~HasTag('simple')) == set((585354, ))
+
+def test_tags_any(matching):
+	assert matching(HasTag('dog') | HasTag('a')) == set((572232, 642924))
+
+def test_not(matching):
+	assert len(matching(~HasTag('train'))) == 8
+
+def test_nested(matching):
+	selection = (HasTag('dog') | HasTag('simple')) & ~(HasTag('a') | HasTag('d'))
+	assert matching(selection) == set((572232, 780034))
+
+def test_property(matching):
+	assert len(matching(HasProperty('val1'))) == 10
+	assert len(matching(HasProperty('val1', 'val2'))) == 10
+	assert matching(HasProperty('val1', 'xxx')) == set()
+	assert matching(HasTag('train') & HasProperty('val1', 'val2')) == set((585354, 780034, 485447, 629441))
+
+def test_collection(matching, filtersdb):
+	with filtersdb.get_session() as session:
+		collection = Collection()
+		collection.name = 'picked'
+		session.add(collection)
+		session.flush()
+		membership = PerceptCollection()
+		membership.percept_id = 585354
+		membership.collection_id = collection.id
+		session.add(membership)
+	assert matching(InCollection('picked')) == set((585354, ))
+	assert matching(InCollection('picked') & HasTag('simple')) == set()
+
+def test_changed_since(matching, filtersdb):
+	with filtersdb.get_session(False) as session:
+		percept_ids = sorted(percept_id for percept_id, in session.query(Percept.id))
+		annotations = session.query(Annotation.percept_id, Annotation.stamp).all()
+	latest = max(stamp for _, stamp in annotations)
+	assert matching(ChangedSince(0)) == set(percept_ids)
+	assert matching(ChangedSince(percept_ids[-2])) == set((percept_ids[-1], ))
+	assert matching(ChangedSince(percept_ids[-1], latest)) == set()
+	restamped = set(percept_id for percept_id, stamp in annotations if stamp >= latest - timedelta(microseconds=1))
+	assert matching(ChangedSince(percept_ids[-1], latest - timedelta(microseconds=1))) == restamped
+	assert matching(ChangedSince(percept_ids[-2], latest - timedelta(microseconds=1)) & HasTag('train')) == (restamped | set((percept_ids[-1], ))) & matching(HasTag('train'))
+
+def test_no_duplicates(filtersdb):
+	with filtersdb.get_session(False) as session:
+		query = session.query(Percept).filter((HasTag('train') & HasTag('hard')).clause())
+		assert query.count() == 2
+
+def test_flatten():
+	selection = HasTag('a') & HasTag('b') & HasTag('c')
+	assert isinstance(selection, AllOf)
+	assert len(selection.filters) == 3
+	assert isinstance(~~HasTag('a'), HasTag)
+
+def test_parse():
+	selection = parse('tag:train & tag:hard & !property:source=synthetic')
+	assert repr(selection) == "AllOf(HasTag('train'), HasTag('hard'), Not(HasProperty('source', 'synthetic')))"
+
+def test_parse_precedence():
+	selection = parse('tag:a | tag:b & !(collection:c | property:d)')
+	assert repr(selection) == "AnyOf(HasTag('a'), AllOf(HasTag('b'), Not(AnyOf(InCollection('c'), HasProperty('d', None)))))"
+
+def test_parse_quoted():
+	selection = parse('tag:"with space" & property:"x y"="a & b"')
+	assert repr(selection) == "AllOf(HasTag('with space'), HasProperty('x y', 'a & b'))"
+
+def test_parse_matches(filtersdb):
+	assert query_ids(filtersdb, parse('tag:train & tag:hard & !tag:simple')) == set((585354, ))
+
+@pytest.mark.parametrize('text', ['', 'tag:a &', 'bogus:a', '(tag:a', 'tag:a)', 'tag:a tag:b', '& tag:a'])
+def test_parse_invalid(text):
+	with pytest.raises(FilterSyntaxError):
+		parse(text)
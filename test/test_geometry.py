@@ -0,0 +1,76 @@
+import rigor.geometry
+import pytest
+
+def test_parse_point():
+	assert rigor.geometry.parse_point('(1, 2)') == (1, 2)
+	assert rigor.geometry.parse_point('(1.5,-2.25)') == (1.5, -2.25)
+	assert rigor.geometry.parse_point(u'(34.56, -120.2)') == (34.56, -120.2)
+	assert rigor.geometry.parse_point(None) is None
+
+def test_parse_point_preserves_integers():
+	x, y = rigor.geometry.parse_point('(3, 4)')
+	assert isinstance(x, int)
+	assert isinstance(y, int)
+
+def test_parse_polygon():
+	assert rigor.geometry.parse_polygon('((1, 2), (3, 4))') == ((1, 2), (3, 4))
+	assert rigor.geometry.parse_polygon('(1, 2), (3, 4)') == ((1, 2), (3, 4))
+	assert rigor.geometry.parse_polygon('((1.25,2.5),(3.25,4))') == ((1.25, 2.5), (3.25, 4))
+	assert rigor.geometry.parse_polygon(u'((1, 2))') == ((1, 2), )
+	assert rigor.geometry.parse_polygon('') == tuple()
+	assert rigor.geometry.parse_polygon(None) is None
+
+def test_parse_polygon_mixed_types():
+	polygon = rigor.geometry.parse_polygon('((1, 2.5), (3, 4), (1e2, -5))')
+	assert polygon == ((1, 2.5), (3, 4), (100.0, -5))
+	assert [[type(coordinate) for coordinate in vertex] for vertex in polygon] == [[int, float], [int, int], [float, int]]
+
+def test_format_point():
+	assert rigor.geometry.format_point((1, 2)) == '(1, 2)'
+	assert rigor.geometry.format_point((1.25, -3)) == '(1.25, -3)'
+	assert rigor.geometry.format_point(None) is None
+
+def test_format_polygon():
+	assert rigor.geometry.format_polygon(((1, 2), (3, 4))) == '(1, 2), (3, 4)'
+	assert rigor.geometry.format_polygon(((1.25, 2.5), (3.25, 4))) == '(1.25, 2.5), (3.25, 4)'
+	assert rigor.geometry.format_polygon(tuple()) == ''
+	assert rigor.geometry.format_polygon(None) is None
+
+def test_round_trip_polygon():
+	polygon = ((1, 10), (3, 6), (1.5, 10.25), (10, 3))
+	assert rigor.geometry.parse_polygon(rigor.geometry.format_polygon(polygon)) == polygon
+
+try:
+	import numpy as np
+
+	def test_parse_point_array():
+		point = rigor.geometry.parse_point('(1.5, 2)', as_array=True)
+		assert point.dtype == np.float64
+		assert point.tolist() == [1.5, 2.0]
+
+	def test_parse_polygon_array():
+		polygon = rigor.geometry.parse_polygon('((1, 2), (3, 4), (5.5, 6))', as_array=True)
+		assert polygon.shape == (3, 2)
+		assert polygon.tolist() == [[1, 2], [3, 4], [5.5, 6]]
+
+	def test_format_polygon_array():
+		polygon = np.array(((1, 2), (3.5, 4)))
+		assert rigor.geometry.format_polygon(polygon) == '(1, 2), (3.5, 4)'
+
+	def test_parse_polygons():
+		coordinates, offsets = rigor.geometry.parse_polygons(['(1, 2), (3, 4)', None, u'((5.5, 6))', ''])
+		assert coordinates.tolist() == [[1, 2], [3, 4], [5.5, 6]]
+		assert offsets.tolist() == [0, 2, 2, 3, 3]
+
+	def test_parse_polygons_empty():
+		coordinates, offsets = rigor.geometry.parse_polygons([])
+		assert coordinates.shape == (0, 2)
+		assert offsets.tolist() == [0]
+
+	@pytest.mark.parametrize('value', ['(1, 2), (x, 4)', '(1, 2), (3)', '(1, 2), (3, 4), (5, 6, 7)'])
+	def test_parse_polygons_malformed(value):
+		with pytest.raises(ValueError):
+			rigor.geometry.parse_polygons(['(0, 0), (1, 1)', value, '(8, 9)'])
+
+except ImportError:
+	pass
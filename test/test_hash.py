@@ -14,3 +14,18 @@ def test_hash_path():
 	expected = '6ecd86bbe85e03ee2a03eb61ad080fcefe399df1c802fecc79d20949c8986115'
 	hashed = rigor.hash.sha256_hash(data)
 	assert hashed == expected
+
+def test_copy_and_hash():
+	destination = io.BytesIO()
+	with open(constants.kExampleImageFile, 'rb') as source:
+		digest = rigor.hash.copy_and_hash(source, destination)
+	assert digest.sha256() == '6ecd86bbe85e03ee2a03eb61ad080fcefe399df1c802fecc79d20949c8986115'
+	assert digest.byte_count == os.path.getsize(constants.kExampleImageFile)
+	with open(constants.kExampleImageFile, 'rb') as source:
+		assert destination.getvalue() == source.read()
+
+def test_copy_and_hash_md5():
+	digest = rigor.hash.copy_and_hash(io.BytesIO('a test string to hash'), md5=True)
+	assert digest.sha256() == '1f9ea24f2e0b6707fdeb7ea29613b080d8657d5d2dfefbe8130e9c40cf6d9e2d'
+	assert digest.md5() == ('98f1ddead04a4ad12ee92534b11dce64', 'mPHd6tBKStEu6SU0sR3OZA==')
+	assert digest.byte_count == 21
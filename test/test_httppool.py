@@ -0,0 +1,144 @@
+from rigor.httppool import HTTPConnectionPool
+import rigor.httppool
+from rigor.perceptops import PerceptOps
+import rigor.config
+import httpserver
+import threading
+import urllib2
+import socket
+import constants
+import pytest
+
+kConfig = rigor.config.RigorDefaultConfiguration(constants.kConfigFile)
+
+@pytest.fixture
+def server():
+	server = httpserver.start()
+	yield server
+	httpserver.stop(server)
+
+def test_from_config():
+	pool = HTTPConnectionPool.from_config(kConfig)
+	assert pool._max_per_host == rigor.httppool.kDefaultMaxPerHost
+
+def test_get_reuses_connection(server):
+	pool = HTTPConnectionPool()
+	for index in range(5):
+		assert pool.get(server.url + '/data/{0}'.format(index)).read() == str(index)
+	assert pool.connections == 1
+	assert server.connections == 1
+	pool.clear()
+
+def test_get_connection_close(server):
+	pool = HTTPConnectionPool()
+	for _ in range(2):
+		assert pool.get(server.url + '/close').read() == 'closed'
+	assert pool.connections == 2
+
+def test_get_stale_connection(server):
+	pool = HTTPConnectionPool(retries=0)
+	assert pool.get(server.url + '/data/a').read() == 'a'
+	# Closes the pooled connection behind the pool's back, as a server closing an idle connection would
+	for host in pool._hosts.values():
+		for connection in host.idle:
+			connection.sock.shutdown(socket.SHUT_RDWR)
+	assert pool.get(server.url + '/data/b').read() == 'b'
+	assert pool.retried == 0
+
+def test_get_retries(server, monkeypatch):
+	monkeypatch.setattr(rigor.httppool, 'kRetryDelay', 0)
+	pool = HTTPConnectionPool(retries=2)
+	assert pool.get(server.url + '/flaky').read() == 'recovered'
+	assert pool.retried == 2
+
+def test_get_retries_exhausted(server, monkeypatch):
+	monkeypatch.setattr(rigor.httppool, 'kRetryDelay', 0)
+	pool = HTTPConnectionPool(retries=1)
+	with pytest.raises(urllib2.HTTPError) as err:
+		pool.get(server.url + '/flaky')
+	assert err.value.code == 503
+
+def test_get_connection_refused(monkeypatch):
+	monkeypatch.setattr(rigor.httppool, 'kRetryDelay', 0)
+	unused = socket.socket()
+	unused.bind(('127.0.0.1', 0))
+	port = unused.getsockname()[1]
+	unused.close()
+	pool = HTTPConnectionPool(retries=1)
+	with pytest.raises(socket.error):
+		pool.get('http://127.0.0.1:{0}/data/a'.format(port))
+	assert pool.retried == 1
+
+def test_get_missing(server):
+	pool = HTTPConnectionPool()
+	with pytest.raises(urllib2.HTTPError) as err:
+		pool.get(server.url + '/nothing')
+	assert err.value.code == 404
+
+def test_get_redirect(server):
+	pool = HTTPConnectionPool()
+	assert pool.get(server.url + '/redirect').read() == 'redirected'
+
+def test_get_range(server):
+	pool = HTTPConnectionPool()
+	assert pool.get_range(server.url + '/range/0123456789', 2, 5).read() == '234'
+	assert pool.get_range(server.url + '/range/0123456789', 7).read() == '789'
+	assert pool.get_range(server.url + '/range/0123456789', 8, 20).read() == '89'
+	assert pool.get_range(server.url + '/range/0123456789', 20).read() == ''
+	assert pool.get_range(server.url + '/range/0123456789', 5, 5).read() == ''
+
+def test_get_range_unsupported(server):
+	pool = HTTPConnectionPool()
+	data = pool.get_range(server.url + '/data/0123456789', 2, 5)
+	assert data.read() == '234'
+	assert data.whole == '0123456789'
+
+def test_get_unsupported_scheme():
+	with pytest.raises(ValueError):
+		HTTPConnectionPool().get('ftp://example.com/data')
+
+def test_get_threads_limited(server):
+	pool = HTTPConnectionPool(max_per_host=2)
+	results = list()
+	def read():
+		for _ in range(20):
+			results.append(pool.get(server.url + '/body').read())
+	threads = [threading.Thread(target=read) for _ in range(6)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert results == [httpserver.kBody] * 120
+	assert pool.connections <= 2
+	assert server.requests == 120
+
+def test_get_streams_body(server):
+	pool = HTTPConnectionPool(max_per_host=1)
+	body = pool.get(server.url + '/body')
+	assert body.read(10) == httpserver.kBody[:10]
+	# The connection is still in use until the body is read to its end or closed
+	assert pool._hosts.values()[0].in_use == 1
+	body.close()
+	assert pool.get(server.url + '/body').read() == httpserver.kBody
+	assert pool.connections == 2
+	assert pool.get(server.url + '/data/a').read() == 'a'
+	assert pool.connections == 2
+
+def test_get_connection_wait_timeout(server):
+	pool = HTTPConnectionPool(max_per_host=1, timeout=0.2)
+	body = pool.get(server.url + '/body')
+	with pytest.raises(socket.timeout):
+		pool.get(server.url + '/body')
+	body.close()
+	assert pool.get(server.url + '/data/a').read() == 'a'
+
+def test_perceptops_read_http(server):
+	ops = PerceptOps(kConfig)
+	for _ in range(2):
+		with ops.read(server.url + '/data/percept') as data:
+			assert data.read() == 'percept'
+	assert ops.http.connections == 1
+
+def test_perceptops_read_range_http(server):
+	with PerceptOps(kConfig).read_range(server.url + '/range/0123456789', 1, 4) as data:
+		assert data.read() == '123'
@@ -0,0 +1,113 @@
+from rigor.imagecache import DecodedImageCache
+from rigor.types import Percept
+import rigor.algorithm
+import rigor.perceptops
+import rigor.config
+import numpy as np
+import constants
+import pytest
+
+kConfig = rigor.config.RigorDefaultConfiguration(constants.kConfigFile)
+
+def make_percept(percept_id, hash_value=None, locator=None):
+	percept = Percept()
+	percept.id = percept_id
+	percept.hash = hash_value
+	percept.locator = locator
+	return percept
+
+def test_from_config():
+	assert DecodedImageCache.from_config(kConfig) is None
+
+def test_key():
+	assert DecodedImageCache.key(make_percept(1, 'a' * 64)) == DecodedImageCache.key(make_percept(2, 'a' * 64))
+	assert DecodedImageCache.key(make_percept(1)) != DecodedImageCache.key(make_percept(2))
+	assert DecodedImageCache.key(make_percept(None, locator='x')) != DecodedImageCache.key(make_percept(None, locator='y'))
+	assert DecodedImageCache.key(make_percept(1), 1) != DecodedImageCache.key(make_percept(1), 2)
+
+def test_get_put():
+	cache = DecodedImageCache(1000)
+	key = cache.key(make_percept(1))
+	assert cache.get(key) is None
+	image = cache.put(key, np.zeros((10, 10), np.uint8))
+	assert cache.get(key) is image
+	assert (cache.hits, cache.misses, cache.size, len(cache)) == (1, 1, 100, 1)
+
+def test_read_only():
+	cache = DecodedImageCache(1000)
+	image = cache.put(cache.key(make_percept(1)), np.zeros((10, 10), np.uint8))
+	with pytest.raises(ValueError):
+		image[0, 0] = 1
+
+def test_lru_eviction():
+	cache = DecodedImageCache(250)
+	keys = [cache.key(make_percept(index)) for index in range(3)]
+	cache.put(keys[0], np.zeros(100, np.uint8))
+	cache.put(keys[1], np.zeros(100, np.uint8))
+	cache.get(keys[0])
+	cache.put(keys[2], np.zeros(100, np.uint8))
+	assert cache.get(keys[1]) is None
+	assert cache.get(keys[0]) is not None
+	assert cache.get(keys[2]) is not None
+	assert (cache.evictions, cache.size) == (1, 200)
+
+def test_replace():
+	cache = DecodedImageCache(1000)
+	key = cache.key(make_percept(1))
+	cache.put(key, np.zeros(100, np.uint8))
+	cache.put(key, np.zeros(300, np.uint8))
+	assert cache.size == 300
+
+def test_too_large():
+	cache = DecodedImageCache(10)
+	key = cache.key(make_percept(1))
+	image = cache.put(key, np.zeros(100, np.uint8))
+	assert not image.flags.writeable
+	assert cache.get(key) is None
+
+def test_get_or_load():
+	cache = DecodedImageCache(1000)
+	key = cache.key(make_percept(1))
+	loads = list()
+	def load():
+		loads.append(1)
+		return np.zeros(10, np.uint8)
+	assert cache.get_or_load(key, load) is cache.get_or_load(key, load)
+	assert len(loads) == 1
+	assert cache.get_or_load(cache.key(make_percept(2)), lambda: None) is None
+
+def test_clear():
+	cache = DecodedImageCache(1000)
+	cache.put(cache.key(make_percept(1)), np.zeros(10, np.uint8))
+	cache.clear()
+	assert (cache.size, len(cache)) == (0, 0)
+
+def test_image_algorithm(monkeypatch):
+	decoded = list()
+	def decode(percept_data, scale=None, roi=None):
+		decoded.append(percept_data)
+		return np.zeros(10, np.uint8)
+	monkeypatch.setattr(rigor.perceptops.ImageOps, 'decode', staticmethod(decode))
+	class ShapeAlgorithm(rigor.algorithm.ImageAlgorithm):
+		def run(self, percept_data):
+			return percept_data.shape
+	algorithm = ShapeAlgorithm()
+	algorithm.image_cache = DecodedImageCache()
+	percept = make_percept(1)
+	first = algorithm.postfetch(percept, 'data')
+	assert algorithm.postfetch(percept, 'data') is first
+	assert len(decoded) == 1
+
+try:
+	import cv2
+
+	def test_imageops_fetch_cached():
+		ops = rigor.perceptops.ImageOps(kConfig, image_cache=DecodedImageCache())
+		percept = make_percept(1, locator=constants.kExampleImageFile)
+		image = ops.fetch(percept)
+		assert ops.fetch(percept) is image
+		assert not image.flags.writeable
+		assert image.shape == constants.kExampleImageDimensions
+
+except ImportError:
+	pass
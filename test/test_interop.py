@@ -2,16 +2,23 @@ import os
 import json
 import constants
 import shutil
+import time
+import threading
 import db
 from s3 import setup_module, teardown_module
-from datetime import datetime
+from datetime import datetime, timedelta
 from urlparse import urlsplit
 from rigor.config import RigorDefaultConfiguration
 from rigor.database import Database
 from rigor.utils import RigorJSONEncoder
-from rigor.interop import Importer, Exporter
-from rigor.types import Percept
+from rigor.interop import Importer, Exporter, ExportWatermark, ImportJournal
+import rigor.interop
+import rigor.columnar
+import rigor.hash
+from rigor.types import Percept, Annotation
 from rigor.perceptops import PerceptOps
+from rigor.filters import HasTag
+from rigor.querycache import get_write_version
 import pytest
 
 kConfig = RigorDefaultConfiguration(constants.kConfigFile)
@@ -170,3 +177,375 @@ def test_export_tag(exportdb):
 	with open(constants.kImportFile, 'rb') as import_file:
 		metadata = json.load(import_file)
 		assert len(metadata) == 3
+
+def test_export_selection(exportdb):
+	exporter = Exporter(kConfig, constants.kTestFile, constants.kImportFile)
+	exporter.run('train', HasTag('hard') & ~HasTag('simple'))
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+		assert len(metadata) == 1
+		assert metadata[0]['id'] == 585354
+
+def test_export_json_lines_batched(exportdb):
+	Exporter(kConfig, constants.kTestFile, constants.kImportFile).run()
+	with open(constants.kImportFile, 'rb') as import_file:
+		expected = json.load(import_file)
+	exporter = Exporter(kConfig, constants.kTestFile, constants.kImportFile, json_lines=True, batch_size=5)
+	assert exporter.run() == 12
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = [json.loads(line) for line in import_file]
+	assert metadata == expected
+	assert [percept['id'] for percept in metadata] == sorted(percept['id'] for percept in metadata)
+	assert any(percept['annotations'] and percept['annotations'][0]['tags'] for percept in metadata)
+
+def test_export_incremental(importdb, monkeypatch):
+	monkeypatch.setattr(rigor.interop, 'kWatermarkIDOverlap', 0)
+	monkeypatch.setattr(rigor.interop, 'kWatermarkStampOverlap', timedelta(0))
+	Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=False).run()
+	watermark_path = os.path.join(constants.kImportDirectory, 'watermark.json')
+	exporter = Exporter(kConfig, constants.kImportDatabase, constants.kImportFile, json_lines=True)
+	assert exporter.run(since=ExportWatermark.load(watermark_path)) == 3
+	exporter.watermark.save(watermark_path)
+	assert exporter.run(since=ExportWatermark.load(watermark_path)) == 0
+	with importdb.get_session() as session:
+		percept_ids = [percept_id for percept_id, in session.query(Percept.id).order_by(Percept.id)]
+		session.add(Annotation(percept_id=percept_ids[0], confidence=1, domain='unittest', stamp=datetime.utcnow() + timedelta(days=1)))
+	Importer(kConfig, constants.kImportDatabase, [constants.kExamplePercept, ], import_data=False).run()
+	watermark = ExportWatermark.load(watermark_path)
+	assert watermark.percept_id == percept_ids[-1]
+	assert exporter.run(since=watermark) == 2
+	with open(constants.kImportFile, 'rb') as import_file:
+		exported = [json.loads(line) for line in import_file]
+	assert exported[0]['id'] == percept_ids[0]
+	assert len(exported[0]['annotations']) == 2
+	assert exported[1]['id'] > percept_ids[-1]
+	assert exporter.run(since=exporter.watermark) == 0
+
+def test_export_incremental_overlap(importdb, monkeypatch):
+	monkeypatch.setattr(rigor.interop, 'kWatermarkIDOverlap', 1)
+	monkeypatch.setattr(rigor.interop, 'kWatermarkStampOverlap', timedelta(0))
+	Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=False).run()
+	exporter = Exporter(kConfig, constants.kImportDatabase, constants.kImportFile, json_lines=True)
+	assert exporter.run() == 3
+	# The last percept is within the overlap, so it's exported again
+	assert exporter.run(since=exporter.watermark) == 1
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=False, skip_existing=True)
+	importer.run()
+	assert importer.existing == 1
+	assert importer.failures == []
+	with importdb.get_session(False) as session:
+		assert session.query(Percept).count() == 3
+
+def test_import_skip_existing_repository():
+	with pytest.raises(ValueError):
+		Importer(kConfig, constants.kImportDatabase, constants.kImportFile, skip_existing=True, repository=constants.kRepoDirectory)
+
+def test_export_columnar(exportdb):
+	directory = os.path.join(constants.kImportDirectory, 'columns')
+	exporter = Exporter(kConfig, constants.kTestFile, directory, columnar=True)
+	assert exporter.run('train') == 4
+	assert exporter.watermark.percept_id > 0
+	tables = rigor.columnar.load_columns(directory)
+	assert sorted(tables['percept']['id'].tolist()) == [485447, 585354, 629441, 780034]
+
+def content_address(path):
+	with open(path, 'rb') as data_file:
+		sha256 = rigor.hash.sha256_hash(data_file)
+	return os.path.join(sha256[0:2], sha256[2:4], sha256 + '.txt')
+
+@pytest.mark.parametrize('batch_size,workers', [(1, 1), (4, 1), (4, 3)])
+def test_import_content_addressed(importdb, batch_size, workers):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	duplicate = dict(metadata[0])
+	del duplicate['locator']
+	metadata.append(duplicate)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=batch_size, workers=workers, repository=constants.kRepoDirectory)
+	importer.run()
+	if workers == 1:
+		# Identical data stored concurrently is written twice, though only one object is kept
+		assert importer.deduplicated == 1
+	source = urlsplit(metadata[0]['source']).path
+	expected = 'file://' + os.path.join(os.path.abspath(constants.kRepoDirectory), content_address(source))
+	with importdb.get_session(False) as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert len(percepts) == 4
+		assert percepts[0].locator == expected
+		assert percepts[3].locator.startswith(expected + '#')
+		assert percepts[0].hash == percepts[3].hash == '6b86b273ff34fce19d6b804eff5a3f5747ada4eaa22f1d49c01e52ddb7875b4b'
+	stored = [os.path.join(directory, filename) for directory, _, filenames in os.walk(constants.kRepoDirectory) for filename in filenames]
+	assert len(stored) == 3
+	with PerceptOps(kConfig).read(percepts[3].locator) as data:
+		assert data.read() == '1'
+
+def test_import_content_addressed_existing(importdb):
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, repository=constants.kRepoDirectory)
+	importer.run()
+	stored_path = os.path.join(constants.kRepoDirectory, content_address(os.path.join(constants.kImportDirectory, '02.txt')))
+	os.utime(stored_path, (1000000000, 1000000000))
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, repository=constants.kRepoDirectory)
+	importer.run()
+	assert importer.deduplicated == 3
+	assert os.stat(stored_path).st_mtime == 1000000000
+	with importdb.get_session(False) as session:
+		assert session.query(Percept).count() == 6
+
+def test_import_content_addressed_s3(importdb):
+	repository = 's3://' + os.path.join(constants.kExampleBucket, 'content')
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, batch_size=3, repository=repository)
+	importer.run()
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, batch_size=3, repository=repository)
+	importer.run()
+	assert importer.deduplicated == 3
+	with importdb.get_session(False) as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert percepts[0].locator == repository + '/' + content_address(os.path.join(constants.kImportDirectory, '01.txt'))
+		with PerceptOps(kConfig).read(percepts[4].locator) as data:
+			assert data.read() == '2'
+
+def test_import_content_addressed_requires_data():
+	with pytest.raises(ValueError):
+		Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=False, repository=constants.kRepoDirectory)
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_import_zero_copy(importdb, workers):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	metadata[2]['hash'] = 'given'
+	metadata[2]['byte_count'] = 1
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=3, workers=workers, zero_copy=True)
+	importer.run()
+	assert sum(importer.copy_strategies.values()) == 3
+	# Source and repository are on the same filesystem
+	assert importer.copy_strategies['hardlink'] == 3
+	with importdb.get_session(False) as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert percepts[0].hash == '6b86b273ff34fce19d6b804eff5a3f5747ada4eaa22f1d49c01e52ddb7875b4b'
+		assert percepts[0].byte_count == 1
+		assert percepts[2].hash == 'given'
+		for entry, percept in zip(metadata, percepts):
+			assert os.path.samefile(urlsplit(entry['source']).path, urlsplit(percept.locator).path)
+
+def test_import_copy_strategy(importdb):
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile)
+	importer.run()
+	assert importer.copy_strategies == {'copy': 3}
+
+def test_import_journal(importdb):
+	journal_path = os.path.join(constants.kImportDirectory, 'journal.jsonl')
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata[:2], batch_size=2, journal=journal_path)
+	importer.run()
+	assert importer.skipped == 0
+	with open(journal_path, 'ab') as journal_file:
+		# Interrupted write
+		journal_file.write('{"source": "file:///tru')
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=2, journal=journal_path)
+	importer.run()
+	assert importer.skipped == 2
+	with importdb.get_session(False) as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert [percept.locator for percept in percepts] == [entry['locator'] for entry in metadata]
+	journal = ImportJournal(journal_path)
+	assert len(journal) == 3
+	record = journal.get(metadata[2])
+	assert record['percept_id'] == percepts[2].id
+	assert record['hash'] == '4e07408562bedb8b60ce05c1decfe3ad16b72230967de01f640b7e4729b49fce'
+	assert record['url'] == metadata[2]['locator']
+	journal.close()
+
+def test_import_journal_records_retried_batch(importdb):
+	journal_path = os.path.join(constants.kImportDirectory, 'journal.jsonl')
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	os.unlink(urlsplit(metadata[1]['source']).path)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=3, stop_on_error=False, journal=journal_path)
+	importer.run()
+	journal = ImportJournal(journal_path)
+	assert metadata[0] in journal
+	assert metadata[1] not in journal
+	assert metadata[2] in journal
+	journal.close()
+
+def test_import_increments_write_version(importdb):
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=False)
+	importer.run()
+	with importdb.get_session(False) as session:
+		assert get_write_version(session) == 3
+
+def test_import_batched(importdb):
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=True, batch_size=2)
+	importer.run()
+	with importdb.get_session(False) as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert len(percepts) == 3
+		for percept in percepts:
+			assert os.path.exists(urlsplit(percept.locator).path)
+			assert len(percept.annotations) == 1
+		assert percepts[2].hash == '4e07408562bedb8b60ce05c1decfe3ad16b72230967de01f640b7e4729b49fce'
+		assert get_write_version(session) == 2
+
+def test_import_batch_not_retried_after_commit(importdb, monkeypatch):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=3, stop_on_error=False)
+	def record_completed(completed):
+		raise IOError("journal write failed")
+	monkeypatch.setattr(importer, '_record_completed', record_completed)
+	with pytest.raises(IOError):
+		importer.run()
+	with importdb.get_session(False) as session:
+		assert session.query(Percept).count() == 3
+
+def test_import_batched_isolates_failure(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	os.unlink(urlsplit(metadata[1]['source']).path)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, import_data=True, batch_size=3, stop_on_error=False)
+	importer.run()
+	assert len(importer.failures) == 1
+	assert importer.failures[0][0] is metadata[1]
+	with importdb.get_session(False) as session:
+		locators = [percept.locator for percept in session.query(Percept).order_by(Percept.id)]
+		assert locators == [metadata[0]['locator'], metadata[2]['locator']]
+
+def test_import_zero_copy_retry_keeps_source(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	source = urlsplit(metadata[0]['source']).path
+	with open(source, 'rb') as source_file:
+		data = source_file.read()
+	os.unlink(urlsplit(metadata[1]['source']).path)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, batch_size=3, stop_on_error=False, zero_copy=True)
+	importer.run()
+	with open(source, 'rb') as source_file:
+		assert source_file.read() == data
+	with importdb.get_session(False) as session:
+		percept = session.query(Percept).order_by(Percept.id).first()
+		assert percept.hash == '6b86b273ff34fce19d6b804eff5a3f5747ada4eaa22f1d49c01e52ddb7875b4b'
+
+def test_import_batched_stop_on_error(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	os.unlink(urlsplit(metadata[1]['source']).path)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, import_data=True, batch_size=3)
+	with pytest.raises(IOError):
+		importer.run()
+	with importdb.get_session(False) as session:
+		locators = [percept.locator for percept in session.query(Percept)]
+		assert locators == [metadata[0]['locator'], ]
+
+@pytest.mark.parametrize('max_buffered', [rigor.interop.kMaxBufferedUpload, 0])
+def test_import_hash_to_s3(importdb, monkeypatch, max_buffered):
+	monkeypatch.setattr(rigor.interop, 'kMaxBufferedUpload', max_buffered)
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	for index, percept in enumerate(metadata):
+		percept['locator'] = 's3://' + os.path.join(constants.kExampleBucket, 'hashed', str(index) + ".txt")
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, import_data=True)
+	importer.run()
+	ops = PerceptOps(kConfig)
+	with importdb.get_session(False) as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert percepts[0].hash == '6b86b273ff34fce19d6b804eff5a3f5747ada4eaa22f1d49c01e52ddb7875b4b'
+		assert percepts[0].byte_count == 1
+		with ops.read(percepts[1].locator) as data:
+			assert data.read() == '2'
+
+def test_import_parallel(importdb):
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=True, batch_size=3, workers=3)
+	importer.run()
+	with importdb.get_session(False) as session:
+		percepts = session.query(Percept).order_by(Percept.id).all()
+		assert [percept.hash for percept in percepts] == [
+			'6b86b273ff34fce19d6b804eff5a3f5747ada4eaa22f1d49c01e52ddb7875b4b',
+			'd4735e3a265e16eee03f59718b9b5d03019c07d8b6c51f90da3a666eec13ab35',
+			'4e07408562bedb8b60ce05c1decfe3ad16b72230967de01f640b7e4729b49fce',
+		]
+		for percept in percepts:
+			assert os.path.exists(urlsplit(percept.locator).path)
+
+def test_import_parallel_ordered_errors(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	for entry in metadata[1:]:
+		os.unlink(urlsplit(entry['source']).path)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, import_data=True, batch_size=3, stop_on_error=False, workers=3)
+	importer.run()
+	assert [entry for entry, _ in importer.failures] == metadata[1:]
+	with importdb.get_session(False) as session:
+		assert session.query(Percept).count() == 1
+
+def test_import_parallel_error_waits_for_copies(importdb, monkeypatch):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	importer = Importer(kConfig, constants.kImportDatabase, metadata, import_data=True, batch_size=3, workers=3)
+	copy_data = importer._copy_data
+	events = list()
+	def slow_copy(source, *args):
+		events.append(('start', source))
+		if source == metadata[0]['source']:
+			raise IOError("copy failed")
+		time.sleep(0.2)
+		result = copy_data(source, *args)
+		events.append(('end', source))
+		return result
+	monkeypatch.setattr(importer, '_copy_data', slow_copy)
+	with pytest.raises(IOError):
+		importer.run()
+	# The error is raised only after every copy already started has finished
+	assert ('end', metadata[1]['source']) in events
+	assert ('end', metadata[2]['source']) in events
+	with importdb.get_session(False) as session:
+		assert session.query(Percept).count() == 0
+
+def test_import_copies_before_transaction(importdb, monkeypatch):
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=True, batch_size=3, workers=3)
+	copy_data = importer._copy_data
+	events = list()
+	def copy(source, *args):
+		result = copy_data(source, *args)
+		events.append('copied')
+		return result
+	get_session = importer._database.get_session
+	def session(*args, **kwargs):
+		events.append('session')
+		return get_session(*args, **kwargs)
+	monkeypatch.setattr(importer, '_copy_data', copy)
+	monkeypatch.setattr(importer._database, 'get_session', session)
+	importer.run()
+	assert events == ['copied', 'copied', 'copied', 'session']
+
+def test_import_parallel_single_percept_batches(importdb, monkeypatch):
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=True, batch_size=1, workers=3)
+	copy_data = importer._copy_data
+	lock = threading.Lock()
+	copying = [0]
+	most_copying = [0]
+	def slow_copy(*args):
+		with lock:
+			copying[0] += 1
+			most_copying[0] = max(most_copying[0], copying[0])
+		time.sleep(0.2)
+		with lock:
+			copying[0] -= 1
+		return copy_data(*args)
+	monkeypatch.setattr(importer, '_copy_data', slow_copy)
+	importer.run()
+	assert most_copying[0] == 3
+	with importdb.get_session(False) as session:
+		assert session.query(Percept).count() == 3
+		assert get_write_version(session) == 3
+
+def test_import_json_lines(importdb):
+	with open(constants.kImportFile, 'rb') as import_file:
+		metadata = json.load(import_file)
+	with open(constants.kImportFile, 'wb') as import_file:
+		for entry in metadata:
+			import_file.write(json.dumps(entry) + '\n')
+	importer = Importer(kConfig, constants.kImportDatabase, constants.kImportFile, import_data=False, batch_size=2)
+	importer.run()
+	with importdb.get_session(False) as session:
+		locators = [percept.locator for percept in session.query(Percept).order_by(Percept.id)]
+		assert locators == [entry['locator'] for entry in metadata]
@@ -0,0 +1,81 @@
+import rigor.jsonstream
+import pytest
+import json
+import io
+import os
+import shutil
+import tempfile
+
+kEntries = [
+	{'locator': 'file:///a/1.txt', 'tags': ['one', 'two'], 'x_offset': 12345, 'ratio': 0.5},
+	{'locator': 'file:///a/2.txt', 'tags': [], 'sensors': None, 'flag': True},
+	{'locator': u'file:///a/\xe9t\xe9.txt', 'annotations': [{'domain': 'text', 'model': 'a, b]'}]},
+]
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, rigor.jsonstream.kChunkSize])
+def test_iter_json_array(chunk_size):
+	data = io.BytesIO(json.dumps(kEntries, indent=2))
+	assert list(rigor.jsonstream.iter_json_array(data, chunk_size)) == kEntries
+
+@pytest.mark.parametrize('chunk_size', [1, 3, rigor.jsonstream.kChunkSize])
+def test_iter_json_values(chunk_size):
+	data = io.BytesIO('\n'.join(json.dumps(entry) for entry in kEntries) + '\n')
+	assert list(rigor.jsonstream.iter_json_values(data, chunk_size)) == kEntries
+
+def test_iter_json_values_numbers():
+	data = io.BytesIO('12345 678\n9')
+	assert list(rigor.jsonstream.iter_json_values(data, 2)) == [12345, 678, 9]
+
+def test_iter_metadata_file_formats():
+	array = io.BytesIO(json.dumps(kEntries))
+	assert list(rigor.jsonstream.iter_metadata_file(array, 5)) == kEntries
+	lines = io.BytesIO('\n'.join(json.dumps(entry) for entry in kEntries))
+	assert list(rigor.jsonstream.iter_metadata_file(lines, 5)) == kEntries
+	single = io.BytesIO(json.dumps(kEntries[0], indent=2))
+	assert list(rigor.jsonstream.iter_metadata_file(single, 5)) == kEntries[:1]
+
+def test_iter_json_array_empty():
+	assert list(rigor.jsonstream.iter_json_array(io.BytesIO(' [ ] \n'), 1)) == []
+	assert list(rigor.jsonstream.iter_metadata_file(io.BytesIO(''))) == []
+
+@pytest.mark.parametrize('text', ['[{"a": 1} {"b": 2}]', '[{"a": 1},', '[{"a": 1}] x', '{"a": 1', '{"a": 1}]'])
+def test_invalid(text):
+	with pytest.raises(ValueError):
+		list(rigor.jsonstream.iter_metadata_file(io.BytesIO(text), 3))
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5])
+def test_escaped_strings(chunk_size):
+	entries = [{'a': 'quote " and [bracket}', 'b': 'back\\slash\\'}, '"{', 1.5e3]
+	data = io.BytesIO('\n'.join(json.dumps(entry) for entry in entries))
+	assert list(rigor.jsonstream.iter_json_values(data, chunk_size)) == entries
+
+def test_syntax_error_not_read_past():
+	data = io.BytesIO('{"a": x}\n' + json.dumps(kEntries[0]) * 1000)
+	with pytest.raises(ValueError):
+		list(rigor.jsonstream.iter_json_values(data, 4))
+	assert data.tell() < 100
+
+def test_large_value():
+	entry = {'locator': 'file:///a/1.txt', 'tags': ['x' * 1000] * 1000}
+	data = io.BytesIO(json.dumps([entry, entry]))
+	assert list(rigor.jsonstream.iter_json_array(data, 16)) == [entry, entry]
+
+def test_value_too_large(monkeypatch):
+	monkeypatch.setattr(rigor.jsonstream, 'kMaxBufferSize', 1000)
+	data = io.BytesIO(json.dumps([{'tags': ['x' * 100] * 20}]))
+	with pytest.raises(ValueError):
+		list(rigor.jsonstream.iter_json_array(data, 16))
+
+def test_iter_metadata_directory():
+	directory = tempfile.mkdtemp()
+	try:
+		os.mkdir(os.path.join(directory, 'b'))
+		with open(os.path.join(directory, 'a.json'), 'wb') as metadata_file:
+			json.dump(kEntries[0], metadata_file)
+		with open(os.path.join(directory, 'b', 'c.jsonl'), 'wb') as metadata_file:
+			metadata_file.write(json.dumps(kEntries[1]) + '\n' + json.dumps(kEntries[2]) + '\n')
+		with open(os.path.join(directory, 'b', 'notes.txt'), 'wb') as metadata_file:
+			metadata_file.write('not metadata')
+		assert list(rigor.jsonstream.iter_metadata(directory)) == kEntries
+	finally:
+		shutil.rmtree(directory)
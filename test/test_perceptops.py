@@ -1,7 +1,17 @@
 from rigor.perceptops import PerceptOps, ImageOps
 from rigor.types import Percept
 from s3 import setup_module, teardown_module, kKeys
+from rigor.datacache import DataCache, DataVerificationError
 import rigor.config
+import rigor.hash
+import rigor.perceptops
+import rigor.s3
+import numpy as np
+import struct
+import mmap
+import socket
+import errno
+import io
 import shutil
 import os.path
 import constants
@@ -47,6 +57,194 @@ def test_read_http():
 	with result as text_file:
 		assert text_file.read() == '1'
 
+def test_read_s3_cached(tmpdir):
+	ops = PerceptOps(kConfig, DataCache(str(tmpdir)))
+	url = 's3://' + os.path.join(constants.kExampleBucket, kKeys[2])
+	for _ in range(2):
+		with ops.read(url, None, rigor.hash.sha256_hash(io.BytesIO('2'))) as data:
+			assert data.read() == '2'
+	assert (ops.cache.hits, ops.cache.misses) == (1, 1)
+	with pytest.raises(DataVerificationError):
+		ops.read(url, None, 'f' * 64)
+
+def test_read_local_not_cached(tmpdir):
+	ops = PerceptOps(kConfig, DataCache(str(tmpdir)))
+	with ops.read(constants.kExampleTextFile) as text_file:
+		assert text_file.read() == 'This is a file to test uploading a file to S3'
+	assert ops.cache.misses == 0
+
+def test_read_buffer_local():
+	ops = PerceptOps(kConfig)
+	with ops.read_buffer(constants.kExampleTextFile) as data:
+		assert isinstance(data, mmap.mmap)
+		assert data[:4] == 'This'
+		assert np.frombuffer(data, np.uint8).size == os.path.getsize(constants.kExampleTextFile)
+
+def test_read_buffer_empty(tmpdir):
+	path = tmpdir.join('empty')
+	path.write('')
+	with PerceptOps(kConfig).read_buffer(str(path)) as data:
+		assert len(data) == 0
+
+def test_read_buffer_s3():
+	ops = PerceptOps(kConfig)
+	with ops.read_buffer('s3://' + os.path.join(constants.kExampleBucket, kKeys[1])) as data:
+		assert str(data) == '1'
+	assert ops.read_buffer('s3://' + os.path.join(constants.kExampleBucket, 'missing')) is None
+
+def test_read_buffer_s3_cached(tmpdir):
+	ops = PerceptOps(kConfig, DataCache(str(tmpdir)))
+	with ops.read_buffer('s3://' + os.path.join(constants.kExampleBucket, kKeys[2])) as data:
+		assert isinstance(data, mmap.mmap)
+		assert data[:] == '2'
+
+def test_fetch_buffer():
+	percept = Percept()
+	percept.locator = 'file://' + constants.kExampleTextFile
+	with PerceptOps(kConfig).fetch_buffer(percept) as data:
+		assert data[:4] == 'This'
+
+def make_percept(locator, byte_count=None):
+	percept = Percept()
+	percept.locator = locator
+	percept.byte_count = byte_count
+	return percept
+
+def test_fetch_many():
+	ops = PerceptOps(kConfig)
+	percepts = [make_percept(constants.kExampleTextFile), make_percept('s3://' + os.path.join(constants.kExampleBucket, kKeys[1]))] * 5
+	results = list(ops.fetch_many(percepts, concurrency=3))
+	assert [percept for percept, _ in results] == percepts
+	for _, data in results:
+		with data as opened:
+			assert opened.read() in ('This is a file to test uploading a file to S3', '1')
+
+def test_fetch_many_unordered():
+	ops = PerceptOps(kConfig)
+	percepts = [make_percept(constants.kExampleTextFile) for _ in range(10)]
+	results = list(ops.fetch_many(iter(percepts), ordered=False))
+	assert sorted(id(percept) for percept, _ in results) == sorted(id(percept) for percept in percepts)
+
+def test_fetch_many_missing():
+	ops = PerceptOps(kConfig)
+	attempts = list()
+	fetch = ops.fetch
+	def counting_fetch(percept):
+		attempts.append(percept)
+		return fetch(percept)
+	ops.fetch = counting_fetch
+	results = ops.fetch_many([make_percept(constants.kExampleTextFile), make_percept(constants.kNonexistentFile)])
+	assert next(results)[0].locator == constants.kExampleTextFile
+	with pytest.raises(IOError):
+		next(results)
+	assert len(attempts) == 2
+
+def test_fetch_many_retries(monkeypatch):
+	monkeypatch.setattr(rigor.perceptops, 'kFetchRetryDelay', 0)
+	ops = PerceptOps(kConfig)
+	failures = list()
+	def flaky_fetch(percept):
+		if len(failures) < 2:
+			failures.append(percept)
+			raise socket.error(errno.ECONNRESET, 'Connection reset')
+		return 'data'
+	ops.fetch = flaky_fetch
+	percept = make_percept('http://example.com/1')
+	assert list(ops.fetch_many([percept], retries=2)) == [(percept, 'data')]
+	assert len(failures) == 2
+	del failures[:]
+	with pytest.raises(socket.error):
+		list(ops.fetch_many([percept], retries=1))
+
+def test_fetch_many_error_closes_results():
+	ops = PerceptOps(kConfig)
+	opened = list()
+	def fetch(percept):
+		if percept.locator == 'bad':
+			raise DataVerificationError("Data doesn't match its hash")
+		data = io.BytesIO(percept.locator)
+		opened.append(data)
+		return data
+	ops.fetch = fetch
+	percepts = [make_percept('bad')] + [make_percept(str(index)) for index in range(20)]
+	with pytest.raises(DataVerificationError):
+		list(ops.fetch_many(percepts, concurrency=4))
+	assert 0 < len(opened) < 20
+	assert all(data.closed for data in opened)
+
+def test_fetch_many_image_early_close():
+	ops = ImageOps(kConfig)
+	def fetch_image(percept, scale, roi):
+		return np.zeros((4, 4, 3), dtype=np.uint8)
+	ops._fetch_image = fetch_image
+	percepts = [make_percept(str(index)) for index in range(6)]
+	results = ops.fetch_many(percepts, concurrency=4)
+	percept, image = next(results)
+	assert image.shape == (4, 4, 3)
+	results.close()
+
+def test_fetch_many_verification_not_retried(monkeypatch):
+	monkeypatch.setattr(rigor.perceptops, 'kFetchRetryDelay', 0)
+	ops = PerceptOps(kConfig)
+	attempts = list()
+	def fetch(percept):
+		attempts.append(percept)
+		raise DataVerificationError("Data doesn't match its hash")
+	ops.fetch = fetch
+	with pytest.raises(DataVerificationError):
+		list(ops.fetch_many([make_percept('http://example.com/1')], retries=2))
+	assert len(attempts) == 1
+
+def test_fetch_many_max_bytes():
+	ops = PerceptOps(kConfig)
+	fetched = list()
+	def fetch(percept):
+		fetched.append(percept)
+		return percept.locator
+	ops.fetch = fetch
+	percepts = [make_percept(str(index), 100) for index in range(20)]
+	for index, (percept, data) in enumerate(ops.fetch_many(percepts, concurrency=8, max_bytes=300)):
+		assert data == str(index)
+		assert len(fetched) <= index + 3
+
+def test_read_range_local():
+	ops = PerceptOps(kConfig)
+	with ops.read_range(constants.kExampleTextFile, 5, 7) as data:
+		assert data.read() == 'is'
+	with ops.read_range('file://' + constants.kExampleTextFile, 43) as data:
+		assert data.read() == 'S3'
+
+def test_read_range_s3(tmpdir):
+	ops = PerceptOps(kConfig)
+	rigor.s3.get_client(kConfig, constants.kExampleBucket).put('range-percept', io.BytesIO('0123456789'))
+	url = 's3://' + os.path.join(constants.kExampleBucket, 'range-percept')
+	with ops.read_range(url, 3, 6) as data:
+		assert data.read() == '345'
+	assert ops.read_range('s3://' + os.path.join(constants.kExampleBucket, 'missing'), 0, 1) is None
+	cached = PerceptOps(kConfig, DataCache(str(tmpdir)))
+	cached.read(url).close()
+	with cached.read_range(url, 3, 6) as data:
+		assert data.read() == '345'
+	assert cached.cache.hits == 1
+
+def test_fetch_time_range():
+	ops = PerceptOps(kConfig)
+	ranges = list()
+	def fetch_range(percept, start, end=None):
+		ranges.append((start, end))
+		return 'data'
+	ops.fetch_range = fetch_range
+	percept = make_percept('audio.wav')
+	percept.sample_rate = 100.0
+	percept.sample_count = 1000
+	assert ops.fetch_time_range(percept, 1.5, 2.0, 44, 4) == (150, 'data')
+	assert ops.fetch_time_range(percept, 9.5, 20.0, 44, 4) == (950, 'data')
+	assert ops.fetch_time_range(percept, 2.0) == (200, 'data')
+	assert ranges == [(644, 844), (3844, 4044), (200, None)]
+	percept.sample_rate = None
+	with pytest.raises(ValueError):
+		ops.fetch_time_range(percept, 0, 1)
+
 def test_remove_local():
 	shutil.copy(constants.kExampleImageFile, constants.kExampleTemporaryImageFile)
 	assert os.path.exists(constants.kExampleTemporaryImageFile)
@@ -87,6 +285,104 @@ def test_delete_local_by_id():
 		ops.destroy(percept.id, session)
 	assert not os.path.exists(constants.kExampleTemporaryImageFile)
 
+def test_delete_shared_local():
+	shutil.copy(constants.kExampleImageFile, constants.kExampleTemporaryImageFile)
+	database = db.get_database()
+	ops = PerceptOps(kConfig)
+	with database.get_session() as session:
+		percept = session.query(rigor.types.Percept).get(642924)
+		percept.locator = 'file://' + constants.kExampleTemporaryImageFile
+		duplicate = session.query(rigor.types.Percept).get(572232)
+		duplicate.locator = percept.locator + '#1234'
+		ops.destroy(percept, session)
+		assert os.path.exists(constants.kExampleTemporaryImageFile)
+		ops.destroy(duplicate, session)
+	assert not os.path.exists(constants.kExampleTemporaryImageFile)
+
+def test_jpeg_header():
+	app0 = '\xff\xe0' + struct.pack('>H', 16) + 'JFIF\x00' + '\x00' * 9
+	frame = '\xff\xc0' + struct.pack('>HBHHB', 17, 8, 1080, 3840, 3)
+	assert rigor.perceptops._jpeg_header(buffer('\xff\xd8' + app0 + frame)) == (1080, 3840, 3)
+	assert rigor.perceptops._jpeg_header(buffer('\xff\xd8' + app0)) is None
+	assert rigor.perceptops._jpeg_header('\x89PNG\r\n\x1a\n') is None
+
+def test_decode_invalid_scale():
+	for scale in (0, 2):
+		with pytest.raises(ValueError):
+			ImageOps.decode(constants.kExampleImageFile, scale)
+
+def test_destroy_many(tmpdir):
+	database = db.get_database()
+	ops = PerceptOps(kConfig)
+	paths = [str(tmpdir.join(str(index))) for index in range(3)]
+	for path in paths:
+		shutil.copy(constants.kExampleTextFile, path)
+	with database.get_session() as session:
+		percepts = [session.query(rigor.types.Percept).get(percept_id) for percept_id in (113714, 572232, 642924)]
+		for percept, path in zip(percepts, paths):
+			percept.locator = 'file://' + path
+		session.flush()
+		deleted, unremoved = ops.destroy_many([percepts[0], 572232, 642924], session)
+		assert (deleted, unremoved) == (3, [])
+	assert not any(os.path.exists(path) for path in paths)
+	with database.get_session() as session:
+		assert session.query(rigor.types.Percept).count() == 9
+		assert session.query(rigor.types.Annotation).filter(rigor.types.Annotation.percept_id == 572232).count() == 0
+		assert session.query(rigor.types.PerceptTag).filter(rigor.types.PerceptTag.percept_id == 642924).count() == 0
+		orphans = session.query(rigor.types.AnnotationTag).filter(~rigor.types.AnnotationTag.annotation_id.in_(session.query(rigor.types.Annotation.id)))
+		assert orphans.count() == 0
+
+def test_destroy_many_shared(tmpdir):
+	database = db.get_database()
+	ops = PerceptOps(kConfig)
+	path = str(tmpdir.join('shared'))
+	shutil.copy(constants.kExampleTextFile, path)
+	with database.get_session() as session:
+		for percept_id, locator in ((113714, 'file://' + path), (572232, 'file://' + path + '#1'), (642924, 'file://' + path + '#2')):
+			session.query(rigor.types.Percept).get(percept_id).locator = locator
+		session.flush()
+		assert ops.destroy_many([113714, 572232], session) == (2, [])
+		assert os.path.exists(path)
+		assert ops.destroy_many([642924], session) == (1, [])
+	assert not os.path.exists(path)
+
+def test_destroy_many_keep_data(tmpdir):
+	database = db.get_database()
+	ops = PerceptOps(kConfig)
+	path = str(tmpdir.join('kept'))
+	shutil.copy(constants.kExampleTextFile, path)
+	with database.get_session() as session:
+		session.query(rigor.types.Percept).get(113714).locator = path
+		session.flush()
+		assert ops.destroy_many([113714], session, remove_data=False) == (1, [])
+	assert os.path.exists(path)
+
+def test_destroy_many_s3():
+	database = db.get_database()
+	ops = PerceptOps(kConfig)
+	client = rigor.s3.get_client(kConfig, constants.kExampleBucket)
+	urls = list()
+	with database.get_session() as session:
+		for index, percept_id in enumerate((113714, 572232, 642924)):
+			key = 'destroy-many-{0}'.format(index)
+			client.put(key, constants.kExampleTextFile)
+			urls.append('s3://' + os.path.join(constants.kExampleBucket, key))
+			session.query(rigor.types.Percept).get(percept_id).locator = urls[-1]
+		session.flush()
+		assert ops.destroy_many([113714, 572232, 642924], session, concurrency=2) == (3, [])
+	for url in urls:
+		assert ops.read(url) is None
+
+def test_destroy_many_http():
+	database = db.get_database()
+	ops = PerceptOps(kConfig)
+	with database.get_session() as session:
+		session.query(rigor.types.Percept).get(113714).locator = 'http://example.com/data'
+		session.flush()
+		with pytest.raises(NotImplementedError):
+			ops.destroy_many([113714], session)
+		assert session.query(rigor.types.Percept).get(113714) is not None
+
 try:
 	import cv2
 
@@ -102,5 +398,33 @@ try:
 		result = ops.decode(constants.kExampleImageFile)
 		assert result.shape == constants.kExampleImageDimensions
 
+	def test_imageops_decode_scaled():
+		result = ImageOps.decode(constants.kExampleImageFile, 0.25)
+		assert result.shape == (270, 960, 3)
+
+	def test_imageops_decode_roi():
+		result = ImageOps.decode(constants.kExampleImageFile, roi=(100, 50, 200, 20))
+		assert result.shape == (20, 200, 3)
+		scaled = ImageOps.decode(constants.kExampleImageFile, 0.5, (100, 50, 200, 20))
+		assert scaled.shape == (10, 100, 3)
+		with pytest.raises(ValueError):
+			ImageOps.decode(constants.kExampleImageFile, roi=(5000, 0, 10, 10))
+
+	def test_imageops_decode_jpeg_reduced(tmpdir):
+		path = str(tmpdir.join('image.jpg'))
+		cv2.imwrite(path, cv2.imread(constants.kExampleImageFile)[:, :, :3])
+		assert ImageOps.decode(path, 0.25).shape == (270, 960, 3)
+		assert ImageOps.decode(path, 0.2).shape == (216, 768, 3)
+
+	def test_imageops_decode_file():
+		with open(constants.kExampleImageFile, 'rb') as image_file:
+			result = ImageOps.decode(image_file)
+		assert result.shape == constants.kExampleImageDimensions
+
+	def test_imageops_decode_buffer():
+		with PerceptOps(kConfig).read_buffer(constants.kExampleImageFile) as image_data:
+			result = ImageOps.decode(image_data)
+		assert result.shape == constants.kExampleImageDimensions
+
 except ImportError:
 	pass
@@ -0,0 +1,87 @@
+from rigor.querycache import QueryCache, get_write_version, increment_write_version
+import rigor.querycache
+from rigor.filters import HasTag
+from rigor.perceptops import PerceptOps
+from rigor.types import Percept, Meta
+import rigor.config
+import pytest
+import shutil
+import constants
+import db
+
+kConfig = rigor.config.RigorDefaultConfiguration(constants.kConfigFile)
+
+@pytest.fixture
+def cachedb():
+	return db.get_database()
+
+def setup_function(function):
+	shutil.rmtree(constants.kQueryCacheDirectory, True)
+
+def teardown_function(function):
+	shutil.rmtree(constants.kQueryCacheDirectory, True)
+
+def test_write_version(cachedb):
+	with cachedb.get_session() as session:
+		assert get_write_version(session) == 0
+		increment_write_version(session)
+		assert get_write_version(session) == 1
+	with cachedb.get_session() as session:
+		increment_write_version(session)
+	with cachedb.get_session(False) as session:
+		assert get_write_version(session) == 2
+
+def test_write_version_created_with_schema(cachedb):
+	with cachedb.get_session() as session:
+		# As created by the schema migration
+		session.add(Meta(rigor.querycache.kWriteVersionKey, '0'))
+	with cachedb.get_session() as session:
+		assert get_write_version(session) == 0
+		increment_write_version(session)
+	with cachedb.get_session(False) as session:
+		assert get_write_version(session) == 1
+
+def test_cache_hit(cachedb):
+	cache = QueryCache(kConfig, cachedb, constants.kQueryCacheDirectory)
+	with cachedb.get_session(False) as session:
+		first = cache.percept_ids(session, HasTag('train'))
+		second = cache.percept_ids(session, HasTag('train'))
+	assert first == [485447, 585354, 629441, 780034]
+	assert second == first
+	assert cache.misses == 1
+	assert cache.hits == 1
+
+def test_cache_persists(cachedb):
+	with cachedb.get_session(False) as session:
+		QueryCache(kConfig, cachedb, constants.kQueryCacheDirectory).percept_ids(session)
+		cache = QueryCache(kConfig, cachedb, constants.kQueryCacheDirectory)
+		assert len(cache.percept_ids(session)) == 12
+	assert cache.hits == 1
+
+def test_cache_key(cachedb):
+	cache = QueryCache(kConfig, cachedb, constants.kQueryCacheDirectory)
+	with cachedb.get_session(False) as session:
+		assert len(cache.percept_ids(session, HasTag('train'))) == 4
+		assert len(cache.percept_ids(session, HasTag('simple'))) == 3
+		assert len(cache.percept_ids(session, HasTag(u'\xe9t\xe9'))) == 0
+	assert cache.misses == 3
+
+def test_cache_invalidated_by_destroy(cachedb):
+	cache = QueryCache(kConfig, cachedb, constants.kQueryCacheDirectory)
+	with cachedb.get_session(False) as session:
+		assert len(cache.percept_ids(session, HasTag('train'))) == 4
+	ops = PerceptOps(kConfig)
+	ops.remove = lambda locator, credentials: None
+	with cachedb.get_session() as session:
+		ops.destroy(585354, session)
+	with cachedb.get_session(False) as session:
+		assert len(cache.percept_ids(session, HasTag('train'))) == 3
+	assert cache.misses == 2
+
+def test_cache_query_rows(cachedb):
+	cache = QueryCache(kConfig, cachedb, constants.kQueryCacheDirectory)
+	with cachedb.get_session(False) as session:
+		query = session.query(Percept.id, Percept.locator).filter(Percept.id == 832621)
+		assert cache.query(session, query) == [(832621, 's3://test-s3-bucket/path/percept_one.txt')]
+		assert cache.query(session, query) == [(832621, 's3://test-s3-bucket/path/percept_one.txt')]
+	assert cache.hits == 1
@@ -1,10 +1,16 @@
 import rigor.algorithm
 import rigor.runner
+import rigor.perceptops
 import rigor.types
 import rigor.config
+import httpserver
 import db
+import numpy as np
+import wave
+import io
 import os
 import constants
+import pytest
 
 class PassthroughAlgorithm(rigor.algorithm.Algorithm):
 	def run(self, percept_data):
@@ -31,6 +37,32 @@ class AllPerceptRunner(rigor.runner.DatabaseRunner):
 		p = DummyPercept(constants.kExampleTextFile, None)
 		return super(AllPerceptRunner, self).fetch_data(p)
 
+class PeakAlgorithm(rigor.algorithm.AudioAlgorithm):
+	block_size = 1000
+	start_time = 0.5
+	def run(self, percept_data):
+		return [int(np.abs(block.astype(np.int32)).max()) for block in percept_data]
+
+class ListedPerceptRunner(rigor.runner.DatabaseRunner):
+	def __init__(self, algorithm, config, database, percepts):
+		super(ListedPerceptRunner, self).__init__(algorithm, config, database)
+		self._percepts = percepts
+
+	def get_percepts(self):
+		return self._percepts
+
+class StreamingRunner(rigor.runner.Runner):
+	def __init__(self, algorithm, percept):
+		super(StreamingRunner, self).__init__(algorithm)
+		self._percept = percept
+		self._perceptops = rigor.perceptops.PerceptOps(kConfig)
+
+	def get_percepts(self):
+		return [self._percept, ]
+
+	def fetch_data(self, percept):
+		return self._perceptops.fetch(percept)
+
 class DummyCommandLineRunner(rigor.runner.CommandLineMixIn, AllPerceptRunner):
 	def __init__(self, algorithm, config, database, arguments):
 		parsed_args = self.parse_arguments(arguments)
@@ -114,3 +146,35 @@ def test_command_line():
 	assert dclr._parameters == dict()
 	evaluated = dclr.run()
 	assert len(evaluated) == 12
+
+@pytest.fixture
+def audio_server():
+	server = httpserver.start()
+	samples = (np.arange(16000, dtype='<i2') - 8000).reshape(-1, 2)
+	data = io.BytesIO()
+	writer = wave.open(data, 'wb')
+	writer.setnchannels(2)
+	writer.setsampwidth(2)
+	writer.setframerate(8000)
+	writer.writeframes(samples.tostring())
+	writer.close()
+	server.files['audio.wav'] = data.getvalue()
+	yield server
+	httpserver.stop(server)
+
+def make_http_percept(server):
+	percept = rigor.types.Percept()
+	percept.id = 1
+	percept.locator = server.url + '/files/audio.wav'
+	return percept
+
+def test_run_audio_http(audio_server):
+	db.get_database()
+	runner = ListedPerceptRunner(PeakAlgorithm(), kConfig, constants.kTestFile, [make_http_percept(audio_server)])
+	evaluated = runner.run()
+	# Frames from 0.5 seconds on, so the first 4000, with samples below 0, are skipped
+	assert evaluated[0][1] == [1999, 3999, 5999, 7999]
+
+def test_run_audio_http_not_seekable(audio_server):
+	evaluated = StreamingRunner(PeakAlgorithm(), make_http_percept(audio_server)).run()
+	assert evaluated[0][1] == [1999, 3999, 5999, 7999]
@@ -1,4 +1,7 @@
-from rigor.s3 import RigorS3Client, BotoS3Client
+from rigor.s3 import RigorS3Client, BotoS3Client, S3ClientRegistry, get_client
+import rigor.s3
+import threading
+import io
 from rigor.config import RigorDefaultConfiguration
 from s3 import setup_module, teardown_module, kKeys
 import pytest
@@ -50,6 +53,23 @@ def test_get_local_file(client):
 	with open(constants.kExampleDownloadedFile, 'rb') as data:
 		assert data.read() == str(0)
 
+def test_get_range(client):
+	key = 'range-key'
+	client.put(key, io.BytesIO('0123456789'))
+	assert client.get_range(key, 2, 5).read() == '234'
+	assert client.get_range(key, 7).read() == '789'
+	assert client.get_range(key, 20).read() == ''
+	assert client.get_range(key, 3, 3).read() == ''
+	assert client.get_range('missing-range-key', 0, 5) is None
+
+def test_get_range_default():
+	class WholeS3Client(DummyS3Client):
+		def get(self, key, local_file=None):
+			return io.BytesIO('0123456789')
+	client = WholeS3Client(kConfig, constants.kExampleBucket)
+	assert client.get_range('key', 2, 5).read() == '234'
+	assert client.get_range('key', 8).read() == '89'
+
 def test_put_local_filename(client):
 	key = 'new-s3-key-4'
 	with open(constants.kExampleTextFile, 'rb') as text_file:
@@ -67,6 +87,10 @@ def test_put_local_open_file(client):
 	with client.get(key) as contents:
 		assert contents.read() == text
 
+def test_exists(client):
+	assert client.exists(kKeys[0])
+	assert not client.exists('xxxxxxx/missing.txt')
+
 def test_delete(client):
 	key = 'new-s3-key-6'
 	client.put(key, constants.kExampleTextFile)
@@ -86,3 +110,52 @@ def test_list_prefix(client):
 		count += 1
 		assert item.key in kKeys
 	assert count == 3
+
+def test_registry_reuses_clients():
+	registry = S3ClientRegistry()
+	client = registry.get(kConfig, constants.kExampleBucket)
+	assert registry.get(kConfig, constants.kExampleBucket) is client
+	assert registry.get(kConfig, constants.kExampleBucket, constants.kExampleCredentials) is not client
+	with client.get(kKeys[1]) as contents:
+		assert contents.read() == '1'
+	registry.clear()
+	assert registry.get(kConfig, constants.kExampleBucket) is not client
+
+def test_registry_shares_connection_between_buckets():
+	registry = S3ClientRegistry()
+	client = registry.get(kConfig, constants.kExampleBucket)
+	other = registry.get(kConfig, 'other-bucket')
+	assert other._conn is client._conn
+
+def test_registry_default_client(monkeypatch):
+	class ListingS3Client(DummyS3Client):
+		def list(self, prefix=None):
+			return [key for key in ('a', 'ab', 'b') if key.startswith(prefix or '')]
+	monkeypatch.setattr(rigor.s3, 'DefaultS3Client', ListingS3Client)
+	registry = S3ClientRegistry()
+	client = registry.get(kConfig, constants.kExampleBucket)
+	assert isinstance(client, ListingS3Client)
+	assert registry.get(kConfig, constants.kExampleBucket) is client
+	assert client.exists('a')
+	assert not client.exists('c')
+
+def test_registry_per_thread():
+	clients = list()
+	thread = threading.Thread(target=lambda: clients.append(get_client(kConfig, constants.kExampleBucket)))
+	thread.start()
+	thread.join()
+	assert clients[0] is not get_client(kConfig, constants.kExampleBucket)
+	assert get_client(kConfig, constants.kExampleBucket) is get_client(kConfig, constants.kExampleBucket)
+
+def test_delete_many(client, monkeypatch):
+	monkeypatch.setattr(rigor.s3, 'kMaxDeleteKeys', 2)
+	keys = ['delete-many-{0}'.format(index) for index in range(5)]
+	for key in keys:
+		client.put(key, constants.kExampleTextFile)
+	assert client.delete_many(['/' + keys[0]] + keys[1:]) == []
+	for key in keys:
+		assert not client.exists(key)
+
+def test_delete_many_default():
+	dummy = DummyS3Client(kConfig, constants.kExampleBucket)
+	assert dummy.delete_many(['a', 'b']) == []
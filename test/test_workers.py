@@ -0,0 +1,74 @@
+from rigor.workers import WorkerPool
+import threading
+import time
+
+def slow_square(value, delay):
+	time.sleep(delay)
+	if value < 0:
+		raise ValueError(value)
+	return value * value
+
+def test_imap_ordered():
+	with WorkerPool(slow_square, 4) as pool:
+		arguments = [(value, 0.01 * (5 - value)) for value in range(6)]
+		results = list(pool.imap(arguments))
+	assert [result for _, result, _ in results] == [0, 1, 4, 9, 16, 25]
+	assert [task for task, _, _ in results] == arguments
+
+def test_imap_unordered():
+	with WorkerPool(slow_square, 4) as pool:
+		results = list(pool.imap([(3, 0.05), (2, 0.0)], ordered=False))
+	assert [result for _, result, _ in results] == [4, 9]
+
+def test_imap_errors():
+	with WorkerPool(slow_square, 2) as pool:
+		results = list(pool.imap([(1, 0), (-1, 0), (2, 0)]))
+	assert results[0][1:] == (1, None)
+	assert results[1][1] is None
+	assert isinstance(results[1][2], ValueError)
+	assert results[2][1:] == (4, None)
+
+def test_imap_bounded():
+	lock = threading.Lock()
+	state = {'running': 0, 'peak': 0}
+	def track(value):
+		with lock:
+			state['running'] += 1
+			state['peak'] = max(state['peak'], state['running'])
+		time.sleep(0.005)
+		with lock:
+			state['running'] -= 1
+		return value
+	consumed = [0]
+	def arguments():
+		for value in range(50):
+			consumed[0] += 1
+			yield (value, )
+	with WorkerPool(track, 8, max_pending=3) as pool:
+		for index, (_, result, _) in enumerate(pool.imap(arguments())):
+			assert result == index
+			assert consumed[0] <= index + 4
+	assert state['peak'] <= 3
+
+def test_imap_abandoned():
+	with WorkerPool(slow_square, 2) as pool:
+		for _, result, _ in pool.imap([(value, 0.01) for value in range(10)]):
+			break
+		assert [result for _, result, _ in pool.imap([(5, 0)])] == [25]
+
+def test_imap_size_bounded():
+	consumed = [0]
+	def arguments():
+		for value in range(20):
+			consumed[0] += 1
+			yield (value, 0)
+	with WorkerPool(slow_square, 8) as pool:
+		for index, (_, result, _) in enumerate(pool.imap(arguments(), size=lambda arguments: 100, max_size=250)):
+			assert result == index * index
+			# Two tasks in flight, plus one waiting for room
+			assert consumed[0] <= index + 3
+
+def test_imap_size_larger_than_limit():
+	with WorkerPool(slow_square, 2) as pool:
+		results = list(pool.imap([(2, 0), (3, 0)], size=lambda arguments: 1000, max_size=10))
+	assert [result for _, result, _ in results] == [4, 9]
@@ -7,7 +7,8 @@ import argparse
 from rigor.database import Database
 from rigor.config import RigorDefaultConfiguration
 from rigor.perceptops import PerceptOps
-from rigor.types import Percept, PerceptTag
+from rigor.types import Percept
+from rigor.filters import HasTag, parse
 
 def main():
 	parser = argparse.ArgumentParser(description='Deletes percepts from the database by tag and deletes the percept data files.')
@@ -15,6 +16,7 @@ def main():
 	parser.add_argument('tag', help='Percepts with this tag will be deleted')
 	parser.add_argument('-c', '--config', type=str, default='~/.rigor.ini', help='Path to .rigor.ini config file.  Default: ~/.rigor.ini')
 	parser.add_argument('--keep-percept-data', action='store_true', default=False, help="Don't remove the percept data files")
+	parser.add_argument('-f', '--filter', help='Only delete tagged percepts that also match this filter, e.g. "tag:hard & !property:source=synthetic"')
 	parser.add_argument('-n', '--dryrun', action='store_true', default=False, help="Don't actually delete anything")
 	args = parser.parse_args()
 	config = RigorDefaultConfiguration(args.config)
@@ -25,20 +27,22 @@ def main():
 	if args.dryrun:
 		print('DRY RUN')
 
+	selection = HasTag(args.tag)
+	if args.filter:
+		selection = selection & parse(args.filter)
+
 	with db.get_session() as session:
-		percepts = session.query(Percept).join(PerceptTag).filter(PerceptTag.name == args.tag).all()
-		if len(percepts) == 0:
+		percept_ids = [percept_id for percept_id, in session.query(Percept.id).filter(selection.clause())]
+		if len(percept_ids) == 0:
 			print('No percepts have the tag "{}"'.format(args.tag))
-		for ii, percept in enumerate(percepts):
-			print('{} of {}: deleting percept with id {}'.format(ii, len(percepts), percept.id))
-			if args.dryrun:
-				continue
-			if args.keep_percept_data:
-				# only delete database entry, not percept file
-				session.delete(percept)
-			else:
-				# delete percept data file as well as database entries
-				ops.destroy(percept, session)
+		else:
+			print('Deleting {} percepts'.format(len(percept_ids)))
+		if not args.dryrun and percept_ids:
+			# deletes database entries, then percept data files unless they are kept
+			deleted, unremoved = ops.destroy_many(percept_ids, session, remove_data=not args.keep_percept_data)
+			print('Deleted {} percepts'.format(deleted))
+			for url in unremoved:
+				print('Could not remove data at {}'.format(url))
 
 	if args.dryrun:
 		print('DRY RUN')
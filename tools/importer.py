@@ -7,6 +7,7 @@ import pprint
 import time
 
 import rigor.types
+from rigor.querycache import increment_write_version
 from rigor.config import RigorDefaultConfiguration
 from rigor.database import Database
 import sqlalchemy.orm.exc
@@ -180,6 +181,7 @@ def importToRigor(rowStream, configFn, dryrun=False, verbose=False, overwrite=Fa
 					print('{} complete'.format(ii+1))
 				session.flush()
 				if not dryrun:
+					increment_write_version(session)
 					session.commit()
 
 			yield row
@@ -191,6 +193,7 @@ def importToRigor(rowStream, configFn, dryrun=False, verbose=False, overwrite=Fa
 		else:
 			print('Flushing one more time, then committing...')
 			session.flush()
+			increment_write_version(session)
 
 
 	# with statement is over